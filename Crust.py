@@ -1,569 +1,2612 @@
 ################################################################################
 ###                                 Imports                                  ###
 ################################################################################
+#Modules only some commands need (shutil, re, Crust_Index, Crust_Walker,
+#Crust_Remove, Crust_Complete, Crust_Copy's pool) are imported by those commands so
+#startup stays cheap
 import os
-from datetime import datetime
-import shutil
+import stat
+import time
+import threading
+import codecs
+import functools
+import collections
+from Crust_Copy import copy_fd, copy_file_to_writer, COPY_CHUNK_SIZE, DEFAULT_NUM_WORKERS as DEFAULT_COPY_WORKERS
+from Crust_Metrics import Session_Metrics, read_io_counters, format_seconds
+from Crust_Lexer import lex_line, split_redirects, expand_glob, Syntax_Error, Operator, Glob_Word, PIPE, BACKGROUND, REDIRECT_OUT, REDIRECT_APPEND, REDIRECT_ERR_APPEND, REDIRECTS
+try:
+	import pwd
+	import grp
+except ImportError:
+	#Not available on windows
+	pwd = None
+	grp = None
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Number of entries 'ls' formats per write
+LS_CHUNK_ROWS = 1024
+
+#Output flush policies
+FLUSH_UNBUFFERED = "unbuffered"
+FLUSH_LINE = "line"
+FLUSH_PROMPT = "prompt"
+FLUSH_POLICIES = (FLUSH_UNBUFFERED, FLUSH_LINE, FLUSH_PROMPT)
+DEFAULT_OUTPUT_BUFFER_SIZE = 64 * 1024
+#Failures a command lists one by one before summarizing the rest
+MAX_LISTED_ERRORS = 10
+
+#Background jobs
+DEFAULT_JOB_WORKERS = 4
+#Max number of characters of output a job holds until it is shown
+MAX_JOB_OUTPUT = 16 * 1024 * 1024
+#How often 'fg' shows output of the job it is waiting on (seconds)
+JOB_POLL_INTERVAL = 0.1
+STATUS_KILLED = 137
+
+#Command registry. A target is either the name of a Crust method, a callable
+#taking (crust, cmd_args), or a 'module:function' string whose module is
+#only imported the first time the command is used. Add to it with
+#register_command
+COMMANDS = {
+	'pwd': 'cmd_pwd',
+	'cd': 'cmd_cd',
+	'ls': 'cmd_ls',
+	'cp': 'cmd_cp',
+	'cat': 'cmd_cat',
+	'mv': 'cmd_mv',
+	'mkdir': 'cmd_mkdir',
+	'rmdir': 'cmd_rmdir',
+	'rm': 'cmd_rm',
+	'touch': 'cmd_touch',
+	'locate': 'cmd_locate',
+	'updatedb': 'cmd_updatedb',
+	'time': 'cmd_time',
+	'stats': 'cmd_stats',
+	'profile': 'cmd_profile',
+	'jobs': 'cmd_jobs',
+	'wait': 'cmd_wait',
+	'fg': 'cmd_fg',
+	'kill': 'cmd_kill',
+	'get': 'Crust_Transfer:cmd_get',
+	'put': 'Crust_Transfer:cmd_put',
+	'du': 'Crust_Du:cmd_du',
+}
+
+#Commands that can stream as a stage of a pipeline. Targets are resolved the
+#same way but take (crust, cmd_args, in_chunks)
+STAGE_COMMANDS = {
+	'cat': 'stage_cat',
+	'locate': 'stage_locate',
+	'head': 'stage_head',
+	'tail': 'stage_tail',
+	'wc': 'stage_wc',
+	'grep': 'stage_grep',
+}
+
+#Targets of 'module:function' commands that have already been imported
+RESOLVED_TARGETS = {}
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+@functools.lru_cache(maxsize=1024)
+def user_name(uid):
+	"""
+	PURPOSE: looks up the name of a user
+	ARGS:
+		uid (int): user id
+	RETURNS: (str) user name, or the id if it has no name
+	NOTES: results are cached since a listing usually has few owners
+	"""
+	if pwd is not None:
+		try:
+			return pwd.getpwuid(uid).pw_name
+		except KeyError:
+			pass
+	return str(uid)
+
+################################################################################
+@functools.lru_cache(maxsize=1024)
+def group_name(gid):
+	"""
+	PURPOSE: looks up the name of a group
+	ARGS:
+		gid (int): group id
+	RETURNS: (str) group name, or the id if it has no name
+	NOTES: results are cached since a listing usually has few groups
+	"""
+	if grp is not None:
+		try:
+			return grp.getgrgid(gid).gr_name
+		except KeyError:
+			pass
+	return str(gid)
+
+################################################################################
+def human_readable_size(num_bytes):
+	"""
+	PURPOSE: formats a number of bytes like 'ls -h'
+	ARGS:
+		num_bytes (int): number of bytes
+	RETURNS: (str) size with a unit suffix, ex: '1.5K'
+	NOTES:
+	"""
+	for unit in ["", "K", "M", "G", "T"]:
+		if abs(num_bytes) < 1024.0:
+			break
+		num_bytes /= 1024.0
+	else:
+		unit = "P"
+	return "%.1f%s" % (num_bytes, unit)
+
+################################################################################
+def entry_stat(entry):
+	"""
+	PURPOSE: stats a directory entry, following symlinks when possible
+	ARGS:
+		entry (os.DirEntry): entry to stat
+	RETURNS: (os.stat_result) stat of the entry
+	NOTES: falls back to the link itself for broken symlinks. The result is
+		cached by the entry so this only costs one syscall
+	"""
+	try:
+		return entry.stat()
+	except OSError:
+		return entry.stat(follow_symlinks=False)
+
+################################################################################
+def register_command(name, target, stage_target=None):
+	"""
+	PURPOSE: adds a command to the shell, or replaces one
+	ARGS:
+		name (str): what the user types to run the command
+		target (str or function): Crust method name, function taking
+			(crust, cmd_args), or 'module:function' to import on first use
+		stage_target (str or function): same as target but taking
+			(crust, cmd_args, in_chunks) and returning an iterator of
+			chunks, for commands that can stream in a pipeline
+	RETURNS: none
+	NOTES: the registry is shared by every shell in the process
+	"""
+	COMMANDS[name] = target
+	RESOLVED_TARGETS.pop(target, None)
+	if stage_target is not None:
+		STAGE_COMMANDS[name] = stage_target
+		RESOLVED_TARGETS.pop(stage_target, None)
+
+################################################################################
+def register_plugin_commands(plugin_str):
+	"""
+	PURPOSE: registers commands listed in a string
+	ARGS:
+		plugin_str (str): comma separated 'name=module:function' entries
+	RETURNS: none
+	NOTES: none of the modules are imported until their command is used.
+		Raises ValueError for a malformed entry
+	"""
+	for entry in plugin_str.split(','):
+		entry = entry.strip()
+		if not entry:
+			continue
+		name, sep, target = entry.partition('=')
+		if not sep or ':' not in target:
+			raise ValueError("plugin entry must be 'name=module:function', got '%s'" % entry)
+		register_command(name.strip(), target.strip())
+
+################################################################################
+def resolve_target(target):
+	"""
+	PURPOSE: gets the function behind a 'module:function' target
+	ARGS:
+		target (str or function): registered command target
+	RETURNS: (function) the target itself if it is already callable
+	NOTES: imports the module the first time and caches the function
+	"""
+	if callable(target):
+		return target
+	func = RESOLVED_TARGETS.get(target)
+	if func is None:
+		import importlib
+		module_name, attr = target.split(':', 1)
+		func = getattr(importlib.import_module(module_name), attr)
+		RESOLVED_TARGETS[target] = func
+	return func
+
+################################################################################
+def split_pipeline(cmd):
+	"""
+	PURPOSE: splits a command on its pipes
+	ARGS:
+		cmd (list): commands and arguments separated by PIPE arguments
+	RETURNS: (list) list of commands, empty for a missing command
+	NOTES: a quoted '|' is an argument, not a pipe
+	"""
+	stage_cmds = [[]]
+	for cur_arg in cmd:
+		if cur_arg is PIPE:
+			stage_cmds.append([])
+		else:
+			stage_cmds[-1].append(cur_arg)
+	return stage_cmds
+
+################################################################################
+def iter_text(fh_in):
+	"""
+	PURPOSE: reads a binary file as text in fixed size chunks
+	ARGS:
+		fh_in (file-like object): binary file to read
+	RETURNS: (generator) decoded chunks of text
+	NOTES: uses an incremental UTF-8 decoder so characters split across
+		chunks are decoded correctly
+	"""
+	decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+	while True:
+		chunk = fh_in.read(COPY_CHUNK_SIZE)
+		if not chunk:
+			break
+		text = decoder.decode(chunk)
+		if text:
+			yield text
+	text = decoder.decode(b'', final=True)
+	if text:
+		yield text
+
+################################################################################
+def iter_lines(chunks):
+	"""
+	PURPOSE: splits chunks of text into lines
+	ARGS:
+		chunks (iterable): strings of any size
+	RETURNS: (generator) lines, each ending with a newline except possibly
+		the last one
+	NOTES: only keeps the current partial line in memory
+	"""
+	partial = ""
+	for chunk in chunks:
+		lines = (partial + chunk).split("\n")
+		partial = lines.pop()
+		for line in lines:
+			yield line + "\n"
+	if partial:
+		yield partial
 
 ################################################################################
 ###                                Class Def                                 ###
+################################################################################
+class Job_Killed(Exception):
+	"""
+	Raised in a background job's shell when it writes after being killed
+	"""
+	pass
+
+################################################################################
+class Job:
+	"""
+	Command running in the background with its own buffered output
+	"""
+	############################################################################
+	def __init__(self, job_id, cmd):
+		"""
+		PURPOSE: creates a new Job
+		ARGS:
+			job_id (int): number the job is referred to by
+			cmd (list): command and arguments being run
+		RETURNS: new instance of a Job
+		NOTES: thread safe
+		"""
+		#Save arguments
+		self.job_id = job_id
+		self.cmd = cmd
+
+		#Define properties
+		self.cmd_str = " ".join(cmd)
+		self.lock = threading.Lock()
+		self.output = []
+		self.output_size = 0
+		self.truncated = False
+		self.kill_event = threading.Event()
+		self.done_event = threading.Event()
+		self.future = None
+		self.status = None
+
+	############################################################################
+	def add_output(self, is_err, out_str):
+		"""
+		PURPOSE: buffers output of the job
+		ARGS:
+			is_err (bool): true for error output
+			out_str (str): string to output
+		RETURNS: none
+		NOTES: output past MAX_JOB_OUTPUT characters is dropped
+		"""
+		with self.lock:
+			if self.output_size + len(out_str) > MAX_JOB_OUTPUT:
+				self.truncated = True
+				return
+			self.output.append((is_err, out_str))
+			self.output_size += len(out_str)
+
+	############################################################################
+	def take_output(self):
+		"""
+		PURPOSE: removes everything buffered so far
+		ARGS:
+		RETURNS: (list) (is_err, string) of each write, in order
+		NOTES:
+		"""
+		with self.lock:
+			output = self.output
+			self.output = []
+			self.output_size = 0
+		return output
+
+	############################################################################
+	def state(self):
+		"""
+		PURPOSE: describes how the job is doing
+		ARGS:
+		RETURNS: (str) 'Running', 'Done', 'Exit N' or 'Killed'
+		NOTES:
+		"""
+		if not self.done_event.is_set():
+			return "Running"
+		if self.status == STATUS_KILLED and self.kill_event.is_set():
+			return "Killed"
+		if self.status:
+			return "Exit %d" % self.status
+		return "Done"
+
+################################################################################
+class Job_File:
+	"""
+	Text file-like object that buffers one stream of a job's output
+	"""
+	############################################################################
+	def __init__(self, job, is_err):
+		"""
+		PURPOSE: creates a new Job_File
+		ARGS:
+			job (Job): job to buffer the output of
+			is_err (bool): true if this is the job's error output
+		RETURNS: new instance of a Job_File
+		NOTES:
+		"""
+		self.job = job
+		self.is_err = is_err
+
+	############################################################################
+	def write(self, out_str):
+		self.job.add_output(self.is_err, out_str)
+		return len(out_str)
+
+	############################################################################
+	def flush(self):
+		pass
+
+################################################################################
+class Capture_File:
+	"""
+	Text file-like object that collects what is written to it
+	"""
+	############################################################################
+	def __init__(self, chunks):
+		"""
+		PURPOSE: creates a new Capture_File
+		ARGS:
+			chunks (list): list that written strings are appended to
+		RETURNS: new instance of a Capture_File
+		NOTES:
+		"""
+		self.chunks = chunks
+
+	############################################################################
+	def write(self, out_str):
+		self.chunks.append(out_str)
+		return len(out_str)
+
+	############################################################################
+	def flush(self):
+		pass
+
+################################################################################
+class Output_Buffer:
+	"""
+	Buffers the output and error output of a shell
+	"""
+	############################################################################
+	def __init__(self, policy=FLUSH_UNBUFFERED, buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE):
+		"""
+		PURPOSE: creates a new Output_Buffer
+		ARGS:
+			policy (str): when to flush, one of FLUSH_POLICIES
+				'unbuffered': after every write
+				'line': after every write that contains a newline
+				'prompt': only when the buffer is full, at the end of a
+					command and before the prompt
+			buffer_size (int): number of buffered characters that forces a
+				flush
+		RETURNS: new instance of an Output_Buffer
+		NOTES: raises ValueError for an unknown policy
+		"""
+		if policy not in FLUSH_POLICIES:
+			raise ValueError("unknown flush policy '%s'" % policy)
+
+		#Save arguments
+		self.policy = policy
+		self.buffer_size = buffer_size
+
+		#Define properties
+		self.stream = None
+		self.chunks = []
+		self.size = 0
+
+	############################################################################
+	def write(self, stream, out_str):
+		"""
+		PURPOSE: buffers output for a stream
+		ARGS:
+			stream (file-like object): where the output is going
+			out_str (str): string to output
+		RETURNS: none
+		NOTES: only one stream is buffered at a time. Writing to a different
+			stream flushes the other one first so output and error output
+			keep their order, whether or not they go to the same place
+		"""
+		if not out_str:
+			return
+		if stream is not self.stream:
+			self.flush()
+			self.stream = stream
+		self.chunks.append(out_str)
+		self.size += len(out_str)
+
+		if self.policy == FLUSH_UNBUFFERED or self.size >= self.buffer_size:
+			self.flush()
+		elif self.policy == FLUSH_LINE and "\n" in out_str:
+			self.flush()
+
+	############################################################################
+	def flush(self):
+		"""
+		PURPOSE: writes out and flushes everything buffered
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		if self.chunks:
+			if len(self.chunks) == 1:
+				out_str = self.chunks[0]
+			else:
+				out_str = "".join(self.chunks)
+			self.chunks = []
+			self.size = 0
+			self.stream.write(out_str)
+		if self.stream is not None:
+			self.stream.flush()
+			self.stream = None
+
 ################################################################################
 class Crust:
 	"""
 	Custom shell/terminal
 	"""
 	############################################################################
-	def __init__(self, fin, fout, ferr):
+	def __init__(self, fin, fout, ferr, cwd=None, flush_policy=FLUSH_UNBUFFERED, buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE):
 		"""
 		PURPOSE: creates a new Custom_Shell
 		ARGS:
 			fin (file-like object): where input is being read from
 			fout (file-like object): where output is being written to
 			ferr (file-like object): where error output is being written to
+			cwd (str): working directory of the shell, None for the process's
+				working directory
+			flush_policy (str): when output is flushed, see Output_Buffer
+			buffer_size (int): max number of characters of buffered output
 		RETURNS: new instance of a Custom_Shell
-		NOTES:
+		NOTES: the shell keeps its own working directory and never calls
+			os.chdir so several shells can run in one process
+		"""
+		#Save arguments
+		self.flush_policy = flush_policy
+		self.buffer_size = buffer_size
+
+		#Define properties
+		self.jobs = collections.OrderedDict()
+		self.job_pool = None
+		self.reset(fin, fout, ferr, cwd)
+
+	############################################################################
+	def reset(self, fin, fout, ferr, cwd=None):
+		"""
+		PURPOSE: puts the shell back in the state of a new one so it can be
+			reused
+		ARGS:
+			fin (file-like object): where input is being read from
+			fout (file-like object): where output is being written to
+			ferr (file-like object): where error output is being written to
+			cwd (str): working directory of the shell, None for the process's
+				working directory
+		RETURNS: none
+		NOTES: background jobs are killed. Must not be called while the shell
+			is running a command
 		"""
+		self.close_jobs()
+
 		#Save arguments
 		self.fin = fin
 		self.fout = fout
 		self.ferr = ferr
+		if cwd is None:
+			cwd = os.getcwd()
+		self.cwd = os.path.abspath(cwd)
 
 		#Define properties
 		self.keep_going = False
+		self.locate_db = None
+		self.output = Output_Buffer(self.flush_policy, self.buffer_size)
+		self.num_errors = 0
+		self.last_status = 0
+		self.exit_status = None
+		self.metrics = Session_Metrics()
+		self.bytes_out = 0
+		self.profiler = None
+		self.profile_data = None
+		self.kill_event = None
+		self.listing_cache = None
+		#Directory sizes kept between runs of 'du', see Crust_Du
+		self.size_cache = None
+		#Set by servers whose clients can send and take files, see
+		#Crust_Transfer
+		self.transfer_link = None
+
+	############################################################################
+	def write_out_and_flush(self, out_str):
+		"""
+		PURPOSE: writes to fout and flushes the buffer
+		ARGS:
+			out_str (str): string to output
+		RETURNS: none
+		NOTES: when the flush actually happens depends on the flush policy.
+			Raises Job_Killed if this is the shell of a killed job
+		"""
+		if self.kill_event is not None and self.kill_event.is_set():
+			raise Job_Killed()
+		self.bytes_out += len(out_str)
+		self.output.write(self.fout, out_str)
+
+	############################################################################
+	def write_err_and_flush(self, out_str):
+		"""
+		PURPOSE: writes to ferr and flushes the buffer
+		ARGS:
+			out_str (str): string to output
+		RETURNS: none
+		NOTES: when the flush actually happens depends on the flush policy.
+			Any error output makes the running command's exit status 1.
+			Raises Job_Killed if this is the shell of a killed job
+		"""
+		if self.kill_event is not None and self.kill_event.is_set():
+			raise Job_Killed()
+		self.num_errors += 1
+		self.bytes_out += len(out_str)
+		self.output.write(self.ferr, out_str)
+
+	############################################################################
+	def flush_output(self):
+		"""
+		PURPOSE: flushes any buffered output and error output
+		ARGS:
+		RETURNS: none
+		NOTES: called at the end of every command
+		"""
+		self.output.flush()
+
+	############################################################################
+	def write_prompt(self, prompt_str):
+		"""
+		PURPOSE: writes the prompt to fout and flushes the buffer
+		ARGS:
+			prompt_str (str): prompt to show
+		RETURNS: none
+		NOTES: uses fout's write_prompt if it has one so a remote client can
+			tell where the output of a command ends
+		"""
+		self.flush_output()
+		if hasattr(self.fout, "write_prompt"):
+			self.fout.write_prompt(prompt_str)
+		else:
+			self.write_out_and_flush(prompt_str)
+			self.flush_output()
+
+	############################################################################
+	def abs_path(self, path):
+		"""
+		PURPOSE: resolves a path against the shell's working directory
+		ARGS:
+			path (str): absolute or relative path, may start with '~'
+		RETURNS: (str) absolute path
+		NOTES: every command must go through this instead of relying on the
+			process's working directory
+		"""
+		return os.path.join(self.cwd, os.path.expanduser(path))
+
+	############################################################################
+	def fs_root(self):
+		"""
+		PURPOSE: gets the root of the filesystem the shell is in
+		ARGS:
+		RETURNS: (str) '/' or the drive root on windows
+		NOTES:
+		"""
+		return self.cwd.split(os.path.sep)[0] + os.sep
+
+	############################################################################
+	def parse_input(self, user_input):
+		"""
+		PURPOSE: parses the raw string of user input. Splits multiple commands 
+			up and tokenizes each command
+		ARGS:
+			user_input (str): user input str
+		RETURNS: (list) list of commands, where each command is a list of 
+			strings representing command and argument
+		NOTES: see Crust_Lexer.lex_line. Commands of a pipeline are separated
+			by a PIPE argument, a background command ends with a BACKGROUND
+			argument and redirections stay in the command until it runs, as
+			do globs. Raises Syntax_Error for a line that cannot be parsed
+		"""
+		return [list(cmd) for cmd in lex_line(user_input)]
+
+	############################################################################
+	def complete(self, text):
+		"""
+		PURPOSE: finds the ways the word before the cursor can be completed
+		ARGS:
+			text (str): line of input up to the cursor
+		RETURNS: (tuple) number of characters of the word being completed, and
+			sorted list of candidates to replace it with
+		NOTES: completes command names and paths from the working directory.
+			Directory listings are cached for the session and used again
+			until the directory changes. Safe to call from another thread
+			while a command runs
+		"""
+		from Crust_Complete import complete, Listing_Cache
+		if self.listing_cache is None:
+			self.listing_cache = Listing_Cache()
+		command_names = list(COMMANDS) + list(STAGE_COMMANDS) + ["exit"]
+		return complete(text, self.cwd, command_names, self.listing_cache)
+
+	############################################################################
+	def run(self):
+		"""
+		PURPOSE: main loop of the shell that waits for input, does something, 
+			and then gives you the output
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		self.keep_going = True
+
+		try:
+			self.run_loop()
+		finally:
+			self.close_jobs()
+
+	############################################################################
+	def run_loop(self):
+		"""
+		PURPOSE: reads and runs commands until 'exit' or end of input
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		while self.keep_going:
+			#Wait for user input
+			self.show_prompt()
+			user_input = self.fin.readline()
+			if not user_input:
+				#Input was closed
+				self.keep_going = False
+				break
+			self.run_line(user_input)
+
+	############################################################################
+	async def run_async(self, fin, executor=None):
+		"""
+		PURPOSE: main loop of the shell for running in an asyncio event loop
+		ARGS:
+			fin (object): where input is read from, anything with a readline()
+				coroutine returning a line as str or bytes, ex: an
+				asyncio.StreamReader
+			executor (concurrent.futures.Executor): where commands are run,
+				None for the event loop's default executor
+		RETURNS: none
+		NOTES: waiting for input does not hold a thread so idle shells cost
+			next to nothing. Commands block on the filesystem so they run
+			in the executor, one at a time. fout and ferr must be safe to
+			write to from the executor's threads and from the loop, see
+			Crust_Async
+		"""
+		import asyncio
+		loop = asyncio.get_running_loop()
+		self.keep_going = True
+
+		try:
+			#Nothing to wait on before the first prompt so it is sent from
+			#the loop, a busy executor cannot delay it
+			self.show_prompt()
+			while self.keep_going:
+				user_input = await fin.readline()
+				if isinstance(user_input, bytes):
+					user_input = user_input.decode("utf-8", "surrogateescape")
+				if not user_input:
+					#Input was closed
+					self.keep_going = False
+					break
+				#One trip to the executor per line, prompt included
+				await loop.run_in_executor(executor, self.run_line_and_prompt, user_input)
+		finally:
+			self.close_jobs()
+
+	############################################################################
+	def show_prompt(self):
+		"""
+		PURPOSE: reports finished background jobs and writes the prompt
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		if self.jobs:
+			self.report_jobs()
+		dir_to_show = os.path.basename(self.cwd)
+		self.write_prompt("(crust) %s>" % dir_to_show)
+
+	############################################################################
+	def run_line_and_prompt(self, user_input):
+		"""
+		PURPOSE: runs a line of user input and prompts for the next one
+		ARGS:
+			user_input (str): line of user input
+		RETURNS: none
+		NOTES: no prompt is written after 'exit'
+		"""
+		self.run_line(user_input)
+		if self.keep_going:
+			self.show_prompt()
+
+	############################################################################
+	def run_line(self, user_input):
+		"""
+		PURPOSE: runs every command on a line of user input
+		ARGS:
+			user_input (str): line of user input
+		RETURNS: none
+		NOTES: may write to fout and ferr. Clears keep_going on 'exit'
+		"""
+		#Parse user input
+		try:
+			cmds = self.parse_input(user_input)
+		except Syntax_Error as e:
+			self.write_err_and_flush("%s\n" % e)
+			self.flush_output()
+			self.last_status = 2
+			return
+
+		#Execute user input
+		for cmd in cmds:
+			if len(cmd) >= 1:
+				actual_cmd = cmd[0]
+				cmd_args = cmd[1:]
+
+				#Switch on cmd
+				if actual_cmd == "exit":
+					self.keep_going = False
+					self.exit_status = self.parse_exit_status(cmd_args)
+					break
+				self.run_command(cmd)
+
+	############################################################################
+	def run_script(self, lines, stop_on_error=False, report_status=False):
+		"""
+		PURPOSE: runs lines of commands without prompting
+		ARGS:
+			lines (iterable): lines of commands, ex: an open script file
+			stop_on_error (bool): true to stop at the first command that fails
+			report_status (bool): true to write each command's exit status to
+				ferr
+		RETURNS: (int) exit status of the last command run, or the one given
+			to 'exit'
+		NOTES: may write to fout and ferr. Background jobs still running at
+			the end are waited for so none of their output is lost
+		"""
+		try:
+			for user_input in lines:
+				try:
+					cmds = self.parse_input(user_input)
+				except Syntax_Error as e:
+					self.write_err_and_flush("%s\n" % e)
+					self.flush_output()
+					self.last_status = 2
+					if stop_on_error:
+						return self.last_status
+					continue
+				for cmd in cmds:
+					if len(cmd) < 1:
+						continue
+					if cmd[0] == "exit":
+						self.exit_status = self.parse_exit_status(cmd[1:])
+						return self.exit_status
+					status = self.run_command(cmd)
+					if report_status:
+						self.write_err_and_flush("[%d] %s\n" % (status, " ".join(cmd)))
+						self.flush_output()
+					if status and stop_on_error:
+						return status
+					if self.jobs:
+						self.report_jobs()
+			return self.last_status
+		finally:
+			if self.jobs:
+				self.cmd_wait([])
+				self.flush_output()
+			self.close_jobs()
+
+	############################################################################
+	def parse_exit_status(self, cmd_args):
+		"""
+		PURPOSE: gets the exit status given to 'exit'
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: (int) status given, or the status of the last command
+		NOTES:
+		"""
+		if cmd_args:
+			try:
+				return int(cmd_args[0]) & 0xFF
+			except ValueError:
+				self.write_err_and_flush("exit: %s: numeric argument required\n" % cmd_args[0])
+				return 2
+		return self.last_status
+
+	############################################################################
+	def run_command(self, cmd):
+		"""
+		PURPOSE: runs a single command or pipeline and works out its status
+		ARGS:
+			cmd (list): command and arguments from parse_input, may contain
+				pipes and redirections
+		RETURNS: (int) exit status, 0 on success
+		NOTES: may write to fout and ferr. A command fails if it returns a
+			non zero status, raises or writes any error output. Its wall
+			time, cpu time, output and I/O are recorded in self.metrics. A
+			command ending in '&' is started as a background job. Globs are
+			expanded and redirections opened here, so they happen in the
+			working directory the command runs in
+		"""
+		if cmd and cmd[-1] is BACKGROUND:
+			return self.start_job(cmd[:-1])
+		bytes_out = self.bytes_out
+		io_start = read_io_counters()
+		cpu_start = time.thread_time()
+		wall_start = time.perf_counter()
+		profiler = self.profiler
+		if profiler is not None:
+			profiler.enable()
+		try:
+			status = self.run_unrecorded(cmd)
+		finally:
+			if profiler is not None:
+				profiler.disable()
+		self.flush_output()
+		self.last_status = status
+
+		#Record metrics, pipelines are recorded under all of their commands
+		wall = time.perf_counter() - wall_start
+		cpu = time.thread_time() - cpu_start
+		io_end = read_io_counters()
+		io = dict((name, io_end[name] - io_start.get(name, 0)) for name in io_end)
+		cmd_name = "|".join(stage_cmd[0] for stage_cmd in split_pipeline(cmd) if stage_cmd)
+		self.metrics.record(cmd_name, status, wall, cpu, self.bytes_out - bytes_out, io)
+		return status
+
+	############################################################################
+	def run_unrecorded(self, cmd):
+		"""
+		PURPOSE: runs a single command or pipeline without recording it
+		ARGS:
+			cmd (list): command and arguments from parse_input, may contain
+				pipes and redirections
+		RETURNS: (int) exit status, 0 on success
+		NOTES: may write to fout and ferr. The part of run_command that
+			commands running another command, ex: 'time', use so it is
+			neither recorded twice nor cuts short a profile
+		"""
+		num_errors = self.num_errors
+		status = 0
+		try:
+			cmd_args, redirects = split_redirects(self.expand_globs(cmd))
+			redirected = self.open_redirects(redirects)
+			if redirected is not None:
+				try:
+					if len(split_pipeline(cmd_args)) > 1:
+						self.run_pipeline(cmd_args)
+					elif cmd_args:
+						status = self.execute_command(cmd_args[0], cmd_args[1:]) or 0
+				finally:
+					self.close_redirects(redirected)
+		except Job_Killed:
+			raise
+		except Exception as e:
+			self.write_err_and_flush("Unknown error occurred: %s\n" % type(e))
+			self.write_err_and_flush(str(e))
+		if not status and self.num_errors != num_errors:
+			status = 1
+		return status
+
+	############################################################################
+	def expand_globs(self, cmd):
+		"""
+		PURPOSE: expands the glob arguments of a command
+		ARGS:
+			cmd (list): command and arguments from parse_input
+		RETURNS: (list) the command with every Glob_Word replaced by the
+			paths it matches, or by itself if it matches nothing
+		NOTES: redirection targets are never expanded
+		"""
+		expanded = []
+		for ii, cur_arg in enumerate(cmd):
+			if isinstance(cur_arg, Glob_Word) and not (ii > 0 and isinstance(cmd[ii - 1], Operator) and cmd[ii - 1] in REDIRECTS):
+				matches = expand_glob(os.path.expanduser(cur_arg.pattern), self.cwd)
+				if matches:
+					expanded.extend(matches)
+					continue
+			expanded.append(cur_arg)
+		return expanded
+
+	############################################################################
+	def open_redirects(self, redirects):
+		"""
+		PURPOSE: points fout and ferr at the files a command redirects to
+		ARGS:
+			redirects (list): (Operator, target path) of each redirection
+		RETURNS: (tuple) fout, ferr and the files opened, to give to
+			close_redirects. None if a file could not be opened
+		NOTES: may write to ferr. Files are text in UTF-8, names that came
+			from os as surrogate escapes are written as their original bytes
+		"""
+		redirected = (self.fout, self.ferr, [])
+		if not redirects:
+			return redirected
+		self.flush_output()
+		for op, target in redirects:
+			mode = 'a' if op in (REDIRECT_APPEND, REDIRECT_ERR_APPEND) else 'w'
+			try:
+				fh = open(self.abs_path(target), mode, encoding="utf-8", errors="surrogateescape", newline="")
+			except OSError as e:
+				self.write_err_and_flush("Could not write to file '%s'\n" % target)
+				self.close_redirects(redirected)
+				return None
+			redirected[2].append(fh)
+			if op in (REDIRECT_OUT, REDIRECT_APPEND):
+				self.fout = fh
+			else:
+				self.ferr = fh
+		return redirected
+
+	############################################################################
+	def close_redirects(self, redirected):
+		"""
+		PURPOSE: closes the files of a command's redirections and puts fout
+			and ferr back
+		ARGS:
+			redirected (tuple): from open_redirects
+		RETURNS: none
+		NOTES: may write to ferr
+		"""
+		fout, ferr, files = redirected
+		if not files:
+			return
+		try:
+			self.flush_output()
+		finally:
+			self.fout = fout
+			self.ferr = ferr
+			for fh in files:
+				try:
+					fh.close()
+				except OSError as e:
+					self.write_err_and_flush("Could not write to file '%s': %s\n" % (fh.name, e.strerror or e))
+
+	############################################################################
+	def execute_command(self, actual_cmd, cmd_args):
+		"""
+		PURPOSE: runs a single command
+		ARGS:
+			actual_cmd (str): name of the command
+			cmd_args (list): list of strings representing arguments
+		RETURNS: (int) exit status if the command has one, otherwise None
+		NOTES: may write to fout and ferr. Commands are looked up in COMMANDS
+		"""
+		target = COMMANDS.get(actual_cmd)
+		if target is None:
+			if actual_cmd in STAGE_COMMANDS:
+				#Filters read their file arguments when not in a pipeline
+				self.write_chunks(self.open_stage(actual_cmd, cmd_args, None))
+				return None
+			err_msg = "%s: command not found\n" % actual_cmd
+			self.write_err_and_flush(err_msg)
+			return 127
+		if isinstance(target, str) and ':' not in target:
+			return getattr(self, target)(cmd_args)
+		return resolve_target(target)(self, cmd_args)
+
+	############################################################################
+	def cmd_pwd(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'pwd' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		cwd = self.cwd + "\n"
+		self.write_out_and_flush(cwd)
+
+	############################################################################
+	def cmd_cd(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'cd' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		if len(cmd_args) < 1:
+			#No arguments were given so find home directory and go there
+			cd_arg = os.path.expanduser('~')
+		else:
+			cd_arg = cmd_args[0]
+
+		new_cwd = os.path.normpath(self.abs_path(cd_arg))
+		if not os.path.exists(new_cwd):
+			self.write_err_and_flush("cd: %s: No such file or directory\n" % cd_arg)
+		elif not os.path.isdir(new_cwd):
+			self.write_err_and_flush("cd: %s: Not a directory\n" % cd_arg)
+		elif not os.access(new_cwd, os.X_OK):
+			self.write_err_and_flush("cd: %s: Permission denied\n" % cd_arg)
+		else:
+			self.cwd = new_cwd
+
+	############################################################################
+	def cmd_ls(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'ls' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. Each entry is stat'ed at most once
+			and output is written in chunks of LS_CHUNK_ROWS entries
+		"""
+		show_hidden_files = False
+		long_listing = False
+		human_readable = False
+		sort_key = None
+		reverse_sort = False
+
+		#Find args that start with dash
+		path_arg = ""
+		dash_args = []
+		for cur_arg in cmd_args:
+			if cur_arg.startswith("-"):
+				dash_args.append(cur_arg)
+			elif path_arg == "":
+				path_arg = cur_arg
+
+		#Interpet modifiers (args that start with dash)
+		for dash_arg in dash_args:
+			if dash_arg.startswith("--"):
+				cur_arg = dash_arg[2:]
+				if cur_arg == "all":
+					show_hidden_files = True
+				else:
+					self.write_err_and_flush("ls: unknown option --%s\n" % cur_arg)
+					return
+			else:
+				cur_arg = dash_arg[1:]
+				#Split into single letters
+				for cur_letter in cur_arg:
+					if cur_letter == 'a':
+						show_hidden_files = True
+					elif cur_letter == 'l':
+						long_listing = True
+					elif cur_letter == 'h':
+						human_readable = True
+					elif cur_letter == 't':
+						sort_key = 'mtime'
+					elif cur_letter == 'S':
+						sort_key = 'size'
+					elif cur_letter == 'r':
+						reverse_sort = True
+					else:
+						self.write_err_and_flush("ls: unknown option -%s\n" % cur_letter)
+						return
+
+		if path_arg == "":
+			#No path argument was given so use current directory
+			path_arg = "."
+
+		#Read directory, hiding hidden files unless asked not to
+		try:
+			with os.scandir(self.abs_path(path_arg)) as it:
+				if show_hidden_files:
+					entries = list(it)
+				else:
+					entries = [entry for entry in it if not entry.name.startswith('.')]
+		except FileNotFoundError as e:
+			self.write_err_and_flush("ls: %s: No such directory\n" % path_arg)
+			return
+		except NotADirectoryError as e:
+			self.write_err_and_flush("ls: %s: Not a directory\n" % path_arg)
+			return
+		except PermissionError as e:
+			self.write_err_and_flush("ls: %s: Permission denied\n" % path_arg)
+			return
+
+		#Stat each entry once, only if something needs it
+		if long_listing or sort_key:
+			listing = [(entry.name, entry_stat(entry)) for entry in entries]
+		else:
+			listing = [(entry.name, None) for entry in entries]
+
+		#Sort by name first so ties keep a stable order
+		listing.sort(key=lambda item: item[0])
+		if sort_key == 'mtime':
+			listing.sort(key=lambda item: item[1].st_mtime, reverse=True)
+		elif sort_key == 'size':
+			listing.sort(key=lambda item: item[1].st_size, reverse=True)
+		if reverse_sort:
+			listing.reverse()
+
+		if not long_listing:
+			for ii in range(0, len(listing), LS_CHUNK_ROWS):
+				names = [item[0] for item in listing[ii:ii + LS_CHUNK_ROWS]]
+				if ii + LS_CHUNK_ROWS >= len(listing):
+					self.write_out_and_flush(" ".join(names) + "\n")
+				else:
+					self.write_out_and_flush(" ".join(names) + " ")
+			if not listing:
+				self.write_out_and_flush("\n")
+			return
+
+		#Long listing format
+		ret_list = [('Permissions', 'Num Links', 'Owner', 'Group', 'Bytes', 'Modification Date', 'File')]
+		for cur_file, stat_res in listing:
+			if human_readable:
+				file_size = human_readable_size(stat_res.st_size)
+			else:
+				file_size = str(stat_res.st_size)
+			ret_list.append((
+				stat.filemode(stat_res.st_mode),
+				str(stat_res.st_nlink),
+				user_name(stat_res.st_uid),
+				group_name(stat_res.st_gid),
+				file_size,
+				time.strftime("%b %d %H:%M", time.localtime(stat_res.st_mtime)),
+				cur_file,
+			))
+
+		#Pad every column but the last to its widest value
+		col_lens = [max(len(row[col]) for row in ret_list) for col in range(6)]
+		row_fmt = " ".join("%%-%ds" % col_len for col_len in col_lens) + " %s\n"
+		for ii in range(0, len(ret_list), LS_CHUNK_ROWS):
+			self.write_out_and_flush("".join(row_fmt % row for row in ret_list[ii:ii + LS_CHUNK_ROWS]))
+
+	############################################################################
+	def cmd_cp(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'cp' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. '-r' copies directories, '-p'
+			preserves mode, owner and timestamps and '-j N' sets how many
+			files are copied at once
+		"""
+		recursive = False
+		preserve = False
+		num_workers = DEFAULT_COPY_WORKERS
+
+		#Split dash args from paths
+		paths = []
+		ii = 0
+		while ii < len(cmd_args):
+			cur_arg = cmd_args[ii]
+			if cur_arg.startswith("-") and len(cur_arg) > 1:
+				for jj in range(1, len(cur_arg)):
+					cur_letter = cur_arg[jj]
+					if cur_letter in ('r', 'R'):
+						recursive = True
+					elif cur_letter == 'p':
+						preserve = True
+					elif cur_letter == 'j':
+						#Number of workers is the rest of this arg or the next arg
+						value = cur_arg[jj + 1:]
+						if not value:
+							ii += 1
+							value = cmd_args[ii] if ii < len(cmd_args) else ""
+						try:
+							num_workers = int(value)
+						except ValueError:
+							self.write_err_and_flush("cp: invalid number of workers '%s'\n" % value)
+							return
+						break
+					else:
+						self.write_err_and_flush("cp: unknown option -%s\n" % cur_letter)
+						return
+			else:
+				paths.append(cur_arg)
+			ii += 1
+
+		if len(paths) < 2:
+			#No arguments were given
+			self.write_err_and_flush("cp: requires at least 2 arguments\n")
+			return
+
+		sources = [self.abs_path(path) for path in paths[:-1]]
+		target = self.abs_path(paths[-1])
+		if len(sources) > 1 and not os.path.isdir(target):
+			self.write_err_and_flush("cp: '%s' needs to be a directory\n" % target)
+			return
+
+		#Work out where each source goes before copying anything
+		pairs = []
+		for src in sources:
+			if not os.path.lexists(src):
+				self.write_err_and_flush("cp: '%s': No such file or directory\n" % src)
+				return
+			if os.path.isdir(src) and not recursive:
+				self.write_err_and_flush("cp: '%s' is a directory (use -r)\n" % src)
+				return
+			if os.path.isdir(target):
+				dst = os.path.join(target, os.path.basename(os.path.normpath(src)))
+			else:
+				dst = target
+			if os.path.exists(dst) and os.path.samefile(src, dst):
+				self.write_err_and_flush("cp: '%s' and '%s' are the same file\n" % (src, dst))
+				return
+			if os.path.isdir(src):
+				real_src = os.path.realpath(src)
+				if os.path.realpath(dst).startswith(real_src + os.sep):
+					self.write_err_and_flush("cp: cannot copy '%s' into itself\n" % src)
+					return
+			pairs.append((src, dst))
+
+		from Crust_Copy import Copier
+		copier = Copier(num_workers, preserve)
+		copier.copy(pairs)
+		for path, e in copier.errors:
+			if isinstance(e, PermissionError):
+				self.write_err_and_flush("cp: '%s': Permission denied\n" % path)
+			elif isinstance(e, FileNotFoundError):
+				self.write_err_and_flush("cp: '%s': No such file or directory\n" % path)
+			else:
+				self.write_err_and_flush("cp: '%s': %s\n" % (path, e.strerror or e))
+
+	############################################################################
+	def cmd_cat(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'cat' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. Files are streamed in binary so
+			memory use does not depend on their size, and are copied inside
+			the kernel when the destination has a file descriptor, as it
+			does when redirected to a file
+		"""
+		if not cmd_args:
+			#No arguments given
+			self.write_err_and_flush("cat: requires at least 1 argument\n")
+			return
+
+		self.cat_files(cmd_args, self.out_fileno())
+
+	############################################################################
+	def out_fileno(self):
+		"""
+		PURPOSE: gets the file descriptor behind fout
+		ARGS:
+		RETURNS: (int) file descriptor, None if fout does not have one
+		NOTES: flushes fout first so raw writes to the descriptor stay in order
+		"""
+		try:
+			fd = self.fout.fileno()
+		except (AttributeError, OSError, ValueError):
+			#io.UnsupportedOperation is an OSError and a ValueError
+			return None
+		self.flush_output()
+		self.fout.flush()
+		return fd
+
+	############################################################################
+	def out_bytes_writer(self):
+		"""
+		PURPOSE: gets a function that writes bytes straight to fout
+		ARGS:
+		RETURNS: (function) fout's write_bytes, None if fout only takes text
+		NOTES: flushes buffered output first so the bytes stay in order
+		"""
+		write_bytes = getattr(self.fout, "write_bytes", None)
+		if write_bytes is not None:
+			self.flush_output()
+		return write_bytes
+
+	############################################################################
+	def cat_files(self, files_to_cat, dst_fd=None):
+		"""
+		PURPOSE: streams files to a file descriptor or to fout
+		ARGS:
+			files_to_cat (list): paths of the files to stream
+			dst_fd (int): file descriptor to copy to, None to write to fout
+		RETURNS: none
+		NOTES: may write to ferr. A file that cannot be read is reported and
+			skipped
+		"""
+		dst_stat = None
+		write_bytes = None
+		if dst_fd is not None:
+			dst_stat = os.fstat(dst_fd)
+		else:
+			write_bytes = self.out_bytes_writer()
+
+		for cur_arg in files_to_cat:
+			cur_file = self.abs_path(cur_arg)
+			try:
+				fh_in = open(cur_file, 'rb', buffering=0)
+			except FileNotFoundError as e:
+				self.write_err_and_flush("Could not find file '%s'\n" % cur_arg)
+				continue
+			except IsADirectoryError as e:
+				self.write_err_and_flush("cat: %s: Is a directory\n" % cur_arg)
+				continue
+			except PermissionError as e:
+				self.write_err_and_flush("cat: %s: Permission denied\n" % cur_arg)
+				continue
+
+			with fh_in:
+				if dst_fd is not None:
+					src_stat = os.fstat(fh_in.fileno())
+					if stat.S_ISREG(dst_stat.st_mode) and (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+						self.write_err_and_flush("cat: %s: input file is output file\n" % cur_arg)
+						continue
+					self.bytes_out += copy_fd(fh_in.fileno(), dst_fd)
+				elif write_bytes is not None:
+					#Remote sessions take the file as is, never decoded
+					self.bytes_out += copy_file_to_writer(fh_in, write_bytes)
+				else:
+					#No descriptor to copy to so decode in chunks for fout
+					self.write_chunks(iter_text(fh_in))
+
+	############################################################################
+	def cmd_mv(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'mv' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		if len(cmd_args) < 2:
+			#No arguments were given
+			self.write_err_and_flush("mv: requires at least 2 arguments\n")
+			return
+		else:
+			import shutil
+			try:
+				shutil.move(self.abs_path(cmd_args[0]), self.abs_path(cmd_args[1]))
+			except shutil.SameFileError as e:
+				self.write_err_and_flush("mv: '%s' and '%s' are the same file\n" % (cmd_args[0], cmd_args[1]))
+			except PermissionError as e:
+				self.write_err_and_flush("mv: Permission denied\n")
+			except FileNotFoundError as e:
+				self.write_err_and_flush("mv: No such file or directory\n")
+
+	############################################################################
+	def cmd_mkdir(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'mkdir' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		if len(cmd_args) < 1:
+			#No arguments were given
+			self.write_err_and_flush("mkdir: requires 1 argument\n")
+			return
+		try:
+			os.makedirs(self.abs_path(cmd_args[0]))
+		except Exception as e:
+			self.write_err_and_flush("Could not make directory '%s'\n" % cmd_args[0])
+
+	############################################################################
+	def cmd_rmdir(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'rmdir' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. Removes directories along with
+			everything in them, see remove_paths
+		"""
+		self.remove_paths("rmdir", cmd_args, dirs_only=True)
+
+	############################################################################
+	def cmd_rm(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'rm' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. Directories are removed along with
+			everything in them, see remove_paths
+		"""
+		self.remove_paths("rm", cmd_args, dirs_only=False)
+
+	############################################################################
+	def remove_paths(self, cmd_name, cmd_args, dirs_only):
+		"""
+		PURPOSE: parses the arguments of 'rm' or 'rmdir' and removes the paths
+		ARGS:
+			cmd_name (str): name of the command, for messages
+			cmd_args (list): list of strings representing arguments
+			dirs_only (bool): true to refuse to remove anything but directories
+		RETURNS: none
+		NOTES: may write to fout and ferr. Options are '-n'/'--dry-run' to
+			only count what would be removed, '-f' to ignore missing paths,
+			'-v' to always report totals and '-j N' for how many directories
+			are emptied at once. '-r' is accepted for habit's sake, trees are
+			always removed. Progress is reported while large trees are
+			removed and every failure is reported at the end instead of
+			stopping the removal
+		"""
+		from Crust_Remove import Remover, DEFAULT_NUM_WORKERS
+		dry_run = False
+		force = False
+		verbose = False
+		num_workers = DEFAULT_NUM_WORKERS
+
+		#Split dash args from paths
+		targets = []
+		ii = 0
+		while ii < len(cmd_args):
+			cur_arg = cmd_args[ii]
+			if cur_arg == "--dry-run":
+				dry_run = True
+			elif cur_arg.startswith("-") and len(cur_arg) > 1:
+				for jj in range(1, len(cur_arg)):
+					cur_letter = cur_arg[jj]
+					if cur_letter == 'n':
+						dry_run = True
+					elif cur_letter == 'f':
+						force = True
+					elif cur_letter == 'v':
+						verbose = True
+					elif cur_letter in ('r', 'R'):
+						pass
+					elif cur_letter == 'j':
+						#Number of workers is the rest of this arg or the next arg
+						value = cur_arg[jj + 1:]
+						if not value:
+							ii += 1
+							value = cmd_args[ii] if ii < len(cmd_args) else ""
+						try:
+							num_workers = int(value)
+						except ValueError:
+							self.write_err_and_flush("%s: invalid number of workers '%s'\n" % (cmd_name, value))
+							return
+						break
+					else:
+						self.write_err_and_flush("%s: unknown option -%s\n" % (cmd_name, cur_letter))
+						return
+			else:
+				targets.append(cur_arg)
+			ii += 1
+
+		if len(targets) < 1:
+			#No arguments were given
+			self.write_err_and_flush("%s: requires at least 1 argument\n" % cmd_name)
+			return
+
+		paths = []
+		for target in targets:
+			path = self.abs_path(target)
+			if not os.path.lexists(path):
+				if not force:
+					self.write_err_and_flush("%s: '%s': No such file or directory\n" % (cmd_name, target))
+			elif os.path.normpath(path) == self.fs_root():
+				self.write_err_and_flush("%s: refusing to remove '%s'\n" % (cmd_name, path))
+			elif dirs_only and not os.path.isdir(path):
+				self.write_err_and_flush("%s: '%s' is not a directory\n" % (cmd_name, path))
+			else:
+				paths.append(path)
+
+		progress_shown = []
+		def progress(num_files, num_dirs):
+			progress_shown.append(True)
+			self.write_out_and_flush("%s: %d files, %d directories so far...\n" % (cmd_name, num_files, num_dirs))
+			self.flush_output()
+
+		remover = Remover(num_workers, dry_run)
+		remover.remove(paths, progress)
+		if dry_run:
+			self.write_out_and_flush("%s: would remove %d files and %d directories\n" % (cmd_name, remover.num_files, remover.num_dirs))
+		elif verbose or progress_shown:
+			self.write_out_and_flush("%s: removed %d files and %d directories\n" % (cmd_name, remover.num_files, remover.num_dirs))
+		self.report_errors(cmd_name, [(path, e) for path, e in remover.errors if not (force and isinstance(e, FileNotFoundError))])
+
+	############################################################################
+	def report_errors(self, cmd_name, errors, max_listed=MAX_LISTED_ERRORS):
+		"""
+		PURPOSE: reports the errors of a command that kept going past them
+		ARGS:
+			cmd_name (str): name of the command, for messages
+			errors (list): (path, OSError) of each failure
+			max_listed (int): max number of failures listed one by one
+		RETURNS: none
+		NOTES: may write to ferr. Past max_listed the rest are counted by
+			reason
+		"""
+		for path, e in errors[:max_listed]:
+			self.write_err_and_flush("%s: '%s': %s\n" % (cmd_name, path, e.strerror or e))
+		if len(errors) > max_listed:
+			reasons = collections.Counter(e.strerror or str(e) for path, e in errors[max_listed:])
+			summary = ", ".join("%d %s" % (num, reason) for reason, num in reasons.most_common())
+			self.write_err_and_flush("%s: %d more errors (%s)\n" % (cmd_name, len(errors) - max_listed, summary))
+
+	############################################################################
+	def cmd_touch(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'touch' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		if len(cmd_args) < 1:
+			#No arguments were given
+			self.write_err_and_flush("touch: requires at least 1 argument\n")
+			return
+
+		for cur_arg in cmd_args:
+			try:
+				with open(self.abs_path(cur_arg), 'a') as fh:
+					pass
+			except Exception as e:
+				self.write_err_and_flush("Could not open file '%s'\n" % cur_arg)
+
+	############################################################################
+	def cmd_locate(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'locate' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. Searches the 'updatedb' index when
+			one exists and no walk options were given, otherwise walks the
+			filesystem in parallel. Matches are written as they are found
+		"""
+		paths = self.locate_paths(cmd_args)
+		if paths is not None:
+			self.write_paths(paths)
+
+	############################################################################
+	def locate_paths(self, cmd_args):
+		"""
+		PURPOSE: parses the arguments of 'locate' and starts the search
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: (generator) matching paths, None if the arguments are invalid
+		NOTES: may write to ferr. Closing the generator stops the search
+		"""
+		file_to_find = ""
+		root = ""
+		max_depth = None
+		excludes = []
+		ii = 0
+		while ii < len(cmd_args):
+			cur_arg = cmd_args[ii]
+			if cur_arg in ("--root", "--max-depth", "--exclude"):
+				if len(cmd_args) == (ii + 1):
+					self.write_err_and_flush("locate: %s requires a value\n" % cur_arg)
+					return None
+				value = cmd_args[ii + 1]
+				ii += 1
+				if cur_arg == "--root":
+					root = value
+				elif cur_arg == "--exclude":
+					excludes.append(value)
+				else:
+					try:
+						max_depth = int(value)
+					except ValueError:
+						self.write_err_and_flush("locate: invalid depth '%s'\n" % value)
+						return None
+			elif cur_arg.startswith("-"):
+				self.write_err_and_flush("locate: unknown option %s\n" % cur_arg)
+				return None
+			elif file_to_find == "":
+				file_to_find = cur_arg
+			ii += 1
+
+		if file_to_find == "":
+			#No arguments were given
+			self.write_err_and_flush("locate: requires at least 1 argument\n")
+			return None
+
+		return self.search_paths(file_to_find, root, max_depth, excludes)
+
+	############################################################################
+	def search_paths(self, file_to_find, root, max_depth, excludes):
+		"""
+		PURPOSE: finds files whose name contains a string
+		ARGS:
+			file_to_find (str): substring to look for in file names
+			root (str): directory to search, "" for the whole filesystem
+			max_depth (int): how deep to search, None for no limit
+			excludes (list): names or glob patterns to skip
+		RETURNS: (generator) full paths of matching files
+		NOTES: may write to ferr. Uses the 'updatedb' index when only a name
+			was given and the index exists. Reports when nothing was found
+		"""
+		from Crust_Index import File_Index, DEFAULT_PRUNE_PATHS
+		from Crust_Walker import Walker
+		found_any = False
+		file_index = File_Index(self.locate_db)
+		if not root and max_depth is None and not excludes and file_index.exists():
+			try:
+				file_index.open()
+			except ValueError as e:
+				self.write_err_and_flush("locate: %s\n" % e)
+				return
+			matches = file_index.search(file_to_find)
+		else:
+			if not root:
+				root = self.fs_root()
+				excludes = excludes + list(DEFAULT_PRUNE_PATHS)
+			else:
+				root = self.abs_path(root)
+			matches = self.walk_matches(Walker(root, max_depth, excludes), file_to_find)
+
+		try:
+			for file_path in matches:
+				found_any = True
+				yield file_path
+		finally:
+			#Stops the walk right away if a consumer gave up early
+			matches.close()
+			file_index.close()
+
+		if not found_any:
+			self.write_err_and_flush("Could not find '%s'\n" % file_to_find)
+
+	############################################################################
+	def walk_matches(self, walker, file_to_find):
+		"""
+		PURPOSE: finds files whose name contains a string by walking a tree
+		ARGS:
+			walker (Walker): walker over the tree to search
+			file_to_find (str): substring to look for in file names
+		RETURNS: (generator) full paths of matching files
+		NOTES: closing the generator stops the walk
+		"""
+		for dir_path, entries in walker.walk():
+			for entry in entries:
+				if file_to_find in entry.name:
+					try:
+						is_dir = entry.is_dir()
+					except OSError:
+						is_dir = False
+					if not is_dir:
+						yield entry.path
+
+	############################################################################
+	def write_paths(self, paths, batch_size=256):
+		"""
+		PURPOSE: writes paths to fout, one per line, in batches
+		ARGS:
+			paths (iterable): paths to write
+			batch_size (int): max number of paths per write
+		RETURNS: (bool) true if at least one path was written
+		NOTES: the first batch is written as soon as the first path is found
+			so results show up right away
+		"""
+		found_any = False
+		batch = []
+		for cur_path in paths:
+			batch.append(cur_path)
+			if not found_any or len(batch) >= batch_size:
+				batch.append("")
+				self.write_out_and_flush("\n".join(batch))
+				batch = []
+				found_any = True
+		if batch:
+			batch.append("")
+			self.write_out_and_flush("\n".join(batch))
+		return found_any
+
+	############################################################################
+	def cmd_updatedb(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'updatedb' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr. Only directories whose mtime changed
+			since the last run are listed again unless '--full' is given
+		"""
+		full = False
+		root = ""
+		for cur_arg in cmd_args:
+			if cur_arg == "--full":
+				full = True
+			elif cur_arg.startswith("-"):
+				self.write_err_and_flush("updatedb: unknown option %s\n" % cur_arg)
+				return
+			elif root == "":
+				root = cur_arg
+		if root == "":
+			#Same root that 'locate' searches without an index
+			root = self.fs_root()
+		elif not os.path.isdir(self.abs_path(root)):
+			self.write_err_and_flush("updatedb: %s: No such directory\n" % root)
+			return
+		else:
+			root = self.abs_path(root)
+
+		from Crust_Index import File_Index
+		try:
+			counts = File_Index(self.locate_db).update(root, full)
+		except OSError as e:
+			self.write_err_and_flush("updatedb: could not write database: %s\n" % e)
+			return
+		self.write_out_and_flush("updatedb: indexed %d files in %d directories (%d rescanned, %d unchanged)\n" % (counts["files"], counts["dirs"], counts["rescanned"], counts["reused"]))
+
+	############################################################################
+	def cmd_time(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'time' command
+		ARGS:
+			cmd_args (list): command to run and its arguments
+		RETURNS: (int) exit status of the command
+		NOTES: may write to fout and ferr. The timings are written to fout so
+			they do not count as a failure of the command
+		"""
+		if len(cmd_args) < 1:
+			self.write_err_and_flush("time: requires a command\n")
+			return 2
+		bytes_out = self.bytes_out
+		io_start = read_io_counters()
+		cpu_start = time.thread_time()
+		wall_start = time.perf_counter()
+		#Only 'time' itself is recorded, it covers the command
+		status = self.run_unrecorded(cmd_args)
+		self.flush_output()
+		wall = time.perf_counter() - wall_start
+		cpu = time.thread_time() - cpu_start
+		io_end = read_io_counters()
+
+		lines = [
+			"real\t%s" % format_seconds(wall),
+			"cpu\t%s" % format_seconds(cpu),
+			"out\t%d" % (self.bytes_out - bytes_out),
+		]
+		if io_end:
+			lines.append("read\t%d bytes in %d calls" % (io_end["rchar"] - io_start["rchar"], io_end["syscr"] - io_start["syscr"]))
+			lines.append("write\t%d bytes in %d calls" % (io_end["wchar"] - io_start["wchar"], io_end["syscw"] - io_start["syscw"]))
+		self.write_out_and_flush("\n".join(lines) + "\n")
+		return status
+
+	############################################################################
+	def cmd_stats(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'stats' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr.
+			stats            table of latency and counters per command
+			stats <command>  latency histogram of one command
+			stats --json     everything as json
+			stats --reset    forget everything recorded so far
+		"""
+		if not cmd_args:
+			self.write_out_and_flush(self.metrics.render())
+		elif cmd_args[0] == "--json":
+			import json
+			self.write_out_and_flush(json.dumps(self.metrics.to_dict(), indent=1, sort_keys=True) + "\n")
+		elif cmd_args[0] == "--reset":
+			self.metrics.reset()
+		elif cmd_args[0].startswith("-"):
+			self.write_err_and_flush("stats: unknown option %s\n" % cmd_args[0])
+		else:
+			histogram = self.metrics.render(cmd_args[0])
+			if histogram is None:
+				self.write_err_and_flush("stats: no stats for '%s'\n" % cmd_args[0])
+			else:
+				self.write_out_and_flush(histogram)
+
+	############################################################################
+	def cmd_profile(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'profile' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout and ferr.
+			profile on        profile every command from now on with cProfile
+			profile off       stop profiling, keeping what was collected
+			profile show [N]  top N functions by cumulative time (default 20)
+			profile reset     throw away what was collected
+		"""
+		if not cmd_args:
+			self.write_err_and_flush("profile: requires on, off, show or reset\n")
+			return
+		action = cmd_args[0]
+		if action == "on":
+			if self.profiler is None:
+				import cProfile
+				self.profiler = cProfile.Profile()
+		elif action == "off":
+			if self.profiler is not None:
+				self.profile_data = self.profiler
+			self.profiler = None
+		elif action == "reset":
+			if self.profiler is not None:
+				import cProfile
+				self.profiler = cProfile.Profile()
+			self.profile_data = None
+		elif action == "show":
+			profiler = self.profiler or self.profile_data
+			if profiler is None:
+				self.write_err_and_flush("profile: nothing collected, use 'profile on'\n")
+				return
+			num_lines = 20
+			if len(cmd_args) > 1:
+				try:
+					num_lines = int(cmd_args[1])
+				except ValueError:
+					self.write_err_and_flush("profile: invalid number '%s'\n" % cmd_args[1])
+					return
+			import io
+			import pstats
+			report = io.StringIO()
+			pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(num_lines)
+			self.write_out_and_flush(report.getvalue())
+		else:
+			self.write_err_and_flush("profile: unknown action '%s'\n" % action)
+
+	############################################################################
+	def start_job(self, cmd):
+		"""
+		PURPOSE: starts a command as a background job
+		ARGS:
+			cmd (list): command and arguments, without the '&'
+		RETURNS: (int) exit status of starting the job
+		NOTES: the job gets its own shell, starting in this shell's working
+			directory, so it cannot change this shell's state. Its output is
+			buffered until it is shown at a prompt, by 'wait' or by 'fg'
+		"""
+		if not cmd:
+			self.write_err_and_flush("syntax error near unexpected token '&'\n")
+			return 2
+		if self.job_pool is None:
+			from concurrent.futures import ThreadPoolExecutor
+			self.job_pool = ThreadPoolExecutor(max_workers=DEFAULT_JOB_WORKERS, thread_name_prefix="crust-job")
+
+		job_id = 1
+		if self.jobs:
+			job_id = max(self.jobs) + 1
+		job = Job(job_id, cmd)
+		shell = Crust(None, Job_File(job, False), Job_File(job, True), cwd=self.cwd, flush_policy=FLUSH_PROMPT)
+		shell.locate_db = self.locate_db
+		shell.metrics = self.metrics
+		shell.kill_event = job.kill_event
+		self.jobs[job_id] = job
+		job.future = self.job_pool.submit(shell.run_job, job)
+		self.write_out_and_flush("[%d] %s\n" % (job_id, job.cmd_str))
+		return 0
+
+	############################################################################
+	def run_job(self, job):
+		"""
+		PURPOSE: runs a background job's command in the job's shell
+		ARGS:
+			job (Job): job to run
+		RETURNS: (int) exit status of the command
+		NOTES: runs on the job pool
+		"""
+		try:
+			job.status = self.run_command(job.cmd)
+		except Job_Killed:
+			job.status = STATUS_KILLED
+		except BaseException:
+			job.status = 1
+			raise
+		finally:
+			job.done_event.set()
+		return job.status
+
+	############################################################################
+	def write_job_output(self, job):
+		"""
+		PURPOSE: writes out what a job has output so far
+		ARGS:
+			job (Job): job to show the output of
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		for is_err, out_str in job.take_output():
+			if is_err:
+				self.write_err_and_flush(out_str)
+			else:
+				self.write_out_and_flush(out_str)
+		if job.truncated and job.done_event.is_set():
+			self.write_out_and_flush("[%d] output past %d characters was dropped\n" % (job.job_id, MAX_JOB_OUTPUT))
+
+	############################################################################
+	def report_jobs(self, jobs_to_report=None):
+		"""
+		PURPOSE: shows the output and status of finished jobs and forgets them
+		ARGS:
+			jobs_to_report (list): jobs to report if finished, None for all
+		RETURNS: none
+		NOTES: may write to fout and ferr
+		"""
+		if jobs_to_report is None:
+			jobs_to_report = list(self.jobs.values())
+		for job in jobs_to_report:
+			if job.done_event.is_set():
+				self.write_job_output(job)
+				self.write_out_and_flush("[%d]  %-10s %s\n" % (job.job_id, job.state(), job.cmd_str))
+				self.jobs.pop(job.job_id, None)
+		self.flush_output()
+
+	############################################################################
+	def kill_job(self, job):
+		"""
+		PURPOSE: stops a job
+		ARGS:
+			job (Job): job to stop
+		RETURNS: none
+		NOTES: a job that has not started yet never runs. A running job is
+			stopped the next time it writes any output
+		"""
+		job.kill_event.set()
+		if job.future is not None and job.future.cancel():
+			job.status = STATUS_KILLED
+			job.done_event.set()
+
+	############################################################################
+	def close_jobs(self):
+		"""
+		PURPOSE: kills every job, for when the shell exits
+		ARGS:
+		RETURNS: none
+		NOTES: does not wait for running jobs to stop
+		"""
+		for job in self.jobs.values():
+			self.kill_job(job)
+		self.jobs.clear()
+		if self.job_pool is not None:
+			self.job_pool.shutdown(wait=False, cancel_futures=True)
+			self.job_pool = None
+
+	############################################################################
+	def find_jobs(self, cmd_name, cmd_args):
+		"""
+		PURPOSE: looks up the jobs given to a job control command
+		ARGS:
+			cmd_name (str): name of the command, for messages
+			cmd_args (list): job numbers, with or without a leading '%'
+		RETURNS: (list) jobs found, None if any of them does not exist
+		NOTES: may write to ferr
+		"""
+		jobs = []
+		for cur_arg in cmd_args:
+			job = None
+			try:
+				job = self.jobs.get(int(cur_arg.lstrip('%')))
+			except ValueError:
+				pass
+			if job is None:
+				self.write_err_and_flush("%s: %s: no such job\n" % (cmd_name, cur_arg))
+				return None
+			jobs.append(job)
+		return jobs
+
+	############################################################################
+	def cmd_jobs(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'jobs' command
+		ARGS:
+			cmd_args (list): list of strings representing arguments
+		RETURNS: none
+		NOTES: may write to fout
+		"""
+		for job in self.jobs.values():
+			self.write_out_and_flush("[%d]  %-10s %s\n" % (job.job_id, job.state(), job.cmd_str))
+
+	############################################################################
+	def cmd_wait(self, cmd_args=[]):
+		"""
+		PURPOSE: executes 'wait' command
+		ARGS:
+			cmd_args (list): job numbers to wait for, none for every job
+		RETURNS: (int) exit status of the last job waited for
+		NOTES: may write to fout and ferr. Shows the output of each job once
+			it finishes
+		"""
+		jobs = self.find_jobs("wait", cmd_args)
+		if jobs is None:
+			return 127
+		if not cmd_args:
+			jobs = list(self.jobs.values())
+		status = 0
+		for job in jobs:
+			job.done_event.wait()
+			self.report_jobs([job])
+			status = job.status
+		return status
 
 	############################################################################
-	def write_out_and_flush(self, out_str):
+	def cmd_fg(self, cmd_args=[]):
 		"""
-		PURPOSE: writes to fout and flushes the buffer
+		PURPOSE: executes 'fg' command
 		ARGS:
-			out_str (str): string to output
-		RETURNS: none
-		NOTES:
+			cmd_args (list): job number, none for the most recent job
+		RETURNS: (int) exit status of the job
+		NOTES: may write to fout and ferr. Shows the job's output as it is
+			produced until the job finishes
 		"""
-		self.fout.write(out_str)
-		self.fout.flush()
+		if not cmd_args:
+			if not self.jobs:
+				self.write_err_and_flush("fg: no current job\n")
+				return 1
+			cmd_args = [str(max(self.jobs))]
+		jobs = self.find_jobs("fg", cmd_args[:1])
+		if jobs is None:
+			return 1
+		job = jobs[0]
+		self.write_out_and_flush("%s\n" % job.cmd_str)
+		while True:
+			done = job.done_event.wait(JOB_POLL_INTERVAL)
+			self.write_job_output(job)
+			self.flush_output()
+			if done:
+				break
+		self.jobs.pop(job.job_id, None)
+		return job.status
 
 	############################################################################
-	def write_err_and_flush(self, out_str):
+	def cmd_kill(self, cmd_args=[]):
 		"""
-		PURPOSE: writes to ferr and flushes the buffer
+		PURPOSE: executes 'kill' command
 		ARGS:
-			out_str (str): string to output
-		RETURNS: none
-		NOTES:
+			cmd_args (list): job numbers to kill
+		RETURNS: (int) exit status
+		NOTES: may write to ferr. See kill_job for when a job actually stops
 		"""
-		self.ferr.write(out_str)
-		self.ferr.flush()
+		if len(cmd_args) < 1:
+			#No arguments were given
+			self.write_err_and_flush("kill: requires at least 1 argument\n")
+			return 2
+		jobs = self.find_jobs("kill", cmd_args)
+		if jobs is None:
+			return 1
+		for job in jobs:
+			self.kill_job(job)
+		return 0
 
 	############################################################################
-	def parse_input(self, user_input):
+	def write_chunks(self, chunks):
 		"""
-		PURPOSE: parses the raw string of user input. Splits multiple commands 
-			up and tokenizes each command
+		PURPOSE: writes every chunk of an iterator to fout
 		ARGS:
-			user_input (str): user input str
-		RETURNS: (list) list of commands, where each command is a list of 
-			strings representing command and argument
-		NOTES:
+			chunks (iterable): strings to write
+		RETURNS: none
+		NOTES: closes the iterator when done so upstream work stops
 		"""
-		#Strip whitespace
-		user_input = user_input.strip()
-
-		#Break multi-command line into multiple commands
-		user_input_list = user_input.split(';')
-		if len(user_input_list) > 1:
-			#Multi command so feed each command to this function recursively 
-			#and save results in a list
-			cmds = []
-			for cur_input in user_input_list:
-				cur_output = self.parse_input(cur_input)
-				cmds.append(cur_output[0])
-			return cmds
-		else:
-			#Single command so ignore list
-			pass
-
-		#Break command into command plus individual arguments
-		cmd = user_input.split()
-
-		#Return list of commands
-		return [cmd]
+		try:
+			for chunk in chunks:
+				self.write_out_and_flush(chunk)
+		finally:
+			if hasattr(chunks, "close"):
+				chunks.close()
 
 	############################################################################
-	def run(self):
+	def run_pipeline(self, cmd):
 		"""
-		PURPOSE: main loop of the shell that waits for input, does something, 
-			and then gives you the output
+		PURPOSE: runs commands connected by pipes
 		ARGS:
+			cmd (list): commands and arguments separated by PIPE arguments
 		RETURNS: none
-		NOTES:
+		NOTES: may write to fout and ferr. Each stage is a generator of
+			chunks consuming the previous one, so only a few chunks are ever
+			in memory. When a stage stops early (ex: 'head') every stage is
+			closed, which stops the work upstream (ex: the walk in 'locate')
 		"""
-		self.keep_going = True
-
-		while self.keep_going:
-			#Wait for user input
-			dir_to_show = os.path.basename(os.getcwd())
-			self.write_out_and_flush("(crust) %s>" % dir_to_show)
-			#self.write_out_and_flush(">>>")
-			user_input = self.fin.readline()
-
-			#Parse user input
-			cmds = self.parse_input(user_input)
-
-			#Execute user input
-			for cmd in cmds:
-				if len(cmd) >= 1:
-					actual_cmd = cmd[0]
-					cmd_args = cmd[1:]
+		stage_cmds = split_pipeline(cmd)
+		for stage_cmd in stage_cmds:
+			if not stage_cmd:
+				self.write_err_and_flush("syntax error near '|'\n")
+				return
 
-					#Switch on cmd
-					try:
-						if actual_cmd == "exit":
-							self.keep_going = False
-							break
-						elif actual_cmd == "pwd":
-							self.cmd_pwd(cmd_args)
-						elif actual_cmd == "cd":
-							self.cmd_cd(cmd_args)
-						elif actual_cmd == 'ls':
-							self.cmd_ls(cmd_args)
-						elif actual_cmd == 'cp':
-							self.cmd_cp(cmd_args)
-						elif actual_cmd == 'cat':
-							self.cmd_cat(cmd_args)
-						elif actual_cmd == 'mv':
-							self.cmd_mv(cmd_args)
-						elif actual_cmd == 'mkdir':
-							self.cmd_mkdir(cmd_args)
-						elif actual_cmd == 'rmdir':
-							self.cmd_rmdir(cmd_args)
-						elif actual_cmd == 'rm':
-							self.cmd_rm(cmd_args)
-						elif actual_cmd == 'touch':
-							self.cmd_touch(cmd_args)
-						elif actual_cmd == 'locate':
-							self.cmd_locate(cmd_args)
-						else:
-							err_msg = "%s: command not found\n" % actual_cmd
-							self.write_err_and_flush(err_msg)
-					except Exception as e:
-						self.write_err_and_flush("Unknown error occurred: %s\n" % type(e))
-						self.write_err_and_flush(str(e))
+		stages = []
+		chunks = None
+		try:
+			for stage_cmd in stage_cmds:
+				chunks = self.open_stage(stage_cmd[0], stage_cmd[1:], chunks)
+				stages.append(chunks)
+			for chunk in chunks:
+				self.write_out_and_flush(chunk)
+		finally:
+			for stage in stages:
+				if hasattr(stage, "close"):
+					stage.close()
 
 	############################################################################
-	def cmd_pwd(self, cmd_args=[]):
+	def open_stage(self, actual_cmd, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'pwd' command
+		PURPOSE: creates one stage of a pipeline
 		ARGS:
+			actual_cmd (str): name of the command
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): output of the previous stage, None for the
+				first stage
+		RETURNS: (iterator) chunks of output of the stage
+		NOTES: commands that cannot stream have their output collected and
+			ignore their input
 		"""
-		cwd = os.getcwd() + "\n"
-		self.write_out_and_flush(cwd)
+		target = STAGE_COMMANDS.get(actual_cmd)
+		if target is None:
+			return self.stage_capture(actual_cmd, cmd_args)
+		if isinstance(target, str) and ':' not in target:
+			return getattr(self, target)(cmd_args, in_chunks)
+		return resolve_target(target)(self, cmd_args, in_chunks)
 
 	############################################################################
-	def cmd_cd(self, cmd_args=[]):
+	def stage_capture(self, actual_cmd, cmd_args):
 		"""
-		PURPOSE: executes 'cd' command
+		PURPOSE: runs a regular command as a pipeline stage
 		ARGS:
+			actual_cmd (str): name of the command
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+		RETURNS: (generator) chunks the command wrote to fout
+		NOTES: the command runs to completion before anything is passed on
 		"""
-		if len(cmd_args) < 1:
-			#No arguments were given so find home directory and go there
-			cd_arg = os.path.expanduser('~')
-		else:
-			cd_arg = cmd_args[0]
-
+		captured = []
+		capture_file = Capture_File(captured)
+		self.flush_output()
+		orig_fout = self.fout
+		self.fout = capture_file
 		try:
-			os.chdir(cd_arg)
-		except FileNotFoundError as e:
-			self.write_err_and_flush("cd: %s: No such file or directory\n" % cd_arg)
+			self.execute_command(actual_cmd, cmd_args)
+			self.flush_output()
+		finally:
+			self.fout = orig_fout
+		for chunk in captured:
+			yield chunk
 
 	############################################################################
-	def cmd_ls(self, cmd_args=[]):
+	def stage_input(self, cmd_name, file_args, in_chunks):
 		"""
-		PURPOSE: executes 'ls' command
+		PURPOSE: gets the input of a filter stage
 		ARGS:
-			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			cmd_name (str): name of the command, for error messages
+			file_args (list): files given on the command line
+			in_chunks (iterator): output of the previous stage or None
+		RETURNS: (generator) chunks of text from the files if any were given,
+			otherwise from the previous stage
+		NOTES: may write to ferr
 		"""
-		show_hidden_files = False
-		long_listing = False
-		human_readable = False
-
-		#Find args that start with dash
-		path_arg = ""
-		dash_args = []
-		for cur_arg in cmd_args:
-			if cur_arg.startswith("-"):
-				dash_args.append(cur_arg)
-			elif path_arg == "":
-				path_arg = cur_arg
-
-		#Interpet modifiers (args that start with dash)
-		for dash_arg in dash_args:
-			if dash_arg.startswith("--"):
-				cur_arg = dash_arg[2:]
-				if cur_arg == "all":
-					show_hidden_files = True
-				else:
-					self.write_err_and_flush("ls: unknown option --%s\n" % cur_arg)
-					return
-			else:
-				cur_arg = dash_arg[1:]
-				#Split into single letters
-				for cur_letter in cur_arg:
-					if cur_letter == 'a':
-						show_hidden_files = True
-					elif cur_letter == 'l':
-						long_listing = True
-					elif cur_letter == 'h':
-						human_readable = True
-					else:
-						self.write_err_and_flush("ls: unknown option -%s\n" % cur_letter)
-						return
+		if not file_args:
+			if in_chunks is None:
+				self.write_err_and_flush("%s: requires a file or piped input\n" % cmd_name)
+				return
+			for chunk in in_chunks:
+				yield chunk
+			return
 
-		if path_arg == "":
-			#No path argument was given so use current directory
-			file_list = os.listdir()
-		else:
-			#Path argument was given
+		for cur_arg in file_args:
 			try:
-				file_list = os.listdir(path_arg)
+				fh_in = open(self.abs_path(cur_arg), 'rb', buffering=0)
 			except FileNotFoundError as e:
-				self.write_err_and_flush("ls: %s: No such directory\n" % path_arg)
-
-		#Show or hide hidden files
-		valid_file_list = []
-		if show_hidden_files:
-			valid_file_list = file_list
-		else:
-			for cur_file in file_list:
-				if not cur_file.startswith('.'):
-					valid_file_list.append(cur_file)
-
-		#Long listing format
-		if long_listing:
-			ret_list = [['Permissions', 'Num Links', 'Owner ID', 'Group ID', 'Bytes', 'Modification Date', 'File']]
-			for cur_file in valid_file_list:
-				if path_arg:
-					file_path = os.path.join(path_arg, cur_file)
-				else:
-					file_path = os.path.join(os.getcwd(), cur_file)
-				cur_ret_list = []
-				is_dir = False
-				if os.path.isdir(file_path):
-					is_dir = True
-					permission_str = 'd'
-				else:
-					permission_str = '-'
-
-				stat_res = os.stat(file_path)
-				stat_mode = stat_res[0]
-				reverse_perm_str = ""
-				for ii in range(3):
-					if (stat_mode & 1):
-						reverse_perm_str = 'x' + reverse_perm_str
-					else:
-						reverse_perm_str = '-' + reverse_perm_str
-					stat_mode = stat_mode >> 1
-					if (stat_mode & 1):
-						reverse_perm_str = 'w' + reverse_perm_str
-					else:
-						reverse_perm_str = '-' + reverse_perm_str
-					stat_mode = stat_mode >> 1
-					if (stat_mode & 1):
-						reverse_perm_str = 'r' + reverse_perm_str
-					else:
-						reverse_perm_str = '-' + reverse_perm_str
-					stat_mode = stat_mode >> 1
-				permission_str += reverse_perm_str
-				cur_ret_list.append(permission_str)
-
-				#TODO if linux look up user and group id for 4 and 5
-				cur_ret_list.append(str(stat_res[3]))
-				cur_ret_list.append(str(stat_res[4]))
-				cur_ret_list.append(str(stat_res[5]))
-				file_size = stat_res[6]
-				if human_readable:
-					for unit in ["", "K", "M", "G", "T"]:
-						if abs(file_size) < 1024.0:
-							file_size = "%.1f%s" % (file_size, unit)
-							break
-						file_size /= 1024.0
-				cur_ret_list.append(str(file_size))
-				file_date = datetime.fromtimestamp(stat_res[8]).strftime("%b %d %H:%M")
-				cur_ret_list.append(file_date)
-				cur_ret_list.append(cur_file)
-
-				ret_list.append(cur_ret_list)
-
-			col0_len = 0
-			col1_len = 0
-			col2_len = 0
-			col3_len = 0
-			col4_len = 0
-			col5_len = 0
-			for col in range(6):
-				max_len = 0
-				for row in range(len(ret_list)):
-					cur_len = len(ret_list[row][col])
-					if cur_len > max_len:
-						max_len = cur_len
-				for row in range(len(ret_list)):
-					cur_len = len(ret_list[row][col])
-					to_add = max_len - cur_len
-					if to_add >= 1:
-						ret_list[row][col] += ' ' * to_add
-
-			ret_str = ""
-			for cur_row in ret_list:
-				ret_str += " ".join(cur_row) + "\n"
-		else:
-			ret_str = " ".join(valid_file_list) + "\n"
-		self.write_out_and_flush(ret_str)
+				self.write_err_and_flush("%s: %s: No such file or directory\n" % (cmd_name, cur_arg))
+				continue
+			except IsADirectoryError as e:
+				self.write_err_and_flush("%s: %s: Is a directory\n" % (cmd_name, cur_arg))
+				continue
+			except PermissionError as e:
+				self.write_err_and_flush("%s: %s: Permission denied\n" % (cmd_name, cur_arg))
+				continue
+			with fh_in:
+				for chunk in iter_text(fh_in):
+					yield chunk
 
 	############################################################################
-	def cmd_cp(self, cmd_args=[]):
+	def stage_cat(self, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'cp' command
+		PURPOSE: 'cat' as a pipeline stage
 		ARGS:
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): output of the previous stage or None
+		RETURNS: (generator) contents of the files, or the input if no files
+			were given
+		NOTES: may write to ferr
 		"""
-		if len(cmd_args) < 2:
-			#No arguments were given
-			self.write_err_and_flush("cp: requires at least 2 arguments\n")
-			return
-		elif len(cmd_args) == 2:
-			#Check for directory
-			if os.path.isdir(cmd_args[0]):
-				self.write_err_and_flush("cp: '%s' cannot be a directory\n")
-				return
-			if os.path.isdir(cmd_args[1]):
-				basename = os.path.basename(cmd_args[0])
-				cmd_args[1] = os.path.join(cmd_args[1], basename)
-
-			try:
-				shutil.copyfile(cmd_args[0], cmd_args[1])
-			except shutil.SameFileError as e:
-				self.write_err_and_flush("cp: '%s' and '%s' are the same file\n" % (cmd_args[0], cmd_args[1]))
-			except PermissionError as e:
-				self.write_err_and_flush("cp: Permission denied\n")
-			except FileNotFoundError as e:
-				self.write_err_and_flush("cp: No such file or directory\n")
-		else:
-			#Should be multiple files copying into a directory
-			for ii in range(len(cmd_args) - 1):
-				if not os.path.isfile(cmd_args[ii]):
-					self.write_err_and_flush("cp: '%s' needs to be a file\n" % cmd_args[ii])
-					return
-			if not os.path.isdir(cmd_args[-1]):
-				self.write_err_and_flush("cp: '%s' needs to be a directory\n" % cmd_args[-1])
-			for ii in range(len(cmd_args) - 1):
-				shutil.copyfile(cmd_args[ii], os.path.join(cmd_args[-1], os.path.basename(cmd_args[ii])))
+		return self.stage_input("cat", cmd_args, in_chunks)
 
 	############################################################################
-	def cmd_cat(self, cmd_args=[]):
+	def stage_locate(self, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'cat' command
+		PURPOSE: 'locate' as a pipeline stage
 		ARGS:
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): ignored
+		RETURNS: (generator) matching paths, in batches of lines
+		NOTES: may write to ferr. Closing the generator stops the search
 		"""
-		if not cmd_args:
-			#No arguments given
-			self.write_err_and_flush("cat: requires at least 1 argument\n")
+		paths = self.locate_paths(cmd_args)
+		if paths is None:
 			return
-
-		cat_str = ""
-		file_to_write_to = ""
-		overwrite_file = False
-		for ii in range(len(cmd_args)):
-			cur_arg = cmd_args[ii]
-			if cur_arg == ">":
-				if len(cmd_args) == (ii + 1):
-					self.write_err_and_flush("A target file is required with use of '>'\n")
-					return
-				file_to_write_to = cmd_args[ii + 1]
-				overwrite_file = True
-				break
-			elif cur_arg == ">>":
-				if len(cmd_args) == (ii + 1):
-					self.write_err_and_flush("A target file is required with use of '>>'\n")
-					return
-				file_to_write_to = cmd_args[ii + 1]
-				overwrite_file = False
-				break
-			else:
-				try:
-					cur_file = os.path.join(os.getcwd(), cur_arg)
-					with open(cur_file, 'r') as fh:
-						cat_str += fh.read()
-				except FileNotFoundError as e:
-					self.write_err_and_flush("Could not find file '%s'\n" % cur_arg)
-					return
-
-		if file_to_write_to:
-			try:
-				full_file_write_to = os.path.join(os.getcwd(), file_to_write_to)
-				if overwrite_file:
-					with open(full_file_write_to, 'w') as fh:
-						fh.write(cat_str)
-				else:
-					with open(full_file_write_to, 'a') as fh:
-						fh.write(cat_str)
-			except Exception as e:
-				self.write_err_and_flush("Could not write to file '%s'\n" % file_to_write_to)
-				return
-		else:
-			self.write_out_and_flush(cat_str)
+		batch = []
+		try:
+			for cur_path in paths:
+				batch.append(cur_path)
+				if len(batch) >= 256:
+					batch.append("")
+					yield "\n".join(batch)
+					batch = []
+			if batch:
+				batch.append("")
+				yield "\n".join(batch)
+		finally:
+			paths.close()
 
 	############################################################################
-	def cmd_mv(self, cmd_args=[]):
+	def stage_head(self, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'mv' command
+		PURPOSE: 'head' as a pipeline stage
 		ARGS:
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): output of the previous stage or None
+		RETURNS: (generator) first lines of the input
+		NOTES: may write to ferr. Stops reading its input as soon as it has
+			enough lines. Usage: head [-n N | -N] [file...]
 		"""
-		if len(cmd_args) < 2:
-			#No arguments were given
-			self.write_err_and_flush("mv: requires at least 2 arguments\n")
+		num_lines, file_args = self.parse_line_count("head", cmd_args)
+		if num_lines is None or num_lines <= 0:
 			return
-		else:
-			try:
-				shutil.move(cmd_args[0], cmd_args[1])
-			except shutil.SameFileError as e:
-				self.write_err_and_flush("mv: '%s' and '%s' are the same file\n" % (cmd_args[0], cmd_args[1]))
-			except PermissionError as e:
-				self.write_err_and_flush("mv: Permission denied\n")
-			except FileNotFoundError as e:
-				self.write_err_and_flush("mv: No such file or directory\n")
+		for line in iter_lines(self.stage_input("head", file_args, in_chunks)):
+			yield line
+			num_lines -= 1
+			if num_lines == 0:
+				break
 
 	############################################################################
-	def cmd_mkdir(self, cmd_args=[]):
+	def stage_tail(self, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'mkdir' command
+		PURPOSE: 'tail' as a pipeline stage
 		ARGS:
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): output of the previous stage or None
+		RETURNS: (generator) last lines of the input
+		NOTES: may write to ferr. Only the last N lines are kept in memory.
+			Usage: tail [-n N | -N] [file...]
 		"""
-		if len(cmd_args) < 1:
-			#No arguments were given
-			self.write_err_and_flush("mkdir: requires 1 argument\n")
+		num_lines, file_args = self.parse_line_count("tail", cmd_args)
+		if num_lines is None or num_lines <= 0:
 			return
-		try:
-			os.makedirs(cmd_args[0])
-		except Exception as e:
-			self.write_err_and_flush("Could not make directory '%s'\n" % cmd_args[0])
+		last_lines = collections.deque(maxlen=num_lines)
+		last_lines.extend(iter_lines(self.stage_input("tail", file_args, in_chunks)))
+		if last_lines:
+			yield "".join(last_lines)
 
 	############################################################################
-	def cmd_rmdir(self, cmd_args=[]):
+	def parse_line_count(self, cmd_name, cmd_args):
 		"""
-		PURPOSE: executes 'rmdir' command
+		PURPOSE: parses the arguments of 'head' and 'tail'
 		ARGS:
+			cmd_name (str): name of the command, for error messages
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+		RETURNS: (tuple) number of lines (None if the arguments are invalid)
+			and list of file arguments
+		NOTES: may write to ferr
 		"""
-		if len(cmd_args) < 1:
-			#No arguments were given
-			self.write_err_and_flush("rmdir: requires at least 1 argument\n")
-			return
-		for cur_arg in cmd_args:
-			try:
-				shutil.rmtree(cur_arg)
-			except NotADirectoryError as e:
-				self.write_err_and_flush("'%s' is not a directory\n" % cur_arg)
-			except Exception as e:
-				self.write_err_and_flush("Could not remove directory '%s'\n" % cur_arg)
+		num_lines = 10
+		file_args = []
+		ii = 0
+		while ii < len(cmd_args):
+			cur_arg = cmd_args[ii]
+			value = None
+			if cur_arg == "-n":
+				if len(cmd_args) == (ii + 1):
+					self.write_err_and_flush("%s: -n requires a value\n" % cmd_name)
+					return None, file_args
+				value = cmd_args[ii + 1]
+				ii += 1
+			elif cur_arg.startswith("-n"):
+				value = cur_arg[2:]
+			elif cur_arg.startswith("-") and len(cur_arg) > 1:
+				value = cur_arg[1:]
+			else:
+				file_args.append(cur_arg)
+			if value is not None:
+				try:
+					num_lines = int(value)
+				except ValueError:
+					self.write_err_and_flush("%s: invalid number of lines '%s'\n" % (cmd_name, value))
+					return None, file_args
+			ii += 1
+		return num_lines, file_args
 
 	############################################################################
-	def cmd_rm(self, cmd_args=[]):
+	def stage_wc(self, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'rm' command
+		PURPOSE: 'wc' as a pipeline stage
 		ARGS:
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): output of the previous stage or None
+		RETURNS: (generator) line, word and character counts of the input
+		NOTES: may write to ferr. Counts chunk by chunk so nothing is kept.
+			Usage: wc [-l] [-w] [-c] [file...]
 		"""
-		if len(cmd_args) < 1:
-			#No arguments were given
-			self.write_err_and_flush("rm: requires at least 1 argument\n")
-			return
+		show = []
+		file_args = []
 		for cur_arg in cmd_args:
-			if os.path.isdir(cur_arg):
-				self.cmd_rmdir([cur_arg])
+			if cur_arg.startswith("-") and len(cur_arg) > 1:
+				for cur_letter in cur_arg[1:]:
+					if cur_letter in ('l', 'w', 'c'):
+						show.append(cur_letter)
+					else:
+						self.write_err_and_flush("wc: unknown option -%s\n" % cur_letter)
+						return
 			else:
-				try:
-					os.remove(cur_arg)
-				except Exception as e:
-					self.write_err_and_flush("Could not remove '%s'\n" % cur_arg)
+				file_args.append(cur_arg)
+		if not show:
+			show = ['l', 'w', 'c']
+
+		counts = {'l': 0, 'w': 0, 'c': 0}
+		in_word = False
+		for chunk in self.stage_input("wc", file_args, in_chunks):
+			counts['l'] += chunk.count("\n")
+			counts['c'] += len(chunk)
+			words = chunk.split()
+			if words:
+				counts['w'] += len(words)
+				#A word split across two chunks was counted twice
+				if in_word and not chunk[0].isspace():
+					counts['w'] -= 1
+			in_word = bool(chunk) and not chunk[-1].isspace()
+		yield " ".join(str(counts[key]) for key in ('l', 'w', 'c') if key in show) + "\n"
 
 	############################################################################
-	def cmd_touch(self, cmd_args=[]):
+	def stage_grep(self, cmd_args, in_chunks):
 		"""
-		PURPOSE: executes 'touch' command
+		PURPOSE: 'grep' as a pipeline stage
 		ARGS:
 			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			in_chunks (iterator): output of the previous stage or None
+		RETURNS: (generator) matching lines of the input
+		NOTES: may write to ferr. Usage: grep [-i] [-v] [-c] [-l] [-r]
+			[-j N] pattern [file...]. '-l' lists the files that match, '-r'
+			searches directories and '-j N' sets how many processes search
+			files. Files are searched with Crust_Grep, piped input a line
+			at a time
 		"""
-		if len(cmd_args) < 1:
-			#No arguments were given
-			self.write_err_and_flush("touch: requires at least 1 argument\n")
+		from Crust_Grep import DEFAULT_NUM_PROCESSES
+		ignore_case = False
+		invert = False
+		count_only = False
+		files_only = False
+		recursive = False
+		num_processes = DEFAULT_NUM_PROCESSES
+		pattern = None
+		file_args = []
+		ii = 0
+		while ii < len(cmd_args):
+			cur_arg = cmd_args[ii]
+			if cur_arg.startswith("-") and len(cur_arg) > 1 and pattern is None:
+				for jj in range(1, len(cur_arg)):
+					cur_letter = cur_arg[jj]
+					if cur_letter == 'i':
+						ignore_case = True
+					elif cur_letter == 'v':
+						invert = True
+					elif cur_letter == 'c':
+						count_only = True
+					elif cur_letter == 'l':
+						files_only = True
+					elif cur_letter in ('r', 'R'):
+						recursive = True
+					elif cur_letter == 'j':
+						#Number of processes is the rest of this arg or the next arg
+						value = cur_arg[jj + 1:]
+						if not value:
+							ii += 1
+							value = cmd_args[ii] if ii < len(cmd_args) else ""
+						try:
+							num_processes = int(value)
+						except ValueError:
+							self.write_err_and_flush("grep: invalid number of processes '%s'\n" % value)
+							return
+						break
+					else:
+						self.write_err_and_flush("grep: unknown option -%s\n" % cur_letter)
+						return
+			elif pattern is None:
+				pattern = cur_arg
+			else:
+				file_args.append(cur_arg)
+			ii += 1
+		if pattern is None:
+			self.write_err_and_flush("grep: requires a pattern\n")
+			return
+		if recursive and not file_args:
+			file_args = ["."]
+		if file_args:
+			yield from self.grep_files(pattern, file_args, ignore_case, invert, count_only, files_only, recursive, num_processes)
 			return
 
-		for cur_arg in cmd_args:
-			try:
-				with open(cur_arg, 'a') as fh:
-					pass
-			except Exception as e:
-				self.write_err_and_flush("Could not open file '%s'\n" % cur_arg)
+		import re
+		try:
+			regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+		except re.error as e:
+			self.write_err_and_flush("grep: invalid pattern '%s': %s\n" % (pattern, e))
+			return
+
+		num_matches = 0
+		for line in iter_lines(self.stage_input("grep", file_args, in_chunks)):
+			if (regex.search(line) is None) == invert:
+				num_matches += 1
+				if files_only:
+					yield "(standard input)\n"
+					return
+				if not count_only:
+					yield line
+		if count_only:
+			yield "%d\n" % num_matches
 
 	############################################################################
-	def cmd_locate(self, cmd_args=[]):
+	def grep_files(self, pattern, file_args, ignore_case, invert, count_only, files_only, recursive, num_processes):
 		"""
-		PURPOSE: executes 'locate' command
+		PURPOSE: searches files for 'grep'
 		ARGS:
-			cmd_args (list): list of strings representing arguments
-		RETURNS: none
-		NOTES: may write to fout and ferr
+			pattern (str): regular expression
+			file_args (list): files and directories given on the command line
+			ignore_case (bool): true to match letters of either case
+			invert (bool): true to match the lines that do not match
+			count_only (bool): true to output the number of matching lines
+			files_only (bool): true to output the names of matching files
+			recursive (bool): true to search directories
+			num_processes (int): number of processes searching files
+		RETURNS: (generator) output of 'grep'
+		NOTES: may write to ferr. Each file is searched as bytes in one go,
+			see Crust_Grep.search, and output as soon as it and every file
+			before it are done. Lines are only built for the default mode
 		"""
-		if len(cmd_args) < 1:
-			#No arguments were given
-			self.write_err_and_flush("locate: requires at least 1 argument\n")
-			return
-		file_to_find = cmd_args[0]
-
-		files_found = ""
-		home_dir = os.path.abspath('.').split(os.path.sep)[0] + os.sep
-		for path, subdirs, files in os.walk(home_dir):
-			for name in files:
-				if file_to_find in name:
-					file_path = os.path.join(path, name)
-					files_found += file_path + "\n"
-		if not files_found:
-			self.write_err_and_flush("Could not find '%s'\n" % file_to_find)
-		else:
-			self.write_out_and_flush(files_found)
+		import re
+		from Crust_Grep import search, list_files, MODE_LINES, MODE_COUNT, MODE_FILES
+		from concurrent.futures.process import BrokenProcessPool
+		mode = MODE_FILES if files_only else MODE_COUNT if count_only else MODE_LINES
+		with_names = recursive or len(file_args) > 1
+
+		def report_error(path, reason):
+			self.write_err_and_flush("grep: %s: %s\n" % (path, reason))
+
+		paths = [(self.abs_path(path), path) for path in file_args]
+		results = search(list_files(paths, recursive, report_error), pattern.encode("utf-8", "surrogateescape"), ignore_case, invert, mode, with_names, max(num_processes, 1))
+		try:
+			for shown_path, error, num_lines, out, is_binary in results:
+				if error is not None:
+					report_error(shown_path, error)
+				elif mode == MODE_FILES:
+					if num_lines:
+						yield shown_path + "\n"
+				elif mode == MODE_COUNT:
+					if with_names:
+						yield "%s:%d\n" % (shown_path, num_lines)
+					else:
+						yield "%d\n" % num_lines
+				elif is_binary:
+					if num_lines:
+						yield "Binary file %s matches\n" % shown_path
+				elif out:
+					yield out.decode("utf-8", "replace")
+		except re.error as e:
+			self.write_err_and_flush("grep: invalid pattern '%s': %s\n" % (pattern, e))
+		except BrokenProcessPool:
+			self.write_err_and_flush("grep: search process died\n")
+		finally:
+			results.close()
+
+#Site specific commands, ex: CRUST_COMMANDS="deploy=site_cmds:cmd_deploy"
+if os.environ.get("CRUST_COMMANDS"):
+	register_plugin_commands(os.environ["CRUST_COMMANDS"])
 
 ################################################################################
 ###                                  Main                                    ###
 ################################################################################
+USAGE = """usage: Crust.py [-e] [--status] [-c commands | script | -]
+  (no arguments)  run the interactive shell
+  -c commands     run commands (separated by ';') and exit
+  script          run the commands in a file and exit, '-' for stdin
+  -e              stop at the first command that fails
+  --status        write the exit status of each command to stderr
+"""
+
+def main(argv):
+	"""
+	PURPOSE: runs the shell from the command line
+	ARGS:
+		argv (list): command line arguments, without the program name
+	RETURNS: (int) exit status for the process
+	NOTES: uses a hand rolled parser since importing argparse would cost
+		more than running a short script. Running it as 'python -m Crust'
+		loads the cached bytecode instead of compiling this file every time
+	"""
+	import sys
+	stop_on_error = False
+	report_status = False
+	commands = None
+	script = None
+	ii = 0
+	while ii < len(argv):
+		cur_arg = argv[ii]
+		if cur_arg == "-e":
+			stop_on_error = True
+		elif cur_arg == "--status":
+			report_status = True
+		elif cur_arg == "-c":
+			if len(argv) == (ii + 1):
+				sys.stderr.write("Crust.py: -c requires an argument\n" + USAGE)
+				return 2
+			commands = argv[ii + 1]
+			ii += 1
+		elif cur_arg in ("-h", "--help"):
+			sys.stdout.write(USAGE)
+			return 0
+		elif cur_arg.startswith("-") and cur_arg != "-":
+			sys.stderr.write("Crust.py: unknown option %s\n" % cur_arg + USAGE)
+			return 2
+		else:
+			script = cur_arg
+		ii += 1
+
+	if commands is None and script is None:
+		crust = Crust(sys.stdin, sys.stdout, sys.stderr)
+		crust.run()
+		return crust.exit_status or 0
+
+	#Batch mode so buffer output until each command ends
+	crust = Crust(sys.stdin, sys.stdout, sys.stderr, flush_policy=FLUSH_PROMPT)
+	if commands is not None:
+		return crust.run_script([commands], stop_on_error, report_status)
+	if script == "-":
+		return crust.run_script(sys.stdin, stop_on_error, report_status)
+	try:
+		fh = open(script, 'r')
+	except OSError as e:
+		sys.stderr.write("Crust.py: %s: %s\n" % (script, e.strerror))
+		return 127
+	with fh:
+		return crust.run_script(fh, stop_on_error, report_status)
+
 if __name__ == "__main__":
 	import sys
-	crust = Crust(sys.stdin, sys.stdout, sys.stderr)
-	crust.run()
+	sys.exit(main(sys.argv[1:]))
 
 ################################################################################
 ###                               End of File                                ###
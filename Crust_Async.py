@@ -0,0 +1,440 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import asyncio
+import concurrent.futures
+from Crust_Protocol import Frame_Writer, encode_text, encode_transfer, FRAME_HEADER, MAX_FRAME_SIZE, FILE_FRAME_SIZE, CHANNEL_STDIN, CHANNEL_CONTROL, CHANNEL_FILE, TRANSFER_MESSAGES, DEFAULT_BUFFER_SIZE, DEFAULT_IDLE_TIMEOUT
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Bytes a stream may hold unsent before writers off the loop wait for it
+DEFAULT_HIGH_WATER = 256 * 1024
+#How often a thread waiting on the loop checks the loop is still running
+#(seconds)
+LOOP_POLL_INTERVAL = 0.5
+#How long a command moving a file waits to hear from the client (seconds)
+DEFAULT_REPLY_TIMEOUT = 60.0
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def call_in_loop(loop, func, *args):
+	"""
+	PURPOSE: runs a function on an event loop's thread, from any thread
+	ARGS:
+		loop (asyncio.AbstractEventLoop): loop to run the function on
+		func (function): function to run
+		*args: arguments for the function
+	RETURNS: none
+	NOTES: runs it right away when called on the loop's thread, otherwise
+		queues it. Calls queued from one thread run in order. Raises
+		BrokenPipeError if the loop has been closed
+	"""
+	if in_loop_thread(loop):
+		func(*args)
+		return
+	try:
+		loop.call_soon_threadsafe(func, *args)
+	except RuntimeError:
+		raise BrokenPipeError("event loop is closed")
+
+################################################################################
+def in_loop_thread(loop):
+	"""
+	PURPOSE: checks if the caller is running on an event loop's thread
+	ARGS:
+		loop (asyncio.AbstractEventLoop): loop to check
+	RETURNS: (bool) true if called from the loop's thread
+	NOTES:
+	"""
+	try:
+		return asyncio.get_running_loop() is loop
+	except RuntimeError:
+		return False
+
+################################################################################
+def drain_from_thread(loop, stream_writer, high_water):
+	"""
+	PURPOSE: blocks a thread until a stream has sent most of its data
+	ARGS:
+		loop (asyncio.AbstractEventLoop): loop the stream belongs to
+		stream_writer (asyncio.StreamWriter): stream to wait on
+		high_water (int): bytes the stream may hold before waiting
+	RETURNS: none
+	NOTES: must not be called on the loop's thread. Raises BrokenPipeError if
+		the stream is closed or the loop stops
+	"""
+	if stream_writer.is_closing():
+		raise BrokenPipeError("stream is closed")
+	if stream_writer.transport.get_write_buffer_size() <= high_water:
+		return
+	run_from_thread(loop, stream_writer.drain())
+
+################################################################################
+def run_from_thread(loop, coro):
+	"""
+	PURPOSE: runs a coroutine on an event loop and blocks a thread until it
+		is done
+	ARGS:
+		loop (asyncio.AbstractEventLoop): loop to run the coroutine on
+		coro (coroutine): coroutine to run
+	RETURNS: what the coroutine returned
+	NOTES: must not be called on the loop's thread. Raises BrokenPipeError if
+		the loop stops first
+	"""
+	try:
+		future = asyncio.run_coroutine_threadsafe(coro, loop)
+	except RuntimeError:
+		coro.close()
+		raise BrokenPipeError("event loop is closed")
+	while True:
+		try:
+			return future.result(LOOP_POLL_INTERVAL)
+		except concurrent.futures.TimeoutError:
+			if future.done():
+				#The coroutine itself timed out
+				raise
+			if loop.is_closed() or not loop.is_running():
+				future.cancel()
+				raise BrokenPipeError("event loop stopped")
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Stream_File:
+	"""
+	Text file-like object that writes to an asyncio stream from any thread
+	"""
+	############################################################################
+	def __init__(self, stream_writer, loop, encoding="utf-8", high_water=DEFAULT_HIGH_WATER):
+		"""
+		PURPOSE: creates a new Stream_File
+		ARGS:
+			stream_writer (asyncio.StreamWriter): stream to write to
+			loop (asyncio.AbstractEventLoop): loop the stream belongs to
+			encoding (str): encoding of the text written
+			high_water (int): bytes the stream may hold unsent before a
+				flush from another thread waits
+		RETURNS: new instance of a Stream_File
+		NOTES: meant to be given to Crust as fout or ferr for run_async.
+			Crust sends bytes with write_bytes when it has them, so files
+			go out undecoded
+		"""
+		#Save arguments
+		self.stream_writer = stream_writer
+		self.loop = loop
+		self.encoding = encoding
+		self.high_water = high_water
+
+	############################################################################
+	def write(self, out_str):
+		"""
+		PURPOSE: writes text to the stream
+		ARGS:
+			out_str (str): text to write
+		RETURNS: (int) number of characters written
+		NOTES: never blocks, see flush
+		"""
+		if out_str:
+			if self.stream_writer.is_closing():
+				raise BrokenPipeError("stream is closed")
+			call_in_loop(self.loop, self.stream_writer.write, encode_text(out_str, self.encoding))
+		return len(out_str)
+
+	############################################################################
+	def write_bytes(self, data):
+		"""
+		PURPOSE: writes raw bytes to the stream
+		ARGS:
+			data (bytes-like object): data to write, copied before returning
+		RETURNS: none
+		NOTES: waits like flush, nothing else flushes after raw writes
+		"""
+		if data:
+			if self.stream_writer.is_closing():
+				raise BrokenPipeError("stream is closed")
+			call_in_loop(self.loop, self.stream_writer.write, bytes(data))
+			self.flush()
+
+	############################################################################
+	def flush(self):
+		"""
+		PURPOSE: applies back pressure
+		ARGS:
+		RETURNS: none
+		NOTES: off the loop's thread, waits while the stream holds more than
+			high_water bytes so a fast command cannot outrun a slow peer.
+			Does nothing on the loop's thread
+		"""
+		if not in_loop_thread(self.loop):
+			drain_from_thread(self.loop, self.stream_writer, self.high_water)
+
+################################################################################
+class Async_Frame_Writer(Frame_Writer):
+	"""
+	Frame_Writer that sends on an asyncio stream and can be used from any
+	thread
+	"""
+	############################################################################
+	def __init__(self, stream_writer, loop, buffer_size=DEFAULT_BUFFER_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT, high_water=DEFAULT_HIGH_WATER):
+		"""
+		PURPOSE: creates a new Async_Frame_Writer
+		ARGS:
+			stream_writer (asyncio.StreamWriter): stream to send frames on
+			loop (asyncio.AbstractEventLoop): loop the stream belongs to
+			buffer_size (int): number of buffered bytes that forces a send
+			idle_timeout (float): max seconds buffered output waits before it
+				is sent
+			high_water (int): bytes the stream may hold unsent before a
+				sender on another thread waits
+		RETURNS: new instance of an Async_Frame_Writer
+		NOTES: idle flushes are timers on the loop instead of a thread per
+			flush
+		"""
+		Frame_Writer.__init__(self, None, buffer_size, idle_timeout)
+
+		#Save arguments
+		self.stream_writer = stream_writer
+		self.loop = loop
+		self.high_water = high_water
+
+	############################################################################
+	def send_data(self, data):
+		if self.stream_writer.is_closing():
+			raise BrokenPipeError("stream is closed")
+		call_in_loop(self.loop, self.stream_writer.write, data)
+
+	############################################################################
+	def schedule_flush(self, deadline):
+		call_in_loop(self.loop, self.loop.call_later, self.idle_timeout, self.flush_if_due, deadline)
+
+	############################################################################
+	def wait_sent(self):
+		if not self.closed and not in_loop_thread(self.loop):
+			drain_from_thread(self.loop, self.stream_writer, self.high_water)
+
+################################################################################
+class Async_Frame_Reader:
+	"""
+	Reads frames from an asyncio stream
+	"""
+	############################################################################
+	def __init__(self, stream_reader):
+		"""
+		PURPOSE: creates a new Async_Frame_Reader
+		ARGS:
+			stream_reader (asyncio.StreamReader): stream to read frames from
+		RETURNS: new instance of an Async_Frame_Reader
+		NOTES:
+		"""
+		self.stream_reader = stream_reader
+
+	############################################################################
+	async def read_frame(self):
+		"""
+		PURPOSE: waits for the next frame
+		ARGS:
+		RETURNS: (tuple) channel and payload (bytes), None if the connection
+			was closed
+		NOTES: raises ValueError if the peer sends a frame that is too large
+		"""
+		try:
+			header = await self.stream_reader.readexactly(FRAME_HEADER.size)
+			channel, length = FRAME_HEADER.unpack(header)
+			if length > MAX_FRAME_SIZE:
+				raise ValueError("frame of %d bytes is too large" % length)
+			payload = await self.stream_reader.readexactly(length)
+		except asyncio.IncompleteReadError:
+			return None
+		return channel, payload
+
+################################################################################
+class Async_Stdin_Reader:
+	"""
+	Turns the stdin frames of a connection into lines for Crust.run_async
+	"""
+	############################################################################
+	def __init__(self, frame_reader, on_control=None):
+		"""
+		PURPOSE: creates a new Async_Stdin_Reader
+		ARGS:
+			frame_reader (Async_Frame_Reader): where frames come from
+			on_control (function): called with the payload of each non empty
+				control frame, None to ignore them
+		RETURNS: new instance of an Async_Stdin_Reader
+		NOTES: frames on other channels are ignored. on_control is called
+			from the loop while the shell is waiting for input, or for a
+			file transfer
+		"""
+		#Save arguments
+		self.frame_reader = frame_reader
+		self.on_control = on_control
+
+		#Define properties
+		self.buffer = bytearray()
+		self.eof = False
+
+	############################################################################
+	async def readline(self):
+		"""
+		PURPOSE: waits for the next line of input
+		ARGS:
+		RETURNS: (str) line including its newline, "" at end of input
+		NOTES: lines are split before decoding so a character split across
+			frames is decoded whole. Bytes that are not valid UTF-8 are kept
+			as surrogate escapes, so a file name typed in another encoding
+			still names the file
+		"""
+		while True:
+			newline = self.buffer.find(b'\n')
+			if newline >= 0:
+				line = self.buffer[:newline + 1].decode("utf-8", "surrogateescape")
+				del self.buffer[:newline + 1]
+				return line
+			if self.eof:
+				line = self.buffer.decode("utf-8", "surrogateescape")
+				self.buffer = bytearray()
+				return line
+
+			frame = await self.frame_reader.read_frame()
+			if frame is None:
+				self.eof = True
+				continue
+			self.handle_frame(*frame)
+
+	############################################################################
+	async def read_transfer_frame(self):
+		"""
+		PURPOSE: waits for the next frame of a file transfer
+		ARGS:
+		RETURNS: (tuple) channel and payload of the next file data frame or
+			transfer message, None at end of input
+		NOTES: for commands moving files while the shell is not reading
+			lines. Input that arrives meanwhile is kept for readline and
+			other control frames are handled as usual
+		"""
+		while not self.eof:
+			frame = await self.frame_reader.read_frame()
+			if frame is None:
+				self.eof = True
+				break
+			channel, payload = frame
+			if channel == CHANNEL_FILE or (channel == CHANNEL_CONTROL and payload and payload[0] in TRANSFER_MESSAGES):
+				return frame
+			self.handle_frame(channel, payload)
+		return None
+
+	############################################################################
+	def handle_frame(self, channel, payload):
+		"""
+		PURPOSE: takes in a frame that is not part of a file transfer
+		ARGS:
+			channel (int): channel of the frame
+			payload (bytes): data of the frame
+		RETURNS: none
+		NOTES: file data left over from a failed transfer is dropped
+		"""
+		if channel == CHANNEL_STDIN:
+			self.buffer += payload
+		elif channel == CHANNEL_CONTROL and payload and self.on_control is not None:
+			self.on_control(payload)
+
+################################################################################
+class Async_Transfer_Link:
+	"""
+	Lets a command on the executor move files over its session's connection
+	"""
+	############################################################################
+	def __init__(self, frame_writer, stdin_reader, stream_writer, loop, reply_timeout=DEFAULT_REPLY_TIMEOUT):
+		"""
+		PURPOSE: creates a new Async_Transfer_Link
+		ARGS:
+			frame_writer (Async_Frame_Writer): writer of the session
+			stdin_reader (Async_Stdin_Reader): reader of the session
+			stream_writer (asyncio.StreamWriter): stream to the client
+			loop (asyncio.AbstractEventLoop): loop the streams belong to
+			reply_timeout (float): max seconds to wait on the client
+		RETURNS: new instance of an Async_Transfer_Link
+		NOTES: meant to be set as a Crust's transfer_link for the 'get' and
+			'put' commands, see Crust_Transfer. Its methods must not be
+			called on the loop's thread
+		"""
+		#Save arguments
+		self.frame_writer = frame_writer
+		self.stdin_reader = stdin_reader
+		self.stream_writer = stream_writer
+		self.loop = loop
+		self.reply_timeout = reply_timeout
+
+	############################################################################
+	def send_message(self, msg_type, fields):
+		"""
+		PURPOSE: sends a transfer message to the client
+		ARGS:
+			msg_type (int): one of the CTRL_FILE_ constants
+			fields (dict): json serializable fields of the message
+		RETURNS: none
+		NOTES: sent right away along with any output before it
+		"""
+		self.frame_writer.send_control(msg_type, encode_transfer(fields))
+
+	############################################################################
+	def read_frame(self):
+		"""
+		PURPOSE: waits for the next frame of a transfer from the client
+		ARGS:
+		RETURNS: (tuple) channel and payload, None if the client hung up
+		NOTES: raises TimeoutError if nothing comes within reply_timeout.
+			The connection is closed then, it may have been left part way
+			through a frame
+		"""
+		try:
+			return run_from_thread(self.loop, asyncio.wait_for(self.stdin_reader.read_transfer_frame(), self.reply_timeout))
+		except asyncio.TimeoutError:
+			call_in_loop(self.loop, self.stream_writer.close)
+			raise TimeoutError("client stopped responding")
+
+	############################################################################
+	def send_file(self, fh, offset, count):
+		"""
+		PURPOSE: sends part of a file to the client as file data frames
+		ARGS:
+			fh (file object): binary file to send from
+			offset (int): where in the file to start
+			count (int): number of bytes to send
+		RETURNS: none
+		NOTES: the data goes from the file to the socket with sendfile where
+			the platform has it, without passing through python, and
+			uncompressed. Raises EOFError if the file is shorter than
+			expected, after padding the frame so the connection stays
+			usable
+		"""
+		self.frame_writer.begin_raw()
+		try:
+			run_from_thread(self.loop, self.send_frames(fh, offset, count))
+		finally:
+			self.frame_writer.end_raw()
+
+	############################################################################
+	async def send_frames(self, fh, offset, count):
+		"""
+		PURPOSE: writes the frames for send_file
+		ARGS:
+			see send_file
+		RETURNS: none
+		NOTES: runs on the loop
+		"""
+		while count > 0:
+			num_bytes = min(count, FILE_FRAME_SIZE)
+			self.stream_writer.write(FRAME_HEADER.pack(CHANNEL_FILE, num_bytes))
+			num_sent = await self.loop.sendfile(self.stream_writer.transport, fh, offset, num_bytes)
+			if num_sent != num_bytes:
+				self.stream_writer.write(bytes(num_bytes - num_sent))
+				raise EOFError("file ended %d bytes early" % (count - num_sent))
+			offset += num_sent
+			count -= num_sent
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
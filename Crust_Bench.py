@@ -0,0 +1,833 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+from Crust import Crust
+from Crust_Protocol import Frame_Reader, encode_frame, encode_hello, CHANNEL_STDIN, CHANNEL_STDOUT, CHANNEL_CONTROL, CTRL_PROMPT, CTRL_EXIT, CTRL_HELLO
+from Crust_Transfer import Transfer_Client, RECV_BUFFER_SIZE
+import io
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import threading
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+DEFAULT_RESULTS_FILE = "crust_bench.json"
+DEFAULT_REPEATS = 3
+
+#Size of the fixtures, 'full' is what regressions are tracked with and
+#'quick' is for checking the suite itself runs
+SCALES = {
+	"full": {
+		"small_dir": 10000,
+		"large_dir": 100000,
+		"tree_depth": 6,
+		"tree_fanout": 5,
+		"tree_files": 10,
+		"big_file": 2 * 1024 * 1024 * 1024,
+		"parse_lines": 200000,
+		"latency_rounds": 2000,
+	},
+	"quick": {
+		"small_dir": 1000,
+		"large_dir": 10000,
+		"tree_depth": 4,
+		"tree_fanout": 4,
+		"tree_files": 10,
+		"big_file": 64 * 1024 * 1024,
+		"parse_lines": 20000,
+		"latency_rounds": 200,
+	},
+}
+
+#Lines parse_input is timed on
+PARSE_LINES = (
+	"ls -l -h /usr/lib",
+	"cat notes.txt | grep -i todo | wc -l",
+	"cd ..; pwd; ls -a",
+	"locate --root /home --max-depth 4 --exclude .git crust",
+)
+
+FILE_BLOCK_SIZE = 1024 * 1024
+#Name every tree file contains, so locate matches every file
+TREE_FILE_NAME = "leaf%d.txt"
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Example_Server.py")
+SERVER_START_TIMEOUT = 10.0
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def make_flat_dir(dir_path, num_entries):
+	"""
+	PURPOSE: creates a directory full of empty files
+	ARGS:
+		dir_path (str): directory to create
+		num_entries (int): number of files to put in it
+	RETURNS: none
+	NOTES:
+	"""
+	os.makedirs(dir_path, exist_ok=True)
+	for ii in range(num_entries):
+		open(os.path.join(dir_path, "file%06d" % ii), 'wb').close()
+
+################################################################################
+def make_tree(dir_path, depth, fanout, num_files):
+	"""
+	PURPOSE: creates a deep tree of directories and small files
+	ARGS:
+		dir_path (str): root of the tree
+		depth (int): number of directory levels below the root
+		fanout (int): number of subdirectories of each directory
+		num_files (int): number of files in each directory
+	RETURNS: (tuple) number of directories and number of files created
+	NOTES:
+	"""
+	num_dirs = 0
+	total_files = 0
+	stack = [(dir_path, 0)]
+	while stack:
+		cur_path, cur_depth = stack.pop()
+		os.makedirs(cur_path, exist_ok=True)
+		num_dirs += 1
+		for ii in range(num_files):
+			with open(os.path.join(cur_path, TREE_FILE_NAME % ii), 'wb') as fh:
+				fh.write(b"x" * 64)
+		total_files += num_files
+		if cur_depth < depth:
+			for ii in range(fanout):
+				stack.append((os.path.join(cur_path, "dir%d" % ii), cur_depth + 1))
+	return num_dirs, total_files
+
+################################################################################
+def make_big_file(file_path, size):
+	"""
+	PURPOSE: creates a large file of text
+	ARGS:
+		file_path (str): file to create
+		size (int): size of the file in bytes
+	RETURNS: none
+	NOTES: the data is real, not sparse, so copies cannot skip holes
+	"""
+	line = b"%s\n" % (b"crust" * 15)
+	block = (line * (FILE_BLOCK_SIZE // len(line) + 1))[:FILE_BLOCK_SIZE]
+	with open(file_path, 'wb') as fh:
+		remaining = size
+		while remaining > 0:
+			fh.write(block[:remaining])
+			remaining -= len(block)
+
+################################################################################
+def summarize(seconds, ops=None, num_bytes=None):
+	"""
+	PURPOSE: turns the timings of a benchmark into a result
+	ARGS:
+		seconds (list): duration of each run
+		ops (int): operations done per run, None if not meaningful
+		num_bytes (int): bytes moved per run, None if not meaningful
+	RETURNS: (dict) json serializable result, rates are based on the best run
+	NOTES:
+	"""
+	ordered = sorted(seconds)
+	best = ordered[0]
+	result = {
+		"runs": len(seconds),
+		"best": best,
+		"median": ordered[len(ordered) // 2],
+		"worst": ordered[-1],
+	}
+	if ops is not None:
+		result["ops"] = ops
+		result["ops_per_sec"] = ops / best if best else None
+	if num_bytes is not None:
+		result["bytes"] = num_bytes
+		result["bytes_per_sec"] = num_bytes / best if best else None
+	return result
+
+################################################################################
+def git_version():
+	"""
+	PURPOSE: gets the version of the code being benchmarked
+	ARGS:
+	RETURNS: (str) git description of the checkout, None if not available
+	NOTES:
+	"""
+	try:
+		return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(SERVER_SCRIPT), stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+################################################################################
+def free_port():
+	"""
+	PURPOSE: finds a loopback port nothing is listening on
+	ARGS:
+	RETURNS: (int) port number
+	NOTES:
+	"""
+	with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+################################################################################
+def format_result(result):
+	"""
+	PURPOSE: formats a result for the progress log
+	ARGS:
+		result (dict): result of a benchmark
+	RETURNS: (str) one line summary
+	NOTES:
+	"""
+	if "error" in result:
+		return "FAILED %s" % result["error"]
+	parts = ["best %.4fs" % result["best"], "median %.4fs" % result["median"]]
+	if result.get("ops_per_sec") and result.get("ops", 1) > 1:
+		parts.append("%.0f ops/s" % result["ops_per_sec"])
+	if result.get("bytes_per_sec"):
+		parts.append("%.1f MiB/s" % (result["bytes_per_sec"] / (1024 * 1024)))
+	if "p99" in result:
+		parts.append("p99 %.0fus" % (result["p99"] * 1000000))
+	return ", ".join(parts)
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Bench_Client:
+	"""
+	Minimal client that runs commands on a Crust server and waits for each
+	prompt
+	"""
+	############################################################################
+	def __init__(self, port, compress=False):
+		"""
+		PURPOSE: creates a new Bench_Client and waits for the first prompt
+		ARGS:
+			port (int): loopback port the server listens on
+			compress (bool): true to ask the server to compress output
+		RETURNS: new instance of a Bench_Client
+		NOTES: takes part in every 'get' and 'put' the server asks for
+		"""
+		self.sock = socket.create_connection(("127.0.0.1", port))
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.reader = Frame_Reader(self.sock, RECV_BUFFER_SIZE)
+		self.transfers = Transfer_Client(self.sock, threading.Lock())
+		if compress:
+			self.sock.sendall(encode_hello())
+		self.wait_for_prompt()
+
+	############################################################################
+	def wait_for_prompt(self):
+		"""
+		PURPOSE: reads output until the server prompts again
+		ARGS:
+		RETURNS: (int) number of stdout bytes received
+		NOTES: raises ConnectionError if the server hangs up first
+		"""
+		num_bytes = 0
+		while True:
+			frame = self.reader.read_frame()
+			if frame is None:
+				raise ConnectionError("server closed the connection")
+			channel, payload = frame
+			if self.transfers.handle_frame(channel, payload):
+				continue
+			if channel == CHANNEL_STDOUT:
+				num_bytes += len(payload)
+			elif channel == CHANNEL_CONTROL and payload:
+				if payload[0] == CTRL_PROMPT:
+					return num_bytes
+				if payload[0] == CTRL_EXIT:
+					raise ConnectionError("server ended the session")
+				if payload[0] == CTRL_HELLO:
+					self.reader.start_decompression(payload[1:].decode("ascii"))
+
+	############################################################################
+	def command(self, cmd_str):
+		"""
+		PURPOSE: runs a command and waits for it to finish
+		ARGS:
+			cmd_str (str): command to run
+		RETURNS: (int) number of stdout bytes received
+		NOTES:
+		"""
+		self.sock.sendall(encode_frame(CHANNEL_STDIN, (cmd_str + "\n").encode("utf-8")))
+		return self.wait_for_prompt()
+
+	############################################################################
+	def close(self):
+		"""
+		PURPOSE: ends the session
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		try:
+			self.sock.sendall(encode_frame(CHANNEL_STDIN, b"exit\n"))
+		except OSError:
+			pass
+		self.sock.close()
+
+################################################################################
+class Bench:
+	"""
+	Builds the fixtures and runs every benchmark against them
+	"""
+	############################################################################
+	def __init__(self, work_dir, scale, repeats=DEFAULT_REPEATS):
+		"""
+		PURPOSE: creates a new Bench
+		ARGS:
+			work_dir (str): directory to create fixtures in
+			scale (dict): sizes of the fixtures, one of SCALES
+			repeats (int): number of times each benchmark is run
+		RETURNS: new instance of a Bench
+		NOTES:
+		"""
+		#Save arguments
+		self.work_dir = work_dir
+		self.scale = scale
+		self.repeats = max(1, repeats)
+
+		#Define properties
+		self.small_dir = os.path.join(work_dir, "small_dir")
+		self.large_dir = os.path.join(work_dir, "large_dir")
+		self.tree_dir = os.path.join(work_dir, "tree")
+		self.big_file = os.path.join(work_dir, "big_file.txt")
+		self.scratch_dir = os.path.join(work_dir, "scratch")
+		self.fixtures = {}
+		self.benchmarks = {
+			"parse_input": self.bench_parse_input,
+			"ls_small": self.bench_ls_small,
+			"ls_large": self.bench_ls_large,
+			"locate_walk": self.bench_locate_walk,
+			"locate_index": self.bench_locate_index,
+			"grep_file": self.bench_grep_file,
+			"grep_tree": self.bench_grep_tree,
+			"du_walk": self.bench_du_walk,
+			"du_cached": self.bench_du_cached,
+			"cat_devnull": self.bench_cat_devnull,
+			"cat_redirect": self.bench_cat_redirect,
+			"cp_file": self.bench_cp_file,
+			"cp_tree": self.bench_cp_tree,
+			"rm_tree": self.bench_rm_tree,
+			"server_latency": self.bench_server_latency,
+			"server_ls": self.bench_server_ls,
+			"server_cat": self.bench_server_cat,
+			"server_cat_zlib": self.bench_server_cat_zlib,
+			"server_get": self.bench_server_get,
+			"server_put": self.bench_server_put,
+		}
+
+	############################################################################
+	def setup(self):
+		"""
+		PURPOSE: creates the fixtures
+		ARGS:
+		RETURNS: none
+		NOTES: fixtures that already exist are reused
+		"""
+		os.makedirs(self.scratch_dir, exist_ok=True)
+		if not os.path.isdir(self.small_dir):
+			make_flat_dir(self.small_dir, self.scale["small_dir"])
+		if not os.path.isdir(self.large_dir):
+			make_flat_dir(self.large_dir, self.scale["large_dir"])
+		if not os.path.isdir(self.tree_dir):
+			num_dirs, num_files = make_tree(self.tree_dir, self.scale["tree_depth"], self.scale["tree_fanout"], self.scale["tree_files"])
+		else:
+			num_dirs = num_files = 0
+			for dir_path, dir_names, file_names in os.walk(self.tree_dir):
+				num_dirs += 1
+				num_files += len(file_names)
+		if not os.path.isfile(self.big_file) or os.path.getsize(self.big_file) != self.scale["big_file"]:
+			make_big_file(self.big_file, self.scale["big_file"])
+		self.fixtures = {
+			"small_dir_entries": self.scale["small_dir"],
+			"large_dir_entries": self.scale["large_dir"],
+			"tree_dirs": num_dirs,
+			"tree_files": num_files,
+			"big_file_bytes": self.scale["big_file"],
+		}
+
+	############################################################################
+	def new_shell(self, fout=None):
+		"""
+		PURPOSE: creates a shell to benchmark
+		ARGS:
+			fout (file-like object): where output goes, None to discard it
+		RETURNS: (Crust) shell working in the fixture directory
+		NOTES: the locate database lives in the work directory
+		"""
+		if fout is None:
+			fout = open(os.devnull, 'w')
+		crust = Crust(io.StringIO(), fout, io.StringIO(), cwd=self.work_dir)
+		crust.locate_db = os.path.join(self.work_dir, "locate.db")
+		return crust
+
+	############################################################################
+	def run_shell_command(self, crust, cmd_str):
+		"""
+		PURPOSE: runs a command and makes sure it worked
+		ARGS:
+			crust (Crust): shell to run the command in
+			cmd_str (str): command to run
+		RETURNS: (float) seconds the command took
+		NOTES: raises RuntimeError if the command failed, so a broken build
+			does not look fast
+		"""
+		cmd = crust.parse_input(cmd_str)[0]
+		start = time.perf_counter()
+		status = crust.run_command(cmd)
+		seconds = time.perf_counter() - start
+		if status:
+			raise RuntimeError("'%s' failed: %s" % (cmd_str, crust.ferr.getvalue().strip()))
+		return seconds
+
+	############################################################################
+	def time_command(self, cmd_str, cleanup=None):
+		"""
+		PURPOSE: times a shell command several times
+		ARGS:
+			cmd_str (str): command to run
+			cleanup (function): called after every run, untimed
+		RETURNS: (list) seconds of each run
+		NOTES:
+		"""
+		seconds = []
+		for ii in range(self.repeats):
+			crust = self.new_shell()
+			try:
+				seconds.append(self.run_shell_command(crust, cmd_str))
+			finally:
+				crust.fout.close()
+				if cleanup is not None:
+					cleanup()
+		return seconds
+
+	############################################################################
+	def clear_scratch(self):
+		"""
+		PURPOSE: empties the scratch directory
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		shutil.rmtree(self.scratch_dir, ignore_errors=True)
+		os.makedirs(self.scratch_dir, exist_ok=True)
+
+	############################################################################
+	def bench_parse_input(self):
+		"""
+		PURPOSE: times tokenizing lines of input
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		crust = self.new_shell()
+		crust.fout.close()
+		num_lines = self.scale["parse_lines"]
+		lines = [PARSE_LINES[ii % len(PARSE_LINES)] for ii in range(num_lines)]
+		seconds = []
+		for ii in range(self.repeats):
+			start = time.perf_counter()
+			for line in lines:
+				crust.parse_input(line)
+			seconds.append(time.perf_counter() - start)
+		return summarize(seconds, ops=num_lines, num_bytes=sum(len(line) for line in lines))
+
+	############################################################################
+	def bench_ls_small(self):
+		"""
+		PURPOSE: times 'ls -l' of a directory of small_dir entries
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		return summarize(self.time_command("ls -l small_dir"), ops=self.scale["small_dir"])
+
+	############################################################################
+	def bench_ls_large(self):
+		"""
+		PURPOSE: times 'ls -l' of a directory of large_dir entries
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		return summarize(self.time_command("ls -l large_dir"), ops=self.scale["large_dir"])
+
+	############################################################################
+	def bench_locate_walk(self):
+		"""
+		PURPOSE: times 'locate' walking the tree
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds = self.time_command("locate --root tree leaf")
+		return summarize(seconds, ops=self.fixtures["tree_dirs"] + self.fixtures["tree_files"])
+
+	############################################################################
+	def bench_locate_index(self):
+		"""
+		PURPOSE: times 'locate' reading an index of the tree
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: the index is built first, untimed
+		"""
+		crust = self.new_shell()
+		self.run_shell_command(crust, "updatedb --full %s" % self.tree_dir)
+		crust.fout.close()
+		#With only a name given locate uses the index
+		seconds = self.time_command("locate leaf")
+		return summarize(seconds, ops=self.fixtures["tree_files"])
+
+	############################################################################
+	def bench_grep_file(self):
+		"""
+		PURPOSE: times 'grep' counting matches in the big file
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: every line matches, so this is the cost of finding lines
+		"""
+		seconds = self.time_command("grep -c crust big_file.txt")
+		return summarize(seconds, num_bytes=self.scale["big_file"])
+
+	############################################################################
+	def bench_grep_tree(self):
+		"""
+		PURPOSE: times 'grep' searching every file of the tree
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: nothing matches, so this is the cost of opening and searching
+		"""
+		seconds = self.time_command("grep -rl crust tree")
+		return summarize(seconds, ops=self.fixtures["tree_files"])
+
+	############################################################################
+	def bench_du_walk(self):
+		"""
+		PURPOSE: times 'du' measuring the tree
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds = self.time_command("du -s --no-cache tree")
+		return summarize(seconds, ops=self.fixtures["tree_dirs"] + self.fixtures["tree_files"])
+
+	############################################################################
+	def bench_du_cached(self):
+		"""
+		PURPOSE: times 'du' measuring the tree again in the same shell
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: the first run fills the size cache, untimed. Directories
+			changed in the last couple of seconds are not cached
+		"""
+		crust = self.new_shell()
+		try:
+			self.run_shell_command(crust, "du -s tree")
+			seconds = [self.run_shell_command(crust, "du -s tree") for ii in range(self.repeats)]
+		finally:
+			crust.fout.close()
+		return summarize(seconds, ops=self.fixtures["tree_dirs"])
+
+	############################################################################
+	def bench_cat_devnull(self):
+		"""
+		PURPOSE: times 'cat' of the big file to /dev/null
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		return summarize(self.time_command("cat big_file.txt"), num_bytes=self.scale["big_file"])
+
+	############################################################################
+	def bench_cat_redirect(self):
+		"""
+		PURPOSE: times 'cat' of the big file into another file
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds = self.time_command("cat big_file.txt > scratch/cat_copy.txt", self.clear_scratch)
+		return summarize(seconds, num_bytes=self.scale["big_file"])
+
+	############################################################################
+	def bench_cp_file(self):
+		"""
+		PURPOSE: times 'cp' of the big file
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds = self.time_command("cp big_file.txt scratch/cp_copy.txt", self.clear_scratch)
+		return summarize(seconds, num_bytes=self.scale["big_file"])
+
+	############################################################################
+	def bench_cp_tree(self):
+		"""
+		PURPOSE: times 'cp -r' of the tree
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds = self.time_command("cp -r tree scratch/tree_copy", self.clear_scratch)
+		return summarize(seconds, ops=self.fixtures["tree_dirs"] + self.fixtures["tree_files"])
+
+	############################################################################
+	def bench_rm_tree(self):
+		"""
+		PURPOSE: times removing a copy of the tree
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: the copy is made before each run, untimed
+		"""
+		seconds = []
+		for ii in range(self.repeats):
+			self.clear_scratch()
+			make_tree(os.path.join(self.scratch_dir, "rm_tree"), self.scale["tree_depth"], self.scale["tree_fanout"], self.scale["tree_files"])
+			crust = self.new_shell()
+			try:
+				seconds.append(self.run_shell_command(crust, "rm scratch/rm_tree"))
+			finally:
+				crust.fout.close()
+		self.clear_scratch()
+		return summarize(seconds, ops=self.fixtures["tree_dirs"] + self.fixtures["tree_files"])
+
+	############################################################################
+	def start_server(self):
+		"""
+		PURPOSE: starts Example_Server.py on a free loopback port
+		ARGS:
+		RETURNS: (tuple) server process and port
+		NOTES: raises RuntimeError if the server does not come up
+		"""
+		port = free_port()
+		proc = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--port", str(port)], cwd=self.work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		deadline = time.monotonic() + SERVER_START_TIMEOUT
+		while time.monotonic() < deadline:
+			try:
+				socket.create_connection(("127.0.0.1", port)).close()
+				return proc, port
+			except OSError:
+				if proc.poll() is not None:
+					break
+				time.sleep(0.05)
+		self.stop_server(proc)
+		raise RuntimeError("server did not start")
+
+	############################################################################
+	def stop_server(self, proc):
+		"""
+		PURPOSE: stops a server started by start_server()
+		ARGS:
+			proc (subprocess.Popen): server process
+		RETURNS: none
+		NOTES:
+		"""
+		if proc.poll() is None:
+			proc.send_signal(signal.SIGINT)
+			try:
+				proc.wait(SERVER_START_TIMEOUT)
+			except subprocess.TimeoutExpired:
+				proc.kill()
+				proc.wait()
+
+	############################################################################
+	def run_remote(self, cmd_str, rounds, compress=False):
+		"""
+		PURPOSE: times a command run through the server
+		ARGS:
+			cmd_str (str): command to run, relative paths are from the work
+				directory
+			rounds (int): number of times to run it
+			compress (bool): true to have the server compress output
+		RETURNS: (tuple) seconds of each round and stdout bytes of the last
+		NOTES:
+		"""
+		proc, port = self.start_server()
+		try:
+			client = Bench_Client(port, compress)
+			try:
+				client.command("cd %s" % self.work_dir)
+				seconds = []
+				num_bytes = 0
+				for ii in range(rounds):
+					start = time.perf_counter()
+					num_bytes = client.command(cmd_str)
+					seconds.append(time.perf_counter() - start)
+			finally:
+				client.close()
+		finally:
+			self.stop_server(proc)
+		return seconds, num_bytes
+
+	############################################################################
+	def bench_server_latency(self):
+		"""
+		PURPOSE: times round trips of a trivial command through the server
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: the result also has the 99th percentile
+		"""
+		seconds, num_bytes = self.run_remote("pwd", self.scale["latency_rounds"])
+		result = summarize(seconds, ops=1)
+		ordered = sorted(seconds)
+		result["p99"] = ordered[min(len(ordered) - 1, (len(ordered) * 99) // 100)]
+		return result
+
+	############################################################################
+	def bench_server_ls(self):
+		"""
+		PURPOSE: times 'ls -l' of the large directory through the server
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds, num_bytes = self.run_remote("ls -l large_dir", self.repeats)
+		return summarize(seconds, ops=self.scale["large_dir"], num_bytes=num_bytes)
+
+	############################################################################
+	def bench_server_cat(self):
+		"""
+		PURPOSE: times 'cat' of the big file through the server
+		ARGS:
+		RETURNS: (dict) result
+		NOTES:
+		"""
+		seconds, num_bytes = self.run_remote("cat big_file.txt", self.repeats)
+		return summarize(seconds, num_bytes=num_bytes)
+
+	############################################################################
+	def bench_server_cat_zlib(self):
+		"""
+		PURPOSE: times 'cat' of the big file through the server with
+			compression
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: over loopback this measures the cost of compressing, the gain
+			shows on slow links
+		"""
+		seconds, num_bytes = self.run_remote("cat big_file.txt", self.repeats, compress=True)
+		return summarize(seconds, num_bytes=num_bytes)
+
+	############################################################################
+	def bench_server_get(self):
+		"""
+		PURPOSE: times 'get' of the big file through the server
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: the client saves it to the scratch directory
+		"""
+		local_path = os.path.join(self.scratch_dir, "got.bin")
+		seconds, num_bytes = self.run_remote("get big_file.txt %s" % local_path, self.repeats)
+		num_got = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+		self.clear_scratch()
+		if num_got != self.scale["big_file"]:
+			raise RuntimeError("'get' saved %d of %d bytes" % (num_got, self.scale["big_file"]))
+		return summarize(seconds, num_bytes=num_got)
+
+	############################################################################
+	def bench_server_put(self):
+		"""
+		PURPOSE: times 'put' of the big file through the server
+		ARGS:
+		RETURNS: (dict) result
+		NOTES: the server saves it to the scratch directory
+		"""
+		remote_path = os.path.join(self.scratch_dir, "put.bin")
+		seconds, num_bytes = self.run_remote("put %s %s" % (self.big_file, remote_path), self.repeats)
+		num_put = os.path.getsize(remote_path) if os.path.exists(remote_path) else 0
+		self.clear_scratch()
+		if num_put != self.scale["big_file"]:
+			raise RuntimeError("'put' saved %d of %d bytes" % (num_put, self.scale["big_file"]))
+		return summarize(seconds, num_bytes=num_put)
+
+	############################################################################
+	def run(self, names=None, log=None):
+		"""
+		PURPOSE: runs benchmarks
+		ARGS:
+			names (list): benchmarks to run, None for all of them
+			log (file-like object): where progress is written, None for none
+		RETURNS: (dict) benchmark name to result
+		NOTES: a benchmark that fails is recorded with its error instead of
+			stopping the suite
+		"""
+		if names is None:
+			names = list(self.benchmarks)
+		results = {}
+		for name in names:
+			if log is not None:
+				log.write("%-16s " % name)
+				log.flush()
+			try:
+				result = self.benchmarks[name]()
+			except Exception as e:
+				result = {"error": "%s: %s" % (type(e).__name__, e)}
+			results[name] = result
+			if log is not None:
+				log.write("%s\n" % format_result(result))
+		return results
+
+################################################################################
+###                                  Main                                    ###
+################################################################################
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark Crust builtins and the example server")
+	parser.add_argument("--out", default=DEFAULT_RESULTS_FILE, help="json file to write results to")
+	parser.add_argument("--work-dir", help="directory for fixtures, kept between runs, default is a temporary directory")
+	parser.add_argument("--scale", choices=sorted(SCALES), default="full", help="size of the fixtures")
+	parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help="runs of each benchmark")
+	parser.add_argument("--only", help="comma separated benchmarks to run")
+	parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+	args = parser.parse_args()
+
+	work_dir = args.work_dir
+	if work_dir is None:
+		work_dir = tempfile.mkdtemp(prefix="crust_bench_")
+	work_dir = os.path.abspath(work_dir)
+	bench = Bench(work_dir, SCALES[args.scale], args.repeats)
+	if args.list:
+		print("\n".join(bench.benchmarks))
+		sys.exit(0)
+	names = None
+	if args.only:
+		names = args.only.split(",")
+		unknown = [name for name in names if name not in bench.benchmarks]
+		if unknown:
+			parser.error("unknown benchmarks: %s" % ", ".join(unknown))
+
+	try:
+		print("Creating fixtures in %s..." % work_dir)
+		bench.setup()
+		results = bench.run(names, sys.stdout)
+	finally:
+		if args.work_dir is None:
+			shutil.rmtree(work_dir, ignore_errors=True)
+
+	report = {
+		"version": git_version(),
+		"time": time.time(),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"cpu_count": os.cpu_count(),
+		"scale": args.scale,
+		"repeats": bench.repeats,
+		"fixtures": bench.fixtures,
+		"results": results,
+	}
+	with open(args.out, 'w') as fh:
+		json.dump(report, fh, indent=1, sort_keys=True)
+	print("Results written to %s" % args.out)
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
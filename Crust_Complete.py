@@ -0,0 +1,215 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import time
+import threading
+import collections
+from Crust_Lexer import BACKSLASH_ESCAPES
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Directory listings a session keeps
+MAX_CACHED_DIRS = 64
+#Max number of candidates given for one completion
+MAX_COMPLETIONS = 1000
+#Directory timestamps are only so fine, a listing taken this soon after the
+#directory last changed may miss a change with the same timestamp so it is
+#not trusted (seconds)
+MTIME_GRANULARITY = 2.0
+#Characters that end the word being completed
+WORD_BREAKS = " \t\n;|&>"
+#Characters after which the next word is a command, the target of a
+#redirection is a path
+COMMAND_BREAKS = ";|&"
+#Characters escaped with a backslash in completed words
+ESCAPE_CHARS = " \t'\"\\;&|>#*?["
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def find_word_start(text):
+	"""
+	PURPOSE: finds where the last word of a line starts
+	ARGS:
+		text (str): line up to the cursor
+	RETURNS: (int) index of the first character of the last word
+	NOTES: backslash escaped breaks are part of the word
+	"""
+	ii = len(text)
+	while ii > 0:
+		if text[ii - 1] in WORD_BREAKS:
+			num_slashes = 0
+			while ii - 2 - num_slashes >= 0 and text[ii - 2 - num_slashes] == '\\':
+				num_slashes += 1
+			if not (BACKSLASH_ESCAPES and num_slashes % 2):
+				break
+		ii -= 1
+	return ii
+
+################################################################################
+def unescape_word(word):
+	"""
+	PURPOSE: removes the backslash escapes from a word
+	ARGS:
+		word (str): word as typed
+	RETURNS: (str) word as the shell sees it
+	NOTES:
+	"""
+	if not BACKSLASH_ESCAPES or '\\' not in word:
+		return word
+	chars = []
+	ii = 0
+	while ii < len(word):
+		if word[ii] == '\\' and ii + 1 < len(word):
+			ii += 1
+		chars.append(word[ii])
+		ii += 1
+	return "".join(chars)
+
+################################################################################
+def escape_word(word):
+	"""
+	PURPOSE: escapes the characters of a word the shell would treat specially
+	ARGS:
+		word (str): word as the shell should see it
+	RETURNS: (str) word to type
+	NOTES:
+	"""
+	if not BACKSLASH_ESCAPES:
+		return word
+	return "".join("\\" + ch if ch in ESCAPE_CHARS else ch for ch in word)
+
+################################################################################
+def complete(text, cwd, command_names, listing_cache, max_results=MAX_COMPLETIONS):
+	"""
+	PURPOSE: finds the ways the last word of a line can be completed
+	ARGS:
+		text (str): line up to the cursor
+		cwd (str): directory relative paths are from
+		command_names (iterable): commands that can be completed
+		listing_cache (Listing_Cache): where directory listings come from
+		max_results (int): max number of candidates
+	RETURNS: (tuple) number of characters of the word being completed, and
+		sorted list of candidates, each a whole word ready to replace it
+	NOTES: the first word of a command is completed as a command name, or
+		as a path if it has a separator in it. Anything else, including
+		the target of a redirection, is completed as a path. A word that
+		starts with a quote is completed inside the quote, otherwise
+		special characters are escaped
+	"""
+	word_start = find_word_start(text)
+	word = text[word_start:]
+	before = text[:word_start].rstrip()
+	if (not before or before[-1] in COMMAND_BREAKS) and os.sep not in word:
+		candidates = sorted(name for name in set(command_names) if name.startswith(word))
+		return len(word), candidates[:max_results]
+
+	quote = ""
+	if word[:1] in ("'", '"'):
+		quote = word[0]
+		raw_word = word[1:]
+	else:
+		raw_word = unescape_word(word)
+	dir_part = raw_word[:raw_word.rfind(os.sep) + 1]
+	prefix = raw_word[len(dir_part):]
+	if dir_part:
+		dir_path = os.path.join(cwd, os.path.expanduser(dir_part))
+	else:
+		dir_path = cwd
+	try:
+		entries = listing_cache.list_dir(dir_path)
+	except OSError:
+		return len(word), []
+
+	candidates = []
+	for name, is_dir in entries:
+		if not name.startswith(prefix) or (name.startswith('.') and not prefix.startswith('.')) or '\n' in name:
+			continue
+		completion = dir_part + name
+		if is_dir:
+			completion += os.sep
+		if quote:
+			candidates.append(quote + completion)
+		else:
+			candidates.append(escape_word(completion))
+		if len(candidates) >= max_results:
+			break
+	return len(word), candidates
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Listing_Cache:
+	"""
+	Directory listings kept until the directory changes
+	"""
+	############################################################################
+	def __init__(self, max_dirs=MAX_CACHED_DIRS):
+		"""
+		PURPOSE: creates a new Listing_Cache
+		ARGS:
+			max_dirs (int): number of listings kept, the least recently used
+				is dropped past this
+		RETURNS: new instance of a Listing_Cache
+		NOTES: thread safe. A listing is checked against the directory's
+			inode and modification time, so using it costs one stat instead
+			of a scan of the directory
+		"""
+		#Save arguments
+		self.max_dirs = max_dirs
+
+		#Define properties
+		self.lock = threading.Lock()
+		self.listings = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	############################################################################
+	def list_dir(self, path):
+		"""
+		PURPOSE: lists a directory
+		ARGS:
+			path (str): directory to list
+		RETURNS: (list) sorted (name, is_dir) of every entry. Shared with
+			the cache so it must not be changed
+		NOTES: raises OSError if the directory cannot be listed. Symlinks to
+			directories count as directories
+		"""
+		st = os.stat(path)
+		version = (st.st_dev, st.st_ino, st.st_mtime_ns)
+		with self.lock:
+			cached = self.listings.get(path)
+			if cached is not None and cached[0] == version:
+				self.listings.move_to_end(path)
+				self.hits += 1
+				return cached[1]
+			self.misses += 1
+
+		entries = []
+		with os.scandir(path) as it:
+			for entry in it:
+				try:
+					is_dir = entry.is_dir()
+				except OSError:
+					is_dir = False
+				entries.append((entry.name, is_dir))
+		entries.sort()
+
+		#A change made right after the listing could leave the timestamp as
+		#it was, so such listings are only used once
+		if time.time() - st.st_mtime < MTIME_GRANULARITY:
+			with self.lock:
+				self.listings.pop(path, None)
+			return entries
+		with self.lock:
+			self.listings[path] = (version, entries)
+			self.listings.move_to_end(path)
+			while len(self.listings) > self.max_dirs:
+				self.listings.popitem(last=False)
+		return entries
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
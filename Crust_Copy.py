@@ -0,0 +1,292 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import stat
+import errno
+import threading
+try:
+	import fcntl
+except ImportError:
+	#Not available on windows
+	fcntl = None
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Max number of bytes moved per read/write or per zero-copy call
+COPY_CHUNK_SIZE = 1024 * 1024
+DEFAULT_NUM_WORKERS = 8
+#linux ioctl that makes the destination share the source's extents
+FICLONE = 0x40049409
+#Errors meaning a reflink can never work between these two files
+REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF)
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def copy_fd(src_fd, dst_fd):
+	"""
+	PURPOSE: copies everything from the current position of one file
+		descriptor to another
+	ARGS:
+		src_fd (int): file descriptor to read from
+		dst_fd (int): file descriptor to write to
+	RETURNS: (int) number of bytes copied
+	NOTES: tries os.copy_file_range and then os.sendfile so the data never
+		leaves the kernel, and falls back to reading and writing fixed size
+		chunks if neither works for this pair of descriptors.
+		copy_file_range is only used for regular files with a size, some
+		kernels return 0 at once for files like those in /proc that report
+		a size of 0 but have data
+	"""
+	total = 0
+
+	#Kernel side copy between files
+	if hasattr(os, "copy_file_range"):
+		src_st = os.fstat(src_fd)
+		if stat.S_ISREG(src_st.st_mode) and src_st.st_size > 0:
+			try:
+				while True:
+					num_copied = os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+					if num_copied == 0:
+						if total:
+							return total
+						#Nothing at all, let the other ways decide
+						break
+					total += num_copied
+			except OSError:
+				pass
+
+	#Kernel side copy from a file to anything (pipe, socket, file)
+	if hasattr(os, "sendfile"):
+		try:
+			while True:
+				num_copied = os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
+				if num_copied == 0:
+					return total
+				total += num_copied
+		except OSError:
+			pass
+
+	#Plain copy through a buffer
+	while True:
+		chunk = os.read(src_fd, COPY_CHUNK_SIZE)
+		if not chunk:
+			return total
+		view = memoryview(chunk)
+		while view:
+			num_written = os.write(dst_fd, view)
+			view = view[num_written:]
+		total += len(chunk)
+
+################################################################################
+def copy_file_to_writer(fh_in, write_bytes):
+	"""
+	PURPOSE: copies everything from the current position of a binary file to
+		a function that takes bytes
+	ARGS:
+		fh_in (file-like object): binary file to read, supporting readinto
+		write_bytes (function): called with each chunk read
+	RETURNS: (int) number of bytes copied
+	NOTES: every chunk is read into the same buffer and handed over as a
+		memoryview of it, write_bytes must copy anything it keeps
+	"""
+	buffer = bytearray(COPY_CHUNK_SIZE)
+	view = memoryview(buffer)
+	total = 0
+	while True:
+		num_read = fh_in.readinto(buffer)
+		if not num_read:
+			return total
+		write_bytes(view[:num_read])
+		total += num_read
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Copier:
+	"""
+	Copies files and directory trees on a pool of worker threads
+	"""
+	############################################################################
+	def __init__(self, num_workers=DEFAULT_NUM_WORKERS, preserve=False):
+		"""
+		PURPOSE: creates a new Copier
+		ARGS:
+			num_workers (int): number of files copied at the same time
+			preserve (bool): true to copy mode, owner and timestamps
+		RETURNS: new instance of a Copier
+		NOTES: errors do not stop the copy, they are collected in errors
+		"""
+		#Save arguments
+		self.num_workers = max(1, num_workers)
+		self.preserve = preserve
+
+		#Define properties
+		self.errors = []
+		self.num_files = 0
+		self.num_bytes = 0
+		self.lock = threading.Lock()
+		self.try_reflink = fcntl is not None and hasattr(fcntl, "ioctl")
+
+	############################################################################
+	def add_error(self, path, e):
+		"""
+		PURPOSE: records an error
+		ARGS:
+			path (str): path the error happened on
+			e (OSError): the error
+		RETURNS: none
+		NOTES: thread safe
+		"""
+		with self.lock:
+			self.errors.append((path, e))
+
+	############################################################################
+	def reflink(self, src_fd, dst_fd):
+		"""
+		PURPOSE: makes the destination share the source's data blocks
+		ARGS:
+			src_fd (int): file descriptor to clone from
+			dst_fd (int): file descriptor to clone to
+		RETURNS: (bool) true if the file was cloned
+		NOTES: only works on filesystems with copy on write (btrfs, xfs). Stops
+			trying after the first failure that means it is not supported
+		"""
+		if not self.try_reflink:
+			return False
+		try:
+			fcntl.ioctl(dst_fd, FICLONE, src_fd)
+			return True
+		except OSError as e:
+			if e.errno in REFLINK_UNSUPPORTED:
+				self.try_reflink = False
+			return False
+
+	############################################################################
+	def copy_metadata(self, dst, src_stat, follow_symlinks=True):
+		"""
+		PURPOSE: copies mode, owner and timestamps onto a copy
+		ARGS:
+			dst (str): path of the copy
+			src_stat (os.stat_result): stat of the original
+			follow_symlinks (bool): false if dst is a symlink
+		RETURNS: none
+		NOTES: changing the owner needs privileges so failure is ignored
+		"""
+		try:
+			os.chown(dst, src_stat.st_uid, src_stat.st_gid, follow_symlinks=follow_symlinks)
+		except (OSError, AttributeError, NotImplementedError):
+			pass
+		if follow_symlinks or os.chmod in os.supports_follow_symlinks:
+			os.chmod(dst, stat.S_IMODE(src_stat.st_mode), follow_symlinks=follow_symlinks)
+		if follow_symlinks or os.utime in os.supports_follow_symlinks:
+			os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns), follow_symlinks=follow_symlinks)
+
+	############################################################################
+	def copy_file(self, src, dst):
+		"""
+		PURPOSE: copies a single file
+		ARGS:
+			src (str): path of the file to copy
+			dst (str): path of the copy
+		RETURNS: none
+		NOTES: raises OSError on failure. Symlinks are copied as symlinks
+		"""
+		src_stat = os.lstat(src)
+		if stat.S_ISLNK(src_stat.st_mode):
+			if os.path.lexists(dst):
+				os.remove(dst)
+			os.symlink(os.readlink(src), dst)
+			if self.preserve:
+				self.copy_metadata(dst, src_stat, follow_symlinks=False)
+			return
+
+		with open(src, 'rb', buffering=0) as fh_in:
+			with open(dst, 'wb', buffering=0) as fh_out:
+				if not self.reflink(fh_in.fileno(), fh_out.fileno()):
+					copy_fd(fh_in.fileno(), fh_out.fileno())
+		if self.preserve:
+			self.copy_metadata(dst, src_stat)
+
+		with self.lock:
+			self.num_files += 1
+			self.num_bytes += src_stat.st_size
+
+	############################################################################
+	def copy_file_task(self, src, dst):
+		"""
+		PURPOSE: copies a single file, recording any error
+		ARGS:
+			src (str): path of the file to copy
+			dst (str): path of the copy
+		RETURNS: none
+		NOTES: to be run on the worker pool
+		"""
+		try:
+			self.copy_file(src, dst)
+		except OSError as e:
+			self.add_error(src, e)
+
+	############################################################################
+	def copy(self, pairs):
+		"""
+		PURPOSE: copies files and directory trees
+		ARGS:
+			pairs (list): (source, destination) paths to copy, directories are
+				copied recursively
+		RETURNS: none
+		NOTES: files are copied on the worker pool while the trees are still
+			being walked. At most a few times num_workers copies are queued
+			at once so memory stays bounded
+		"""
+		from concurrent.futures import ThreadPoolExecutor
+		from Crust_Walker import Walker
+		slots = threading.BoundedSemaphore(self.num_workers * 4)
+		dir_stats = []
+
+		def submit(src, dst):
+			slots.acquire()
+			future = pool.submit(self.copy_file_task, src, dst)
+			future.add_done_callback(lambda f: slots.release())
+
+		with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+			for src, dst in pairs:
+				if not os.path.isdir(src) or os.path.islink(src):
+					submit(src, dst)
+					continue
+
+				walker = Walker(src, onerror=lambda e: self.add_error(e.filename, e))
+				for dir_path, entries in walker.walk():
+					dst_dir = os.path.join(dst, os.path.relpath(dir_path, src))
+					try:
+						os.makedirs(dst_dir, exist_ok=True)
+					except OSError as e:
+						self.add_error(dir_path, e)
+						continue
+					if self.preserve:
+						try:
+							dir_stats.append((dst_dir, os.stat(dir_path)))
+						except OSError as e:
+							self.add_error(dir_path, e)
+					for entry in entries:
+						try:
+							is_dir = entry.is_dir(follow_symlinks=False)
+						except OSError:
+							is_dir = False
+						if not is_dir:
+							submit(entry.path, os.path.join(dst_dir, entry.name))
+
+		#Directory timestamps change as their contents are copied so they are
+		#set last, deepest first
+		dir_stats.sort(key=lambda item: len(item[0]), reverse=True)
+		for dst_dir, src_stat in dir_stats:
+			try:
+				self.copy_metadata(dst_dir, src_stat)
+			except OSError as e:
+				self.add_error(dst_dir, e)
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
@@ -0,0 +1,498 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import stat
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from Crust_Walker import DEFAULT_NUM_WORKERS
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Directories whose sizes are kept, the least recently used is dropped past this
+MAX_CACHED_DIRS = 200000
+#Directories changed this recently (seconds) are not cached, a change in the
+#same tick as the scan would not move the modification time
+MTIME_GRANULARITY = 2.0
+#Lines written at a time
+OUTPUT_BATCH_SIZE = 256
+#Block size sizes are shown in without '-h', like du
+BLOCK_SIZE = 1024
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def disk_usage(st):
+	"""
+	PURPOSE: gets how much space a file takes up
+	ARGS:
+		st (os.stat_result): stat of the file
+	RETURNS: (int) bytes allocated to the file, its size where the platform
+		does not report blocks
+	NOTES:
+	"""
+	blocks = getattr(st, "st_blocks", None)
+	if blocks is None:
+		return st.st_size
+	return blocks * 512
+
+################################################################################
+def scan_dir(path, st):
+	"""
+	PURPOSE: measures the entries of one directory
+	ARGS:
+		path (str): directory to scan
+		st (os.stat_result): stat of the directory
+	RETURNS: (Dir_Sizes) sizes of the directory
+	NOTES: raises OSError if the directory cannot be listed. Symlinks count
+		as themselves and are not followed. Entries that vanish during the
+		scan are skipped
+	"""
+	sizes = Dir_Sizes(disk_usage(st), st.st_size)
+	with os.scandir(path) as it:
+		for entry in it:
+			try:
+				if entry.is_dir(follow_symlinks=False):
+					sizes.subdirs.append(entry.name)
+					continue
+				entry_st = entry.stat(follow_symlinks=False)
+			except OSError:
+				continue
+			if entry_st.st_nlink > 1:
+				sizes.links.append((entry_st.st_dev, entry_st.st_ino, disk_usage(entry_st), entry_st.st_size))
+			else:
+				sizes.disk += disk_usage(entry_st)
+				sizes.apparent += entry_st.st_size
+	return sizes
+
+################################################################################
+def get_size_cache(crust):
+	"""
+	PURPOSE: gets the size cache of a shell
+	ARGS:
+		crust (Crust): shell running 'du'
+	RETURNS: (Size_Cache) cache, made the first time it is needed
+	NOTES:
+	"""
+	if crust.size_cache is None:
+		crust.size_cache = Size_Cache()
+	return crust.size_cache
+
+################################################################################
+def format_size(num_bytes, human):
+	"""
+	PURPOSE: formats a size for output
+	ARGS:
+		num_bytes (int): size in bytes
+		human (bool): true for 'ls -h' style, false for BLOCK_SIZE blocks
+	RETURNS: (str) formatted size
+	NOTES: blocks are rounded up, like du
+	"""
+	if human:
+		from Crust import human_readable_size
+		return human_readable_size(num_bytes)
+	return str(-(-num_bytes // BLOCK_SIZE))
+
+################################################################################
+def path_within(path, parent):
+	"""
+	PURPOSE: checks whether a path is a directory or something under it
+	ARGS:
+		path (str): normalized full path
+		parent (str): normalized full path of the directory
+	RETURNS: (bool) true if path is parent or inside it
+	NOTES:
+	"""
+	return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+################################################################################
+def parse_du_args(crust, cmd_args):
+	"""
+	PURPOSE: reads the arguments of 'du'
+	ARGS:
+		crust (Crust): shell running the command
+		cmd_args (list): list of strings representing arguments
+	RETURNS: (dict) options and paths, None after reporting a usage error
+	NOTES:
+	"""
+	options = {"human": False, "apparent": False, "max_depth": None, "top": None, "use_cache": True, "paths": []}
+	ii = 0
+	while ii < len(cmd_args):
+		cur_arg = cmd_args[ii]
+		if cur_arg in ("--max-depth", "-d", "--top", "-n"):
+			if len(cmd_args) == (ii + 1):
+				crust.write_err_and_flush("du: %s requires a value\n" % cur_arg)
+				return None
+			ii += 1
+			try:
+				value = int(cmd_args[ii])
+			except ValueError:
+				value = -1
+			if value < 0:
+				crust.write_err_and_flush("du: invalid value '%s' for %s\n" % (cmd_args[ii], cur_arg))
+				return None
+			if cur_arg in ("--max-depth", "-d"):
+				options["max_depth"] = value
+			else:
+				options["top"] = value
+		elif cur_arg == "--apparent-size":
+			options["apparent"] = True
+		elif cur_arg == "--no-cache":
+			options["use_cache"] = False
+		elif cur_arg.startswith("-") and not cur_arg.startswith("--") and len(cur_arg) > 1:
+			for cur_letter in cur_arg[1:]:
+				if cur_letter == 'h':
+					options["human"] = True
+				elif cur_letter == 's':
+					options["max_depth"] = 0
+				else:
+					crust.write_err_and_flush("du: unknown option -%s\n" % cur_letter)
+					return None
+		elif cur_arg.startswith("-") and len(cur_arg) > 1:
+			crust.write_err_and_flush("du: unknown option %s\n" % cur_arg)
+			return None
+		else:
+			options["paths"].append(cur_arg)
+		ii += 1
+	if not options["paths"]:
+		options["paths"].append(".")
+	return options
+
+################################################################################
+def cmd_du(crust, cmd_args):
+	"""
+	PURPOSE: executes 'du' command
+	ARGS:
+		crust (Crust): shell running the command
+		cmd_args (list): list of strings representing arguments
+	RETURNS: none
+	NOTES: may write to fout and ferr. Usage: du [-h] [-s] [--max-depth N]
+		[--top N] [--apparent-size] [--no-cache] [path...]. Shows the
+		total size of every directory down to --max-depth ('-s' for only
+		the paths given), children before parents, or with '--top N' the N
+		largest of them, largest first. Sizes are space used in 1K blocks,
+		'-h' for 'ls -h' style and '--apparent-size' for file sizes
+		instead. Files with several hard links count once, in the first of
+		their directories by path. As with du, a directory already shown
+		for an earlier path is not shown or counted again. Directories
+		whose modification time has not changed since the last 'du' in
+		this shell are not scanned again, see Size_Cache, '--no-cache'
+		scans everything
+	"""
+	options = parse_du_args(crust, cmd_args)
+	if options is None:
+		return
+	cache = get_size_cache(crust) if options["use_cache"] else None
+	usage = Usage_Tree(cache, crust.kill_event, lambda path, e: crust.write_err_and_flush("du: cannot read directory '%s': %s\n" % (path, e.strerror or e)))
+
+	roots = []
+	for path in options["paths"]:
+		full_path = crust.abs_path(path)
+		try:
+			st = os.stat(full_path)
+		except OSError as e:
+			crust.write_err_and_flush("du: cannot access '%s': %s\n" % (path, e.strerror or e))
+			continue
+		full_path = os.path.normpath(full_path)
+		if any(path_within(full_path, root[0]) for root in roots if stat.S_ISDIR(root[2].st_mode)):
+			#Already shown as part of an earlier path, like du
+			continue
+		if stat.S_ISDIR(st.st_mode):
+			usage.add_root(full_path, st)
+		roots.append((full_path, path.rstrip(os.sep) or os.sep, st))
+	if not usage.walk():
+		from Crust import Job_Killed
+		raise Job_Killed()
+	totals = usage.totals(options["apparent"])
+
+	lines = []
+	for root_index, (full_path, shown_root, st) in enumerate(roots):
+		if not stat.S_ISDIR(st.st_mode):
+			size = st.st_size if options["apparent"] else disk_usage(st)
+			lines.append((size, shown_root))
+			continue
+		#Earlier paths inside this one were shown already, leave them out
+		shown_before = [root[0] for root in roots[:root_index] if stat.S_ISDIR(root[2].st_mode) and path_within(root[0], full_path)]
+		shown_before = [path for path in shown_before if not any(other != path and path_within(path, other) for other in shown_before)]
+		totals_left = {}
+		for path in shown_before:
+			parent = path
+			while parent != full_path:
+				parent = os.path.dirname(parent)
+				totals_left[parent] = totals_left.get(parent, 0) + totals[path]
+		for dir_path, depth in usage.post_order(full_path, options["max_depth"], set(shown_before)):
+			rest = dir_path[len(full_path):].lstrip(os.sep)
+			if not rest:
+				shown_path = shown_root
+			elif shown_root.endswith(os.sep):
+				shown_path = shown_root + rest
+			else:
+				shown_path = shown_root + os.sep + rest
+			lines.append((totals[dir_path] - totals_left.get(dir_path, 0), shown_path))
+
+	if options["top"] is not None:
+		lines.sort(key=lambda line: (-line[0], line[1]))
+		del lines[options["top"]:]
+	for ii in range(0, len(lines), OUTPUT_BATCH_SIZE):
+		batch = ["%s\t%s\n" % (format_size(size, options["human"]), shown_path) for size, shown_path in lines[ii:ii + OUTPUT_BATCH_SIZE]]
+		crust.write_out_and_flush("".join(batch))
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Dir_Sizes:
+	"""
+	Space used by the entries of one directory, not counting subdirectories
+	"""
+	__slots__ = ("disk", "apparent", "subdirs", "links")
+
+	############################################################################
+	def __init__(self, disk=0, apparent=0):
+		"""
+		PURPOSE: creates a new Dir_Sizes
+		ARGS:
+			disk (int): bytes allocated to the directory and its files
+			apparent (int): size in bytes of the directory and its files
+		RETURNS: new instance of a Dir_Sizes
+		NOTES: files with more than one hard link are kept apart in links
+			so they can be counted once across the whole walk
+		"""
+		#Save arguments
+		self.disk = disk
+		self.apparent = apparent
+
+		#Define properties
+		self.subdirs = []
+		self.links = []
+
+################################################################################
+class Size_Cache:
+	"""
+	Sizes of directories kept until the directory changes
+	"""
+	############################################################################
+	def __init__(self, max_dirs=MAX_CACHED_DIRS):
+		"""
+		PURPOSE: creates a new Size_Cache
+		ARGS:
+			max_dirs (int): number of directories kept, the least recently
+				used is dropped past this
+		RETURNS: new instance of a Size_Cache
+		NOTES: thread safe. Sizes are checked against the directory's inode
+			and modification time, so reusing them costs one stat instead of
+			a scan and a stat of every entry. Adding, removing or renaming
+			an entry changes the time, a file growing in place does not, so
+			its new size shows once its directory next changes
+		"""
+		#Save arguments
+		self.max_dirs = max_dirs
+
+		#Define properties
+		self.lock = threading.Lock()
+		self.dirs = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	############################################################################
+	def measure(self, path, st):
+		"""
+		PURPOSE: gets the sizes of a directory's entries
+		ARGS:
+			path (str): directory to measure
+			st (os.stat_result): stat of the directory
+		RETURNS: (Dir_Sizes) sizes of the directory. Shared with the cache
+			so it must not be changed
+		NOTES: raises OSError if the directory cannot be listed
+		"""
+		version = (st.st_dev, st.st_ino, st.st_mtime_ns)
+		with self.lock:
+			cached = self.dirs.get(path)
+			if cached is not None and cached[0] == version:
+				self.dirs.move_to_end(path)
+				self.hits += 1
+				return cached[1]
+			self.misses += 1
+
+		sizes = scan_dir(path, st)
+		with self.lock:
+			if time.time() - st.st_mtime < MTIME_GRANULARITY:
+				self.dirs.pop(path, None)
+			else:
+				self.dirs[path] = (version, sizes)
+				self.dirs.move_to_end(path)
+				while len(self.dirs) > self.max_dirs:
+					self.dirs.popitem(last=False)
+		return sizes
+
+################################################################################
+class Usage_Tree:
+	"""
+	Sizes of every directory under a set of roots, measured in parallel
+	"""
+	############################################################################
+	def __init__(self, cache=None, kill_event=None, onerror=None, num_workers=DEFAULT_NUM_WORKERS):
+		"""
+		PURPOSE: creates a new Usage_Tree
+		ARGS:
+			cache (Size_Cache): sizes to reuse, None to scan everything
+			kill_event (threading.Event): stops the walk when set, ex: when
+				the job running it is killed
+			onerror (function): called with the path and the OSError of
+				each directory that cannot be read
+			num_workers (int): number of threads scanning directories
+		RETURNS: new instance of a Usage_Tree
+		NOTES: add roots with add_root then call walk
+		"""
+		#Save arguments
+		self.cache = cache
+		self.kill_event = kill_event
+		self.onerror = onerror
+		self.num_workers = max(1, num_workers)
+
+		#Define properties
+		self.roots = []
+		self.dirs = {}
+
+	############################################################################
+	def add_root(self, path, st):
+		"""
+		PURPOSE: adds a directory to measure
+		ARGS:
+			path (str): full, normalized path of the directory
+			st (os.stat_result): stat of the directory
+		RETURNS: none
+		NOTES:
+		"""
+		self.roots.append((path, st))
+
+	############################################################################
+	def measure(self, path, st):
+		"""
+		PURPOSE: measures one directory
+		ARGS:
+			path (str): directory to measure
+			st (os.stat_result): stat of the directory, None to stat it
+		RETURNS: (tuple) path and its Dir_Sizes
+		NOTES: run by the worker threads. A directory that cannot be read
+			counts only itself and has no subdirectories
+		"""
+		try:
+			if st is None:
+				st = os.lstat(path)
+			if self.cache is not None:
+				return path, self.cache.measure(path, st)
+			return path, scan_dir(path, st)
+		except OSError as e:
+			if self.onerror is not None:
+				self.onerror(path, e)
+			if st is None:
+				return path, None
+			return path, Dir_Sizes(disk_usage(st), st.st_size)
+
+	############################################################################
+	def walk(self):
+		"""
+		PURPOSE: measures every directory under the roots
+		ARGS:
+		RETURNS: (bool) true if the walk finished, false if it was stopped
+			by kill_event
+		NOTES: a directory's subdirectories are handed to the workers as
+			soon as it has been measured, each stats itself so directories
+			that are cached cost no scan. Roots inside other roots are only
+			measured once
+		"""
+		done_queue = queue.Queue()
+		with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+			num_pending = 0
+			for path, st in self.roots:
+				if path not in self.dirs:
+					self.dirs[path] = None
+					pool.submit(self.measure, path, st).add_done_callback(done_queue.put)
+					num_pending += 1
+			while num_pending:
+				path, sizes = done_queue.get().result()
+				num_pending -= 1
+				if self.kill_event is not None and self.kill_event.is_set():
+					pool.shutdown(wait=False, cancel_futures=True)
+					return False
+				self.dirs[path] = sizes
+				if sizes is None:
+					continue
+				for name in sizes.subdirs:
+					sub_path = os.path.join(path, name)
+					if sub_path not in self.dirs:
+						self.dirs[sub_path] = None
+						pool.submit(self.measure, sub_path, None).add_done_callback(done_queue.put)
+						num_pending += 1
+		return True
+
+	############################################################################
+	def totals(self, apparent=False):
+		"""
+		PURPOSE: adds up the size of each directory and everything under it
+		ARGS:
+			apparent (bool): true to add file sizes instead of space used
+		RETURNS: (dict) full path of each directory to its total in bytes
+		NOTES: each hard linked file is counted in the first directory by
+			path that has it, so the result does not depend on the order
+			the walk happened in
+		"""
+		totals = {}
+		first_links = {}
+		for path, sizes in self.dirs.items():
+			if sizes is None:
+				continue
+			totals[path] = sizes.apparent if apparent else sizes.disk
+			for dev, ino, disk, size in sizes.links:
+				key = (dev, ino)
+				first = first_links.get(key)
+				if first is None or path < first[0]:
+					first_links[key] = (path, size if apparent else disk)
+		for path, size in first_links.values():
+			totals[path] += size
+
+		#Longest paths first puts every directory before its parent
+		for path in sorted(totals, key=len, reverse=True):
+			parent = os.path.dirname(path)
+			if parent != path and parent in totals:
+				totals[parent] += totals[path]
+		return totals
+
+	############################################################################
+	def post_order(self, root, max_depth=None, skip=()):
+		"""
+		PURPOSE: lists a root and the directories under it
+		ARGS:
+			root (str): root given to add_root
+			max_depth (int): how many levels below root to list, None for no
+				limit
+			skip (set): full paths of directories to leave out along with
+				everything under them
+		RETURNS: (generator) (full path, depth) of each directory, sorted
+			by name with children before their parent, like du
+		NOTES:
+		"""
+		if self.dirs.get(root) is None:
+			return
+		stack = [(root, 0, False)]
+		while stack:
+			path, depth, expanded = stack.pop()
+			if expanded:
+				yield path, depth
+				continue
+			stack.append((path, depth, True))
+			sizes = self.dirs.get(path)
+			if sizes is None or (max_depth is not None and depth >= max_depth):
+				continue
+			for name in sorted(sizes.subdirs, reverse=True):
+				sub_path = os.path.join(path, name)
+				if self.dirs.get(sub_path) is not None and sub_path not in skip:
+					stack.append((sub_path, depth + 1, False))
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
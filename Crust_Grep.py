@@ -0,0 +1,415 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import re
+import mmap
+import stat
+import functools
+import itertools
+import collections
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Worker processes searching files, shared by every shell in the process
+DEFAULT_NUM_PROCESSES = os.cpu_count() or 1
+#Files are handed to a worker in batches of up to this many files or bytes,
+#whichever comes first, so small files do not cost a round trip each
+BATCH_FILES = 256
+BATCH_BYTES = 16 * 1024 * 1024
+#Batches each worker may have queued, more would only hold results in memory
+BATCHES_PER_PROCESS = 2
+#Files are searched this much at a time, the end moved to a line end
+CHUNK_SIZE = 256 * 1024
+#Matches skipped to in a chunk before the rest of it is tested line by line
+MAX_SKIPS = 16
+#Files smaller than this are read instead of mapped, mapping costs more than
+#it saves for them
+MMAP_MIN_SIZE = 64 * 1024
+#A NUL byte this close to the start makes a file binary, its lines are not
+#printed
+BINARY_CHECK_SIZE = 8192
+#Characters that make a pattern more than a plain string
+REGEX_CHARS = ".^$*+?{}[]\\|()"
+
+#What is reported for each file
+MODE_LINES = "lines"
+MODE_COUNT = "count"
+MODE_FILES = "files"
+
+#Process pool, made the first time it is needed
+PROCESS_POOL = None
+PROCESS_POOL_SIZE = 0
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+@functools.lru_cache(maxsize=64)
+def make_finder(pattern, ignore_case):
+	"""
+	PURPOSE: compiles a pattern for searching bytes
+	ARGS:
+		pattern (bytes): regular expression
+		ignore_case (bool): true to match letters of either case
+	RETURNS: (tuple) find function, which takes (data, pos, endpos) and
+		returns the (start, end) of the first match in data[pos:endpos] or
+		None, and the search method of the compiled pattern, for testing
+		single lines
+	NOTES: plain strings are found with bytes.find, which is much faster
+		than the regex engine. Case is only ignored for ASCII letters.
+		Raises re.error for a bad pattern
+	"""
+	flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+	if not ignore_case and not any(chr(ch) in REGEX_CHARS for ch in pattern):
+		pattern_len = len(pattern)
+
+		def find(data, pos, endpos):
+			start = data.find(pattern, pos, endpos)
+			if start < 0:
+				return None
+			return start, start + pattern_len
+		return find, re.compile(re.escape(pattern), flags).search
+
+	search = re.compile(pattern, flags).search
+
+	def find(data, pos, endpos):
+		match = search(data, pos, endpos)
+		if match is None:
+			return None
+		return match.span()
+	return find, search
+
+################################################################################
+def split_lines(chunk):
+	"""
+	PURPOSE: splits text into lines
+	ARGS:
+		chunk (bytes): text, not empty
+	RETURNS: (list) lines without their newlines
+	NOTES:
+	"""
+	lines = chunk.split(b'\n')
+	if chunk.endswith(b'\n'):
+		lines.pop()
+	return lines
+
+################################################################################
+def matching_lines(data, find, search, invert=False):
+	"""
+	PURPOSE: finds the lines of a buffer that match
+	ARGS:
+		data (bytes-like object): text to search, ex: an mmap
+		find (function): from make_finder
+		search (function): from make_finder
+		invert (bool): true for the lines that do not match
+	RETURNS: (generator) list of the matching lines of each chunk of data,
+		without their newlines. Lists may be empty
+	NOTES: each chunk is searched as a whole and the search skips to the
+		end of each matching line, so lines with no match are never looked
+		at one by one. Once a chunk has had MAX_SKIPS matches the rest of it
+		is split into lines and each line tested, which is faster when most
+		lines match
+	"""
+	size = len(data)
+	pos = 0
+	while pos < size:
+		end = data.find(b'\n', min(pos + CHUNK_SIZE, size) - 1)
+		end = size if end < 0 else end + 1
+		if invert:
+			yield list(itertools.filterfalse(search, split_lines(data[pos:end])))
+			pos = end
+			continue
+
+		lines = []
+		num_skips = 0
+		while pos < end and num_skips < MAX_SKIPS:
+			span = find(data, pos, end)
+			if span is None:
+				pos = end
+				break
+			line_start = data.rfind(b'\n', pos, span[0]) + 1 or pos
+			line_end = data.find(b'\n', span[0], end)
+			if line_end < 0:
+				line_end = end
+			#A match running into the next line only counts within one
+			if span[1] <= line_end or find(data, line_start, line_end) is not None:
+				lines.append(data[line_start:line_end])
+			num_skips += 1
+			pos = line_end + 1
+		if pos < end:
+			#Most lines match, testing each is quicker than skipping
+			lines.extend(filter(search, split_lines(data[pos:end])))
+			pos = end
+		yield lines
+
+################################################################################
+def search_file(path, finder, invert, mode, prefix):
+	"""
+	PURPOSE: searches one file
+	ARGS:
+		path (str): file to search
+		finder (tuple): from make_finder
+		invert (bool): true to match the lines that do not match
+		mode (str): MODE_LINES, MODE_COUNT or MODE_FILES
+		prefix (bytes): put in front of every line output
+	RETURNS: (tuple) number of matching lines (at most 1 for MODE_FILES and
+		for binary files), matching lines for MODE_LINES (bytes, otherwise
+		None), and true if the file is binary
+	NOTES: raises OSError if the file cannot be read
+	"""
+	with open(path, 'rb', buffering=0) as fh:
+		size = os.fstat(fh.fileno()).st_size
+		if size == 0:
+			return 0, None, False
+		if size < MMAP_MIN_SIZE:
+			data = fh.read()
+		else:
+			data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			chunks = matching_lines(data, finder[0], finder[1], invert)
+			if mode == MODE_COUNT:
+				return sum(len(lines) for lines in chunks), None, False
+			is_binary = mode == MODE_LINES and data.find(b'\0', 0, BINARY_CHECK_SIZE) >= 0
+			if mode == MODE_FILES or is_binary:
+				return (1 if any(chunks) else 0), None, is_binary
+			out = bytearray()
+			separator = b'\n' + prefix
+			num_lines = 0
+			for lines in chunks:
+				if lines:
+					out += prefix
+					out += separator.join(lines)
+					out += b'\n'
+					num_lines += len(lines)
+			return num_lines, bytes(out), False
+		finally:
+			if isinstance(data, mmap.mmap):
+				data.close()
+
+################################################################################
+def search_files(files, pattern, ignore_case, invert, mode, with_names):
+	"""
+	PURPOSE: searches a batch of files
+	ARGS:
+		files (list): (path to open, path to show) of each file
+		pattern (bytes): regular expression
+		ignore_case (bool): true to match letters of either case
+		invert (bool): true to match the lines that do not match
+		mode (str): MODE_LINES, MODE_COUNT or MODE_FILES
+		with_names (bool): true to start each line with the file it is from
+	RETURNS: (list) (path to show, error, number of matching lines,
+		matching lines, binary) of each file, see search_file. Error is
+		None or the reason the file could not be read
+	NOTES: runs in the worker processes. The pattern is compiled once per
+		process
+	"""
+	finder = make_finder(pattern, ignore_case)
+	results = []
+	for path, shown_path in files:
+		prefix = b''
+		if with_names:
+			prefix = os.fsencode(shown_path) + b':'
+		try:
+			num_lines, out, is_binary = search_file(path, finder, invert, mode, prefix)
+		except (OSError, ValueError) as e:
+			results.append((shown_path, getattr(e, "strerror", None) or str(e), 0, None, False))
+			continue
+		results.append((shown_path, None, num_lines, out, is_binary))
+	return results
+
+################################################################################
+def get_process_pool(num_processes):
+	"""
+	PURPOSE: gets the pool of worker processes
+	ARGS:
+		num_processes (int): number of processes wanted
+	RETURNS: (concurrent.futures.ProcessPoolExecutor) the pool, None if
+		processes cannot be used here
+	NOTES: the pool is kept for the life of the process and only replaced
+		to change its size. Workers are started from a fork server where
+		there is one, forking a server with threads running commands is
+		not safe
+	"""
+	global PROCESS_POOL, PROCESS_POOL_SIZE
+	if PROCESS_POOL is not None and PROCESS_POOL_SIZE == num_processes:
+		return PROCESS_POOL
+	try:
+		import multiprocessing
+		from concurrent.futures import ProcessPoolExecutor
+		if "forkserver" in multiprocessing.get_all_start_methods():
+			context = multiprocessing.get_context("forkserver")
+		else:
+			context = multiprocessing.get_context()
+		pool = ProcessPoolExecutor(max_workers=num_processes, mp_context=context)
+	except (ImportError, OSError, NotImplementedError):
+		#ex: no working semaphores on this platform
+		return None
+	if PROCESS_POOL is not None:
+		PROCESS_POOL.shutdown(wait=False)
+	PROCESS_POOL = pool
+	PROCESS_POOL_SIZE = num_processes
+	return pool
+
+################################################################################
+def discard_process_pool(pool):
+	"""
+	PURPOSE: forgets a pool that stopped working
+	ARGS:
+		pool (concurrent.futures.ProcessPoolExecutor): pool that failed
+	RETURNS: none
+	NOTES: the next search starts a new one
+	"""
+	global PROCESS_POOL
+	if PROCESS_POOL is pool:
+		PROCESS_POOL = None
+	pool.shutdown(wait=False)
+
+################################################################################
+def make_batches(files):
+	"""
+	PURPOSE: groups files for the worker processes
+	ARGS:
+		files (iterable): (path to open, path to show, size) of each file
+	RETURNS: (generator) lists of (path to open, path to show), each up to
+		BATCH_FILES files or BATCH_BYTES bytes
+	NOTES: a batch is handed out as soon as it is full so workers start
+		while the tree is still being walked
+	"""
+	batch = []
+	batch_bytes = 0
+	for path, shown_path, size in files:
+		batch.append((path, shown_path))
+		batch_bytes += size
+		if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+			yield batch
+			batch = []
+			batch_bytes = 0
+	if batch:
+		yield batch
+
+################################################################################
+def search(files, pattern, ignore_case=False, invert=False, mode=MODE_LINES, with_names=False, num_processes=DEFAULT_NUM_PROCESSES):
+	"""
+	PURPOSE: searches files in parallel
+	ARGS:
+		files (iterable): (path to open, path to show, size) of each file,
+			may be a generator still walking a tree
+		pattern (bytes): regular expression
+		ignore_case (bool): true to match letters of either case
+		invert (bool): true to match the lines that do not match
+		mode (str): MODE_LINES, MODE_COUNT or MODE_FILES
+		with_names (bool): true to start each line with the file it is from
+		num_processes (int): number of worker processes, 1 to search in
+			this process
+	RETURNS: (generator) results of each file as from search_files, in the
+		order the files were given
+	NOTES: raises re.error for a bad pattern before anything is searched.
+		Results come back as soon as a batch is done and every batch
+		before it has been given out, at most BATCHES_PER_PROCESS batches
+		per process are ever waiting. Searches that fit in one batch are
+		done in this process, starting processes would take longer.
+		Closing the generator cancels the batches not yet started
+	"""
+	make_finder(pattern, ignore_case)
+	batches = make_batches(files)
+	first = next(batches, None)
+	if first is None:
+		return
+	second = next(batches, None)
+	pool = None
+	if second is not None and num_processes > 1:
+		pool = get_process_pool(num_processes)
+	if pool is None:
+		for batch in (first, second):
+			if batch is not None:
+				yield from search_files(batch, pattern, ignore_case, invert, mode, with_names)
+		for batch in batches:
+			yield from search_files(batch, pattern, ignore_case, invert, mode, with_names)
+		return
+
+	from concurrent.futures.process import BrokenProcessPool
+	max_pending = num_processes * BATCHES_PER_PROCESS
+	pending = collections.deque()
+	try:
+		for batch in (first, second):
+			pending.append(pool.submit(search_files, batch, pattern, ignore_case, invert, mode, with_names))
+		for batch in batches:
+			#Hand back whatever is done before walking further
+			while pending and (len(pending) >= max_pending or pending[0].done()):
+				yield from pending.popleft().result()
+			pending.append(pool.submit(search_files, batch, pattern, ignore_case, invert, mode, with_names))
+		while pending:
+			yield from pending.popleft().result()
+	except BrokenProcessPool:
+		discard_process_pool(pool)
+		raise
+	finally:
+		for future in pending:
+			future.cancel()
+
+################################################################################
+def list_files(paths, recursive, onerror):
+	"""
+	PURPOSE: finds the files to search
+	ARGS:
+		paths (list): (full path, path as given) of each file and directory
+		recursive (bool): true to search directories, false to report them
+		onerror (function): called with the path to show and the reason for
+			each path that cannot be searched
+	RETURNS: (generator) (path to open, path to show, size) of each file
+	NOTES: directories are walked in parallel with Walker, the same way as
+		'locate'. Symlinks found in a walk are not followed, like 'grep -r'
+	"""
+	from Crust_Walker import Walker
+	for full_path, path in paths:
+		try:
+			st = os.stat(full_path)
+		except OSError as e:
+			onerror(path, e.strerror or str(e))
+			continue
+		if not stat.S_ISDIR(st.st_mode):
+			yield full_path, path, st.st_size
+			continue
+		if not recursive:
+			onerror(path, "Is a directory")
+			continue
+
+		root = os.path.normpath(full_path)
+		shown_root = path.rstrip(os.sep) or os.sep
+		walker = Walker(root, onerror=lambda e: onerror(shown_path(e.filename, root, shown_root), e.strerror or str(e)))
+		walk = walker.walk()
+		try:
+			for dir_path, entries in walk:
+				for entry in entries:
+					try:
+						if not entry.is_file(follow_symlinks=False):
+							continue
+						size = entry.stat(follow_symlinks=False).st_size
+					except OSError:
+						continue
+					yield entry.path, shown_path(entry.path, root, shown_root), size
+		finally:
+			walk.close()
+
+################################################################################
+def shown_path(path, root, shown_root):
+	"""
+	PURPOSE: gets the path of a file found in a walk the way the user wrote
+		the directory
+	ARGS:
+		path (str): full path of the file
+		root (str): full path of the directory walked
+		shown_root (str): the directory as given, without a trailing
+			separator
+	RETURNS: (str) shown_root followed by the rest of path
+	NOTES:
+	"""
+	rest = path[len(root):].lstrip(os.sep)
+	if shown_root.endswith(os.sep):
+		return shown_root + rest
+	return shown_root + os.sep + rest
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
@@ -0,0 +1,377 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import mmap
+import struct
+import bisect
+from array import array
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Database layout:
+#	magic | table offset (Q) | num dirs (Q) | root (NUL terminated)
+#	records, each one a tag byte followed by data and a NUL terminator
+#	table of dir record offsets (array of Q)
+DB_MAGIC = b"CRUSTDB1"
+DB_HEADER = struct.Struct("<QQ")
+TAG_DIR = 0x01
+TAG_FILE = 0x02
+TAG_SUBDIR = 0x03
+#Every RESTART_INTERVAL dirs the full path is stored instead of a suffix so a
+#path can be decoded without reading the whole database
+RESTART_INTERVAL = 16
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+#Virtual filesystems that are never worth indexing
+DEFAULT_PRUNE_PATHS = ("/proc", "/sys", "/dev", "/run")
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def default_db_path():
+	"""
+	PURPOSE: gets the path of the locate database
+	ARGS:
+	RETURNS: (str) path to the database
+	NOTES: can be overridden with the CRUST_LOCATE_DB environment variable
+	"""
+	db_path = os.environ.get("CRUST_LOCATE_DB")
+	if not db_path:
+		db_path = os.path.join(os.path.expanduser('~'), ".crust", "locate.db")
+	return db_path
+
+################################################################################
+def common_prefix_len(a, b):
+	"""
+	PURPOSE: finds the length of the common prefix of two byte strings
+	ARGS:
+		a (bytes): first string
+		b (bytes): second string
+	RETURNS: (int) number of leading bytes that are the same
+	NOTES:
+	"""
+	max_len = min(len(a), len(b))
+	ii = 0
+	while ii < max_len and a[ii] == b[ii]:
+		ii += 1
+	return ii
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class File_Index:
+	"""
+	Prefix-compressed, memory-mapped index of file names used by 'locate'
+	"""
+	############################################################################
+	def __init__(self, db_path=None):
+		"""
+		PURPOSE: creates a new File_Index
+		ARGS:
+			db_path (str): path to the database file, None for the default
+		RETURNS: new instance of a File_Index
+		NOTES: the database is not opened until open() or search() is called
+		"""
+		if db_path is None:
+			db_path = default_db_path()
+		self.db_path = db_path
+
+		#Define properties
+		self.fh = None
+		self.mm = None
+		self.root = None
+		self.body_start = 0
+		self.body_end = 0
+		self.dir_offsets = None
+
+	############################################################################
+	def __enter__(self):
+		self.open()
+		return self
+
+	############################################################################
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	############################################################################
+	def exists(self):
+		"""
+		PURPOSE: checks if the database has been built
+		ARGS:
+		RETURNS: (bool) true if the database file exists
+		NOTES:
+		"""
+		return os.path.isfile(self.db_path)
+
+	############################################################################
+	def open(self):
+		"""
+		PURPOSE: memory maps the database and loads the directory table
+		ARGS:
+		RETURNS: none
+		NOTES: raises ValueError if the file is not a locate database
+		"""
+		if self.mm is not None:
+			return
+
+		self.fh = open(self.db_path, 'rb')
+		try:
+			self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+			if self.mm[:len(DB_MAGIC)] != DB_MAGIC:
+				raise ValueError("'%s' is not a locate database" % self.db_path)
+			header_end = len(DB_MAGIC) + DB_HEADER.size
+			table_offset, num_dirs = DB_HEADER.unpack(self.mm[len(DB_MAGIC):header_end])
+			root_end = self.mm.find(b'\0', header_end)
+			self.root = self.mm[header_end:root_end]
+			self.body_start = root_end + 1
+			self.body_end = table_offset
+			self.dir_offsets = array('Q')
+			self.dir_offsets.frombytes(self.mm[table_offset:table_offset + num_dirs * 8])
+		except Exception:
+			self.close()
+			raise
+
+	############################################################################
+	def close(self):
+		"""
+		PURPOSE: unmaps and closes the database
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		if self.mm is not None:
+			self.mm.close()
+			self.mm = None
+		if self.fh is not None:
+			self.fh.close()
+			self.fh = None
+		self.dir_offsets = None
+
+	############################################################################
+	def parse_dir_record(self, offset):
+		"""
+		PURPOSE: parses the directory record at an offset
+		ARGS:
+			offset (int): offset of the record's tag byte
+		RETURNS: (tuple) shared prefix length, mtime in ns, path suffix, offset
+			of the next record
+		NOTES:
+		"""
+		end = self.mm.find(b'\0', offset)
+		prefix_len, mtime_ns, suffix = self.mm[offset + 1:end].split(b' ', 2)
+		return int(prefix_len), int(mtime_ns), suffix, end + 1
+
+	############################################################################
+	def dir_path(self, dir_idx, cache):
+		"""
+		PURPOSE: decodes the full path of a directory
+		ARGS:
+			dir_idx (int): index of the directory in the directory table
+			cache (dict): map of already decoded indices to paths
+		RETURNS: (bytes) full path of the directory
+		NOTES: starts decoding at the nearest restart point
+		"""
+		path = cache.get(dir_idx)
+		if path is not None:
+			return path
+
+		path = b''
+		for ii in range(dir_idx - (dir_idx % RESTART_INTERVAL), dir_idx + 1):
+			prefix_len, mtime_ns, suffix, next_offset = self.parse_dir_record(self.dir_offsets[ii])
+			path = path[:prefix_len] + suffix
+		cache[dir_idx] = path
+		return path
+
+	############################################################################
+	def search(self, file_to_find):
+		"""
+		PURPOSE: finds all files whose name contains a string
+		ARGS:
+			file_to_find (str): substring to look for in file names
+		RETURNS: (generator) full paths (str) of matching files
+		NOTES: the raw mapping is scanned with mmap.find so only records that
+			contain the pattern are ever decoded
+		"""
+		self.open()
+		mm = self.mm
+		pattern = os.fsencode(file_to_find)
+		if not pattern:
+			return
+		path_cache = {}
+		pos = self.body_start
+		while True:
+			pos = mm.find(pattern, pos, self.body_end)
+			if pos < 0:
+				break
+			record_start = mm.rfind(b'\0', 0, pos) + 1
+			record_end = mm.find(b'\0', pos)
+			if mm[record_start] == TAG_FILE and pos > record_start:
+				name = mm[record_start + 1:record_end]
+				dir_idx = bisect.bisect_right(self.dir_offsets, record_start) - 1
+				dir_path = self.dir_path(dir_idx, path_cache)
+				yield os.fsdecode(os.path.join(dir_path, name))
+			pos = record_end + 1
+
+	############################################################################
+	def read_dirs(self):
+		"""
+		PURPOSE: decodes every directory in the database
+		ARGS:
+		RETURNS: (dict) map of directory path (bytes) to a tuple of mtime in ns,
+			list of file names and list of subdirectory names
+		NOTES: used to refresh the database incrementally
+		"""
+		self.open()
+		mm = self.mm
+		dirs = {}
+		path = b''
+		files = subdirs = None
+		pos = self.body_start
+		while pos < self.body_end:
+			tag = mm[pos]
+			if tag == TAG_DIR:
+				prefix_len, mtime_ns, suffix, pos = self.parse_dir_record(pos)
+				path = path[:prefix_len] + suffix
+				files = []
+				subdirs = []
+				dirs[path] = (mtime_ns, files, subdirs)
+			else:
+				end = mm.find(b'\0', pos)
+				if tag == TAG_FILE:
+					files.append(mm[pos + 1:end])
+				else:
+					subdirs.append(mm[pos + 1:end])
+				pos = end + 1
+		return dirs
+
+	############################################################################
+	def update(self, root, full=False, prune_paths=DEFAULT_PRUNE_PATHS):
+		"""
+		PURPOSE: builds or refreshes the database
+		ARGS:
+			root (str): directory to index
+			full (bool): true to ignore the existing database and rescan
+				every directory
+			prune_paths (iterable): absolute paths to leave out of the index
+		RETURNS: (dict) counts of 'dirs', 'files', 'rescanned' and 'reused'
+			directories
+		NOTES: a directory whose mtime matches the existing database reuses its
+			old entries instead of being listed again. The new database is
+			written to a temporary file and swapped in atomically
+		"""
+		root = os.fsencode(os.path.abspath(root))
+		prune_paths = set(os.fsencode(p) for p in prune_paths) - set([root])
+
+		#Load the previous database if it covers the same root
+		old_dirs = {}
+		if not full and self.exists():
+			try:
+				self.open()
+				if self.root == root:
+					old_dirs = self.read_dirs()
+			except (OSError, ValueError):
+				pass
+		self.close()
+
+		db_dir = os.path.dirname(self.db_path)
+		if db_dir:
+			os.makedirs(db_dir, exist_ok=True)
+		tmp_path = self.db_path + ".tmp"
+		counts = {"dirs": 0, "files": 0, "rescanned": 0, "reused": 0}
+		dir_offsets = array('Q')
+		try:
+			with open(tmp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as fh:
+				fh.write(DB_MAGIC + DB_HEADER.pack(0, 0) + root + b'\0')
+				offset = fh.tell()
+				prev_path = b''
+				stack = [root]
+				while stack:
+					dir_path = stack.pop()
+					try:
+						mtime_ns = os.lstat(dir_path).st_mtime_ns
+					except OSError:
+						continue
+
+					old = old_dirs.get(dir_path)
+					if old is not None and old[0] == mtime_ns:
+						files, subdirs = old[1], old[2]
+						counts["reused"] += 1
+					else:
+						files, subdirs = self.list_dir(dir_path)
+						counts["rescanned"] += 1
+
+					#Write directory record with its path front coded
+					if len(dir_offsets) % RESTART_INTERVAL == 0:
+						prefix_len = 0
+					else:
+						prefix_len = common_prefix_len(prev_path, dir_path)
+					dir_offsets.append(offset)
+					record = b'%c%d %d %s\0' % (TAG_DIR, prefix_len, mtime_ns, dir_path[prefix_len:])
+					fh.write(record)
+					offset += len(record)
+					prev_path = dir_path
+
+					#Write entries
+					for name in files:
+						fh.write(b'%c%s\0' % (TAG_FILE, name))
+						offset += len(name) + 2
+					for name in subdirs:
+						fh.write(b'%c%s\0' % (TAG_SUBDIR, name))
+						offset += len(name) + 2
+					counts["files"] += len(files)
+
+					#Visit subdirectories in sorted order so paths share prefixes
+					for name in reversed(subdirs):
+						sub_path = os.path.join(dir_path, name)
+						if sub_path not in prune_paths:
+							stack.append(sub_path)
+
+				#Write directory table and fill in header
+				fh.write(dir_offsets.tobytes())
+				fh.seek(len(DB_MAGIC))
+				fh.write(DB_HEADER.pack(offset, len(dir_offsets)))
+			os.replace(tmp_path, self.db_path)
+		except BaseException:
+			try:
+				os.remove(tmp_path)
+			except OSError:
+				pass
+			raise
+
+		counts["dirs"] = len(dir_offsets)
+		return counts
+
+	############################################################################
+	def list_dir(self, dir_path):
+		"""
+		PURPOSE: lists a directory for the database
+		ARGS:
+			dir_path (bytes): directory to list
+		RETURNS: (tuple) sorted list of file names and sorted list of
+			subdirectory names
+		NOTES: symlinks are treated as files and never followed
+		"""
+		files = []
+		subdirs = []
+		try:
+			with os.scandir(dir_path) as it:
+				for entry in it:
+					try:
+						is_dir = entry.is_dir(follow_symlinks=False)
+					except OSError:
+						is_dir = False
+					if is_dir:
+						subdirs.append(entry.name)
+					else:
+						files.append(entry.name)
+		except OSError:
+			pass
+		files.sort()
+		subdirs.sort()
+		return files, subdirs
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
@@ -0,0 +1,327 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import functools
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Parsed lines kept, scripts tend to run the same few lines over and over
+PARSE_CACHE_SIZE = 4096
+#Backslash escapes the next character, except on windows where it separates
+#paths
+BACKSLASH_ESCAPES = os.sep != '\\'
+#Characters that are special outside quotes
+GLOB_CHARS = "*?["
+WHITESPACE = " \t\r\n\f\v"
+SPECIAL_CHARS = "'\";&|>#" + GLOB_CHARS + ("\\" if BACKSLASH_ESCAPES else "")
+#Characters a backslash escapes inside double quotes
+DOUBLE_QUOTE_ESCAPES = "\"\\$`\n"
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Syntax_Error(ValueError):
+	"""
+	Raised for a line that cannot be parsed
+	"""
+	pass
+
+################################################################################
+class Operator(str):
+	"""
+	Operator of a command line, told apart from quoted text that looks the same
+	"""
+	pass
+
+PIPE = Operator('|')
+BACKGROUND = Operator('&')
+REDIRECT_OUT = Operator('>')
+REDIRECT_APPEND = Operator('>>')
+REDIRECT_ERR = Operator('2>')
+REDIRECT_ERR_APPEND = Operator('2>>')
+REDIRECTS = (REDIRECT_OUT, REDIRECT_APPEND, REDIRECT_ERR, REDIRECT_ERR_APPEND)
+
+################################################################################
+class Glob_Word(str):
+	"""
+	Argument with unquoted glob characters, expanded when its command runs
+	"""
+	############################################################################
+	def __new__(cls, text, pattern):
+		"""
+		PURPOSE: creates a new Glob_Word
+		ARGS:
+			text (str): the argument with its quotes removed, used as is if
+				nothing matches
+			pattern (str): glob pattern with the quoted glob characters
+				escaped, ex: '"a*"*' is 'a[*]*'
+		RETURNS: new instance of a Glob_Word
+		NOTES:
+		"""
+		word = str.__new__(cls, text)
+		word.pattern = pattern
+		return word
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def lex_line(line):
+	"""
+	PURPOSE: splits a line of input into commands and arguments in one pass
+	ARGS:
+		line (str): line of input
+	RETURNS: (tuple) commands, each a tuple of arguments. Pipes, '&' and
+		redirections are Operator arguments, arguments with unquoted glob
+		characters are Glob_Words
+	NOTES: supports single quotes, double quotes, backslash escapes, ';',
+		'|', '&' at the end of a command, '>', '>>', '2>', '2>>' and '#'
+		comments. Raises Syntax_Error for an unterminated quote, a
+		redirection without a target or a '|' or '&' with no command
+		before it, ex: '&&', so nothing on such a line is run. Results are cached so they must not
+		be changed
+	"""
+	#Plain words need none of the work below
+	for ch in SPECIAL_CHARS:
+		if ch in line:
+			break
+	else:
+		return (tuple(line.split()),)
+
+	cmds = []
+	cmd = []
+	word_text = []
+	word_pattern = []
+	in_word = False
+	#Word has nothing quoted or escaped, so '2' before '>' means stderr
+	word_plain = True
+	word_magic = False
+	quote = None
+	redirect = None
+	ii = 0
+	num_chars = len(line)
+	while ii < num_chars:
+		ch = line[ii]
+		ii += 1
+
+		#Inside quotes
+		if quote is not None:
+			if ch == quote:
+				quote = None
+				continue
+			if quote == '"' and ch == '\\' and BACKSLASH_ESCAPES and ii < num_chars and line[ii] in DOUBLE_QUOTE_ESCAPES:
+				ch = line[ii]
+				ii += 1
+				if ch == '\n':
+					continue
+			word_text.append(ch)
+			word_pattern.append("[%s]" % ch if ch in GLOB_CHARS else ch)
+			continue
+
+		#Plain characters
+		if ch not in SPECIAL_CHARS and ch not in WHITESPACE:
+			word_text.append(ch)
+			word_pattern.append(ch)
+			in_word = True
+			continue
+		if ch in GLOB_CHARS:
+			word_text.append(ch)
+			word_pattern.append(ch)
+			in_word = True
+			word_magic = True
+			continue
+		if ch == "'" or ch == '"':
+			quote = ch
+			in_word = True
+			word_plain = False
+			continue
+		if ch == '\\':
+			if ii < num_chars:
+				ch = line[ii]
+				ii += 1
+				if ch == '\n':
+					continue
+			word_text.append(ch)
+			word_pattern.append("[%s]" % ch if ch in GLOB_CHARS else ch)
+			in_word = True
+			word_plain = False
+			continue
+		if ch == '#':
+			if in_word:
+				#Only starts a comment at the start of a word
+				word_text.append(ch)
+				word_pattern.append(ch)
+				continue
+			#Comment runs to the end of the line
+			break
+
+		#Everything else ends the word, '2' directly before '>' is not a word
+		if ch == '>' and in_word and word_plain and word_text == ['2']:
+			op = REDIRECT_ERR
+		else:
+			op = None
+			if in_word:
+				text = "".join(word_text)
+				if word_magic:
+					cmd.append(Glob_Word(text, "".join(word_pattern)))
+				else:
+					cmd.append(text)
+				redirect = None
+		word_text = []
+		word_pattern = []
+		in_word = False
+		word_plain = True
+		word_magic = False
+		if ch in WHITESPACE:
+			continue
+
+		#Operators
+		if redirect is not None:
+			raise Syntax_Error("syntax error near unexpected token '%s'" % ch)
+		if ch in "|&" and (not cmd or cmd[-1] is PIPE):
+			#Nothing to pipe or put in the background, ex: '&&' or '||'
+			raise Syntax_Error("syntax error near unexpected token '%s'" % ch)
+		if ch == '>':
+			if ii < num_chars and line[ii] == '>':
+				ii += 1
+				op = REDIRECT_ERR_APPEND if op is REDIRECT_ERR else REDIRECT_APPEND
+			elif op is None:
+				op = REDIRECT_OUT
+			cmd.append(op)
+			redirect = op
+		elif ch == '|':
+			cmd.append(PIPE)
+		elif ch == '&':
+			cmd.append(BACKGROUND)
+			cmds.append(tuple(cmd))
+			cmd = []
+		elif ch == ';':
+			cmds.append(tuple(cmd))
+			cmd = []
+
+	if quote is not None:
+		raise Syntax_Error("syntax error: unterminated %s quote" % quote)
+	if in_word:
+		text = "".join(word_text)
+		if word_magic:
+			cmd.append(Glob_Word(text, "".join(word_pattern)))
+		else:
+			cmd.append(text)
+		redirect = None
+	if redirect is not None:
+		raise Syntax_Error("syntax error near unexpected token 'newline'")
+	if cmd or not cmds:
+		cmds.append(tuple(cmd))
+	return tuple(cmds)
+
+################################################################################
+def split_redirects(cmd):
+	"""
+	PURPOSE: takes the redirections out of a command
+	ARGS:
+		cmd (list): command and arguments from lex_line
+	RETURNS: (tuple) list of the other arguments, and list of (Operator,
+		target path) of each redirection in order
+	NOTES:
+	"""
+	args = []
+	redirects = []
+	ii = 0
+	while ii < len(cmd):
+		cur_arg = cmd[ii]
+		if isinstance(cur_arg, Operator) and cur_arg in REDIRECTS and ii + 1 < len(cmd):
+			redirects.append((cur_arg, cmd[ii + 1]))
+			ii += 2
+			continue
+		args.append(cur_arg)
+		ii += 1
+	return args, redirects
+
+################################################################################
+@functools.lru_cache(maxsize=256)
+def compile_glob(part):
+	"""
+	PURPOSE: compiles one path component of a glob pattern
+	ARGS:
+		part (str): component that may contain '*', '?' or '[...]'
+	RETURNS: (function) match function of the compiled regular expression
+	NOTES:
+	"""
+	import re
+	import fnmatch
+	return re.compile(fnmatch.translate(os.path.normcase(part))).match
+
+################################################################################
+def expand_glob(pattern, cwd):
+	"""
+	PURPOSE: finds the paths matching a glob pattern
+	ARGS:
+		pattern (str): pattern, relative patterns are from cwd
+		cwd (str): directory relative patterns start from
+	RETURNS: (list) sorted paths that match, written the way the pattern was
+		so relative patterns give relative paths
+	NOTES: every directory is listed with a single os.scandir, whatever the
+		number of patterns matched against it. Names starting with '.' only
+		match a component that starts with '.' too
+	"""
+	if os.altsep:
+		pattern = pattern.replace(os.altsep, os.sep)
+	parts = pattern.split(os.sep)
+	#Prefixes of the matches so far, ending with a separator unless empty
+	prefixes = [""]
+	if parts[0] == "" and len(parts) > 1:
+		prefixes = [os.sep]
+		parts = parts[1:]
+	#Trailing separator only matches directories
+	dirs_only = pattern.endswith(os.sep)
+	while parts and parts[-1] == "":
+		parts.pop()
+
+	matches = prefixes
+	literal = True
+	for ii, part in enumerate(parts):
+		last = ii == len(parts) - 1
+		if not part:
+			continue
+		matches = []
+		literal = not any(ch in part for ch in GLOB_CHARS)
+		if literal:
+			matches = [prefix + part for prefix in prefixes]
+		else:
+			match = compile_glob(part)
+			show_hidden = part.startswith('.')
+			for prefix in prefixes:
+				try:
+					with os.scandir(os.path.join(cwd, prefix) if prefix else cwd) as it:
+						for entry in it:
+							if entry.name.startswith('.') and not show_hidden:
+								continue
+							if not match(os.path.normcase(entry.name)):
+								continue
+							if not last or dirs_only:
+								#Follows symlinks, a link to a directory is
+								#searched like the directory
+								try:
+									if not entry.is_dir():
+										continue
+								except OSError:
+									continue
+							matches.append(prefix + entry.name)
+				except OSError:
+					pass
+		if not last:
+			prefixes = [path + os.sep for path in matches]
+
+	#A literal last component was never looked at so check it exists
+	if literal:
+		matches = [path for path in matches if os.path.lexists(os.path.join(cwd, path))]
+	if dirs_only:
+		matches = [path + os.sep for path in matches if os.path.isdir(os.path.join(cwd, path))]
+	matches.sort()
+	return matches
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
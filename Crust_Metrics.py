@@ -0,0 +1,326 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import threading
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Latency buckets are powers of two of microseconds, the last one is open ended
+NUM_BUCKETS = 32
+#Per thread I/O counters (linux), falls back to per process counters
+IO_PATHS = ("/proc/thread-self/io", "/proc/self/io")
+IO_FIELDS = ("rchar", "wchar", "syscr", "syscw")
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def find_io_path():
+	"""
+	PURPOSE: finds where I/O counters can be read from
+	ARGS:
+	RETURNS: (str) path to read, None if not available
+	NOTES:
+	"""
+	for io_path in IO_PATHS:
+		try:
+			with open(io_path, 'rb') as fh:
+				fh.read()
+			return io_path
+		except OSError:
+			pass
+	return None
+
+IO_PATH = find_io_path()
+
+################################################################################
+def read_io_counters():
+	"""
+	PURPOSE: reads the I/O counters of the calling thread
+	ARGS:
+	RETURNS: (dict) bytes read/written (rchar, wchar) and read/write system
+		calls (syscr, syscw), empty if not available on this platform
+	NOTES:
+	"""
+	counters = {}
+	if IO_PATH is None:
+		return counters
+	try:
+		with open(IO_PATH, 'rb') as fh:
+			for line in fh.read().split(b'\n'):
+				name, sep, value = line.partition(b':')
+				name = name.decode("ascii")
+				if name in IO_FIELDS:
+					counters[name] = int(value)
+	except (OSError, ValueError):
+		pass
+	return counters
+
+################################################################################
+def bucket_index(seconds):
+	"""
+	PURPOSE: finds the latency bucket for a duration
+	ARGS:
+		seconds (float): duration
+	RETURNS: (int) index of the bucket
+	NOTES: bucket N holds durations up to 2**N microseconds
+	"""
+	micros = int(seconds * 1000000)
+	return min(max(micros - 1, 0).bit_length(), NUM_BUCKETS - 1)
+
+################################################################################
+def bucket_limit(index):
+	"""
+	PURPOSE: gets the upper limit of a latency bucket
+	ARGS:
+		index (int): index of the bucket
+	RETURNS: (float) limit in seconds
+	NOTES:
+	"""
+	return (1 << index) / 1000000.0
+
+################################################################################
+def format_seconds(seconds):
+	"""
+	PURPOSE: formats a duration with a sensible unit
+	ARGS:
+		seconds (float): duration
+	RETURNS: (str) ex: '850us', '12.3ms', '4.20s'
+	NOTES:
+	"""
+	if seconds < 0.001:
+		return "%dus" % (seconds * 1000000)
+	if seconds < 1.0:
+		return "%.1fms" % (seconds * 1000)
+	return "%.2fs" % seconds
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Command_Stats:
+	"""
+	Counters and latency histogram for one command
+	"""
+	############################################################################
+	def __init__(self):
+		"""
+		PURPOSE: creates a new Command_Stats
+		ARGS:
+		RETURNS: new instance of a Command_Stats
+		NOTES:
+		"""
+		self.count = 0
+		self.failures = 0
+		self.wall_total = 0.0
+		self.wall_max = 0.0
+		self.cpu_total = 0.0
+		self.bytes_out = 0
+		self.io = dict((name, 0) for name in IO_FIELDS)
+		self.buckets = [0] * NUM_BUCKETS
+
+	############################################################################
+	def add(self, status, wall, cpu, bytes_out, io):
+		"""
+		PURPOSE: records one run of the command
+		ARGS:
+			status (int): exit status
+			wall (float): wall clock seconds
+			cpu (float): cpu seconds of the shell's thread
+			bytes_out (int): amount of output written
+			io (dict): change in I/O counters while the command ran
+		RETURNS: none
+		NOTES:
+		"""
+		self.count += 1
+		if status:
+			self.failures += 1
+		self.wall_total += wall
+		self.wall_max = max(self.wall_max, wall)
+		self.cpu_total += cpu
+		self.bytes_out += bytes_out
+		for name, value in io.items():
+			self.io[name] += value
+		self.buckets[bucket_index(wall)] += 1
+
+	############################################################################
+	def merge(self, other):
+		"""
+		PURPOSE: adds another command's stats into this one
+		ARGS:
+			other (Command_Stats): stats to add
+		RETURNS: none
+		NOTES:
+		"""
+		self.count += other.count
+		self.failures += other.failures
+		self.wall_total += other.wall_total
+		self.wall_max = max(self.wall_max, other.wall_max)
+		self.cpu_total += other.cpu_total
+		self.bytes_out += other.bytes_out
+		for name, value in other.io.items():
+			self.io[name] += value
+		for ii in range(NUM_BUCKETS):
+			self.buckets[ii] += other.buckets[ii]
+
+	############################################################################
+	def percentile(self, fraction):
+		"""
+		PURPOSE: estimates a latency percentile from the histogram
+		ARGS:
+			fraction (float): ex: 0.99 for the 99th percentile
+		RETURNS: (float) upper limit of the bucket the percentile falls in
+		NOTES: accurate to within a factor of two
+		"""
+		target = fraction * self.count
+		seen = 0
+		for ii in range(NUM_BUCKETS):
+			seen += self.buckets[ii]
+			if seen >= target and seen > 0:
+				return min(bucket_limit(ii), self.wall_max)
+		return self.wall_max
+
+	############################################################################
+	def to_dict(self):
+		"""
+		PURPOSE: converts the stats to plain data
+		ARGS:
+		RETURNS: (dict) json serializable stats
+		NOTES: histogram keys are bucket upper limits in microseconds
+		"""
+		return {
+			"count": self.count,
+			"failures": self.failures,
+			"wall_total": self.wall_total,
+			"wall_max": self.wall_max,
+			"wall_p50": self.percentile(0.5),
+			"wall_p90": self.percentile(0.9),
+			"wall_p99": self.percentile(0.99),
+			"cpu_total": self.cpu_total,
+			"bytes_out": self.bytes_out,
+			"io": dict(self.io),
+			"histogram_us": dict((str(1 << ii), n) for ii, n in enumerate(self.buckets) if n),
+		}
+
+################################################################################
+class Session_Metrics:
+	"""
+	Per command metrics of one shell session
+	"""
+	############################################################################
+	def __init__(self):
+		"""
+		PURPOSE: creates a new Session_Metrics
+		ARGS:
+		RETURNS: new instance of a Session_Metrics
+		NOTES: thread safe so a server can read it while the session runs
+		"""
+		self.lock = threading.Lock()
+		self.commands = {}
+
+	############################################################################
+	def record(self, cmd_name, status, wall, cpu, bytes_out, io):
+		"""
+		PURPOSE: records one run of a command
+		ARGS:
+			cmd_name (str): name of the command
+			status (int): exit status
+			wall (float): wall clock seconds
+			cpu (float): cpu seconds of the shell's thread
+			bytes_out (int): amount of output written
+			io (dict): change in I/O counters while the command ran
+		RETURNS: none
+		NOTES:
+		"""
+		with self.lock:
+			cmd_stats = self.commands.get(cmd_name)
+			if cmd_stats is None:
+				cmd_stats = self.commands[cmd_name] = Command_Stats()
+			cmd_stats.add(status, wall, cpu, bytes_out, io)
+
+	############################################################################
+	def merge(self, other):
+		"""
+		PURPOSE: adds another session's metrics into this one
+		ARGS:
+			other (Session_Metrics): metrics to add
+		RETURNS: none
+		NOTES:
+		"""
+		with other.lock:
+			other_commands = list(other.commands.items())
+		with self.lock:
+			for cmd_name, other_stats in other_commands:
+				cmd_stats = self.commands.get(cmd_name)
+				if cmd_stats is None:
+					cmd_stats = self.commands[cmd_name] = Command_Stats()
+				cmd_stats.merge(other_stats)
+
+	############################################################################
+	def reset(self):
+		"""
+		PURPOSE: forgets everything recorded
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		with self.lock:
+			self.commands = {}
+
+	############################################################################
+	def to_dict(self):
+		"""
+		PURPOSE: converts the metrics to plain data
+		ARGS:
+		RETURNS: (dict) command name to stats, json serializable
+		NOTES:
+		"""
+		with self.lock:
+			return dict((cmd_name, cmd_stats.to_dict()) for cmd_name, cmd_stats in self.commands.items())
+
+	############################################################################
+	def render(self, cmd_name=None):
+		"""
+		PURPOSE: formats the metrics as a table, or one command's histogram
+		ARGS:
+			cmd_name (str): command to show the histogram of, None for the
+				table of every command
+		RETURNS: (str) text to show, None if cmd_name has no stats
+		NOTES:
+		"""
+		with self.lock:
+			if cmd_name is not None:
+				cmd_stats = self.commands.get(cmd_name)
+				if cmd_stats is None:
+					return None
+				max_count = max(cmd_stats.buckets)
+				lines = ["%s: %d runs, %d failed" % (cmd_name, cmd_stats.count, cmd_stats.failures)]
+				for ii, num in enumerate(cmd_stats.buckets):
+					if num:
+						bar = "#" * max(1, (num * 40) // max_count)
+						lines.append("  <=%-8s %6d %s" % (format_seconds(bucket_limit(ii)), num, bar))
+				return "\n".join(lines) + "\n"
+
+			rows = [("Command", "Runs", "Failed", "Mean", "p50", "p90", "p99", "Max", "CPU", "Out", "Syscalls")]
+			for name in sorted(self.commands):
+				cmd_stats = self.commands[name]
+				rows.append((
+					name,
+					str(cmd_stats.count),
+					str(cmd_stats.failures),
+					format_seconds(cmd_stats.wall_total / cmd_stats.count),
+					format_seconds(cmd_stats.percentile(0.5)),
+					format_seconds(cmd_stats.percentile(0.9)),
+					format_seconds(cmd_stats.percentile(0.99)),
+					format_seconds(cmd_stats.wall_max),
+					format_seconds(cmd_stats.cpu_total),
+					str(cmd_stats.bytes_out),
+					str(cmd_stats.io["syscr"] + cmd_stats.io["syscw"]),
+				))
+		#Pad every column but the last to its widest value
+		col_lens = [max(len(row[col]) for row in rows) for col in range(len(rows[0]) - 1)]
+		row_fmt = " ".join("%%-%ds" % col_len for col_len in col_lens) + " %s\n"
+		return "".join(row_fmt % row for row in rows)
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
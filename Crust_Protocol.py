@@ -0,0 +1,641 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import json
+import struct
+import threading
+import time
+import zlib
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Every frame is a header (channel, payload length) followed by the payload
+FRAME_HEADER = struct.Struct("!BI")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+#File data is sent in frames of at most this
+FILE_FRAME_SIZE = 4 * 1024 * 1024
+
+#Channels
+CHANNEL_STDIN = 0
+CHANNEL_STDOUT = 1
+CHANNEL_STDERR = 2
+CHANNEL_CONTROL = 3
+#Raw file data of a transfer, see Crust_Transfer
+CHANNEL_FILE = 4
+
+#Control messages, the first byte of a control frame's payload
+CTRL_PROMPT = 1
+CTRL_EXIT = 2
+#Sent by a client with the codecs it can decompress (comma separated), the
+#server answers with the one it picked, empty for none. Everything the
+#server sends after its answer goes through the codec
+CTRL_HELLO = 3
+#Sent by a client with the line up to the cursor, the server answers with
+#the candidates for the word before the cursor, see encode_completion
+CTRL_COMPLETE = 4
+#File transfers, the body of each is a json object, see Crust_Transfer.
+#Sent by the server to offer a client a file ('get') or to ask it for one
+#('put')
+CTRL_FILE_OFFER = 5
+CTRL_FILE_REQUEST = 6
+#Answer to an offer or request, with where the data starts
+CTRL_FILE_START = 7
+#Sent after the last of the data, with the checksum of the whole file
+CTRL_FILE_END = 8
+#Sent by a client once it has checked a file it was given
+CTRL_FILE_DONE = 9
+TRANSFER_MESSAGES = (CTRL_FILE_OFFER, CTRL_FILE_REQUEST, CTRL_FILE_START, CTRL_FILE_END, CTRL_FILE_DONE)
+
+#Streaming codecs, only zlib can be flushed mid stream
+CODEC_ZLIB = "zlib"
+CODECS = (CODEC_ZLIB,)
+DEFAULT_COMPRESS_LEVEL = 6
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+#How long output may sit in a buffer before it is sent anyway (seconds)
+DEFAULT_IDLE_TIMEOUT = 0.05
+RECV_SIZE = 64 * 1024
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def encode_frame(channel, payload):
+	"""
+	PURPOSE: builds a frame
+	ARGS:
+		channel (int): channel the payload belongs to
+		payload (bytes): data of the frame
+	RETURNS: (bytes) header followed by payload
+	NOTES:
+	"""
+	return FRAME_HEADER.pack(channel, len(payload)) + payload
+
+################################################################################
+def encode_control(msg_type, body=b''):
+	"""
+	PURPOSE: builds a control frame
+	ARGS:
+		msg_type (int): one of the CTRL_ constants
+		body (bytes): data of the message
+	RETURNS: (bytes) the frame
+	NOTES:
+	"""
+	return encode_frame(CHANNEL_CONTROL, bytes([msg_type]) + body)
+
+################################################################################
+def encode_text(text, encoding="utf-8"):
+	"""
+	PURPOSE: encodes text from a shell for the wire
+	ARGS:
+		text (str): text to encode
+		encoding (str): encoding to use
+	RETURNS: (bytes) encoded text
+	NOTES: file names that are not valid UTF-8 come from os as surrogate
+		escapes, they are turned back into their original bytes. Anything
+		else that cannot be encoded is replaced
+	"""
+	try:
+		return text.encode(encoding, "surrogateescape")
+	except UnicodeEncodeError:
+		return text.encode(encoding, "replace")
+
+################################################################################
+def encode_hello(codecs=CODECS):
+	"""
+	PURPOSE: builds the hello a client sends to offer compression
+	ARGS:
+		codecs (tuple): names of the codecs the client can decompress, in
+			order of preference
+	RETURNS: (bytes) the frame
+	NOTES: servers that do not know about compression ignore it
+	"""
+	return encode_control(CTRL_HELLO, ",".join(codecs).encode("ascii"))
+
+################################################################################
+def encode_completion(word_len, candidates):
+	"""
+	PURPOSE: builds the body of the answer to a completion request
+	ARGS:
+		word_len (int): number of characters of the word being completed
+		candidates (list): words that can replace it
+	RETURNS: (bytes) the body
+	NOTES: one line with word_len, then one line per candidate
+	"""
+	return encode_text("\n".join([str(word_len)] + candidates))
+
+################################################################################
+def decode_completion(body):
+	"""
+	PURPOSE: reads the answer to a completion request
+	ARGS:
+		body (bytes): body of the answer
+	RETURNS: (tuple) number of characters of the word being completed, and
+		list of the words that can replace it
+	NOTES:
+	"""
+	lines = body.decode("utf-8", "surrogateescape").split("\n")
+	try:
+		word_len = int(lines[0])
+	except ValueError:
+		return 0, []
+	return word_len, lines[1:]
+
+################################################################################
+def encode_transfer(fields):
+	"""
+	PURPOSE: builds the body of a file transfer message
+	ARGS:
+		fields (dict): json serializable fields of the message
+	RETURNS: (bytes) the body
+	NOTES: file names that are not valid UTF-8 are sent as their surrogate
+		escapes and come back out of decode_transfer the same way
+	"""
+	return json.dumps(fields).encode("ascii")
+
+################################################################################
+def decode_transfer(body):
+	"""
+	PURPOSE: reads the body of a file transfer message
+	ARGS:
+		body (bytes): body of the message
+	RETURNS: (dict) fields of the message
+	NOTES: raises ValueError if the body is not a json object
+	"""
+	fields = json.loads(body.decode("ascii"))
+	if not isinstance(fields, dict):
+		raise ValueError("transfer message is not an object")
+	return fields
+
+################################################################################
+def choose_codec(hello_body, compress_level=DEFAULT_COMPRESS_LEVEL):
+	"""
+	PURPOSE: picks the codec to answer a client's hello with
+	ARGS:
+		hello_body (bytes): body of the client's hello
+		compress_level (int): compression level the server uses, 0 to never
+			compress
+	RETURNS: (str) first codec offered that is supported, "" for none
+	NOTES:
+	"""
+	if compress_level <= 0:
+		return ""
+	for codec in hello_body.decode("ascii", "replace").split(","):
+		if codec.strip() in CODECS:
+			return codec.strip()
+	return ""
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Frame_Writer:
+	"""
+	Coalesces frames for a socket and sends them in large writes
+	"""
+	############################################################################
+	def __init__(self, sock, buffer_size=DEFAULT_BUFFER_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+		"""
+		PURPOSE: creates a new Frame_Writer
+		ARGS:
+			sock (socket): socket to send frames on
+			buffer_size (int): number of buffered bytes that forces a send
+			idle_timeout (float): max seconds buffered output waits before it
+				is sent
+		RETURNS: new instance of a Frame_Writer
+		NOTES: thread safe. Buffered output is sent when it reaches
+			buffer_size, on a prompt, on flush() and after idle_timeout
+		"""
+		#Save arguments
+		self.sock = sock
+		self.buffer_size = buffer_size
+		self.idle_timeout = idle_timeout
+
+		#Define properties
+		self.lock = threading.Lock()
+		self.buffer = bytearray()
+		self.flush_deadline = None
+		#Thread waiting to send idle output, only running while a flush is
+		#due. Each writer has its own so a client that stops reading only
+		#holds up its own session
+		self.flush_cond = threading.Condition(self.lock)
+		self.flush_thread = None
+		self.closed = False
+		self.compressor = None
+		#Codec answered to the client's hello, None until there is one
+		self.codec = None
+		self.compress_level = DEFAULT_COMPRESS_LEVEL
+		#Set while raw data is going out on the socket, see begin_raw
+		self.held = False
+
+	############################################################################
+	def send_frame(self, channel, payload):
+		"""
+		PURPOSE: queues a frame to be sent
+		ARGS:
+			channel (int): channel the payload belongs to
+			payload (bytes): data of the frame
+		RETURNS: none
+		NOTES: large payloads are split so no frame exceeds MAX_FRAME_SIZE
+		"""
+		with self.lock:
+			if self.closed:
+				raise BrokenPipeError("frame writer is closed")
+			for ii in range(0, len(payload), MAX_FRAME_SIZE):
+				chunk = payload[ii:ii + MAX_FRAME_SIZE]
+				self.buffer += FRAME_HEADER.pack(channel, len(chunk))
+				self.buffer += chunk
+			if len(self.buffer) >= self.buffer_size:
+				self.send_buffer()
+			elif self.buffer and self.flush_deadline is None:
+				self.flush_deadline = time.monotonic() + self.idle_timeout
+				self.schedule_flush(self.flush_deadline)
+		self.wait_sent()
+
+	############################################################################
+	def send_control(self, msg_type, body=b'', flush=True):
+		"""
+		PURPOSE: queues a control message
+		ARGS:
+			msg_type (int): one of the CTRL_ constants
+			body (bytes): data of the message
+			flush (bool): true to send everything buffered right away
+		RETURNS: none
+		NOTES:
+		"""
+		self.send_frame(CHANNEL_CONTROL, bytes([msg_type]) + body)
+		if flush:
+			self.flush()
+
+	############################################################################
+	def send_buffer(self):
+		"""
+		PURPOSE: sends everything buffered
+		ARGS:
+		RETURNS: none
+		NOTES: must be called with the lock held. When compressing, the
+			compressor is flushed so the peer can decode everything sent so
+			far, which includes every prompt. Nothing is sent while held,
+			end_raw sends it
+		"""
+		self.flush_deadline = None
+		if self.buffer and not self.held:
+			data = self.buffer
+			self.buffer = bytearray()
+			if self.compressor is not None:
+				data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+			self.send_data(data)
+
+	############################################################################
+	def send_data(self, data):
+		"""
+		PURPOSE: writes encoded frames to the socket
+		ARGS:
+			data (bytearray): frames to send
+		RETURNS: none
+		NOTES: called with the lock held. Overridden by writers that do not
+			own a blocking socket
+		"""
+		self.sock.sendall(data)
+
+	############################################################################
+	def schedule_flush(self, deadline):
+		"""
+		PURPOSE: arranges for flush_if_due to be called at a deadline
+		ARGS:
+			deadline (float): time.monotonic() value to flush at
+		RETURNS: none
+		NOTES: called with the lock held
+		"""
+		if self.flush_thread is None:
+			self.flush_thread = threading.Thread(target=self.run_idle_flush, daemon=True)
+			self.flush_thread.start()
+
+	############################################################################
+	def run_idle_flush(self):
+		"""
+		PURPOSE: sends buffered output once it has waited idle_timeout
+		ARGS:
+		RETURNS: none
+		NOTES: to be run in a separate thread, which exits once nothing is
+			waiting to be sent. The send may block on a slow client, which
+			is why this is not shared between writers
+		"""
+		with self.lock:
+			try:
+				while not self.closed and self.flush_deadline is not None:
+					remaining = self.flush_deadline - time.monotonic()
+					if remaining > 0:
+						self.flush_cond.wait(remaining)
+						continue
+					try:
+						self.send_buffer()
+					except OSError:
+						#Client is gone, the session will notice on its next write
+						self.buffer = bytearray()
+						self.flush_deadline = None
+			finally:
+				self.flush_thread = None
+
+	############################################################################
+	def wait_sent(self):
+		"""
+		PURPOSE: waits until the peer has taken enough of what was sent
+		ARGS:
+		RETURNS: none
+		NOTES: called without the lock held. Nothing to do when sends block
+		"""
+		pass
+
+	############################################################################
+	def answer_hello(self, codec, compress_level=DEFAULT_COMPRESS_LEVEL):
+		"""
+		PURPOSE: answers a client's hello and starts compressing
+		ARGS:
+			codec (str): codec picked by choose_codec, "" for none
+			compress_level (int): zlib compression level, 1 (fast) to 9
+				(small)
+		RETURNS: none
+		NOTES: the answer and everything before it are sent uncompressed.
+			Hellos after the first are ignored
+		"""
+		with self.lock:
+			if self.closed:
+				raise BrokenPipeError("frame writer is closed")
+			if self.codec is not None:
+				return
+			self.codec = codec
+			self.compress_level = compress_level
+			if not self.held:
+				self.start_codec()
+		self.wait_sent()
+
+	############################################################################
+	def start_codec(self):
+		"""
+		PURPOSE: tells the client which codec follows and starts using it
+		ARGS:
+		RETURNS: none
+		NOTES: must be called with the lock held. Everything buffered is sent
+			uncompressed ahead of the announcement
+		"""
+		self.buffer += encode_control(CTRL_HELLO, self.codec.encode("ascii"))
+		self.send_buffer()
+		if self.codec == CODEC_ZLIB:
+			self.compressor = zlib.compressobj(self.compress_level)
+
+	############################################################################
+	def begin_raw(self):
+		"""
+		PURPOSE: sends everything buffered and stops sending, so the caller
+			can write raw data to the connection
+		ARGS:
+		RETURNS: none
+		NOTES: the data written must be whole frames. A compressed stream is
+			ended so the frames go out as they are, ex: sent with sendfile.
+			Frames queued meanwhile are held until end_raw
+		"""
+		with self.lock:
+			if self.closed:
+				raise BrokenPipeError("frame writer is closed")
+			self.send_buffer()
+			if self.compressor is not None:
+				self.send_data(self.compressor.flush(zlib.Z_FINISH))
+				self.compressor = None
+			self.held = True
+		self.wait_sent()
+
+	############################################################################
+	def end_raw(self):
+		"""
+		PURPOSE: goes back to sending frames after begin_raw
+		ARGS:
+		RETURNS: none
+		NOTES: compression is restarted with a new announcement of the codec
+		"""
+		with self.lock:
+			if self.closed or not self.held:
+				return
+			self.held = False
+			if self.codec:
+				self.start_codec()
+			else:
+				self.send_buffer()
+		self.wait_sent()
+
+	############################################################################
+	def flush(self):
+		"""
+		PURPOSE: sends everything buffered
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		with self.lock:
+			if not self.closed:
+				self.send_buffer()
+		self.wait_sent()
+
+	############################################################################
+	def flush_if_due(self, deadline):
+		"""
+		PURPOSE: sends buffered output if it has waited long enough
+		ARGS:
+			deadline (float): deadline this flush was scheduled for
+		RETURNS: none
+		NOTES: called by the timers of writers that schedule their own
+			flushes, see Async_Frame_Writer. Does nothing if the buffer was
+			already sent since the flush was scheduled
+		"""
+		with self.lock:
+			if self.closed or self.flush_deadline != deadline:
+				return
+			try:
+				self.send_buffer()
+			except OSError:
+				#Client is gone, the session will notice on its next write
+				self.buffer = bytearray()
+
+	############################################################################
+	def close(self):
+		"""
+		PURPOSE: sends anything left and stops accepting frames
+		ARGS:
+		RETURNS: none
+		NOTES: does not close the socket
+		"""
+		with self.lock:
+			if self.closed:
+				return
+			try:
+				self.send_buffer()
+			finally:
+				self.closed = True
+				self.flush_cond.notify_all()
+
+################################################################################
+class Channel_File:
+	"""
+	Text file-like object that writes to one channel of a Frame_Writer
+	"""
+	############################################################################
+	def __init__(self, writer, channel, encoding="utf-8"):
+		"""
+		PURPOSE: creates a new Channel_File
+		ARGS:
+			writer (Frame_Writer): writer to send frames with
+			channel (int): channel to write to
+			encoding (str): encoding of the text written
+		RETURNS: new instance of a Channel_File
+		NOTES: meant to be given to Crust as fout or ferr. Crust sends bytes
+			with write_bytes when it has them, so files go out undecoded
+		"""
+		#Save arguments
+		self.writer = writer
+		self.channel = channel
+		self.encoding = encoding
+
+	############################################################################
+	def write(self, out_str):
+		"""
+		PURPOSE: writes text to the channel
+		ARGS:
+			out_str (str): text to write
+		RETURNS: (int) number of characters written
+		NOTES:
+		"""
+		if out_str:
+			self.writer.send_frame(self.channel, encode_text(out_str, self.encoding))
+		return len(out_str)
+
+	############################################################################
+	def write_bytes(self, data):
+		"""
+		PURPOSE: writes raw bytes to the channel
+		ARGS:
+			data (bytes-like object): data to write, copied before returning
+		RETURNS: none
+		NOTES:
+		"""
+		if data:
+			self.writer.send_frame(self.channel, data)
+
+	############################################################################
+	def flush(self):
+		"""
+		PURPOSE: lets the writer know the output is complete for now
+		ARGS:
+		RETURNS: none
+		NOTES: does not send anything itself. Output goes out when the buffer
+			fills, on the next prompt or after the idle timeout so many
+			small writes end up in one send
+		"""
+		pass
+
+	############################################################################
+	def write_prompt(self, prompt_str):
+		"""
+		PURPOSE: sends a prompt and everything before it
+		ARGS:
+			prompt_str (str): prompt to show
+		RETURNS: none
+		NOTES: the prompt goes on the control channel so the client knows the
+			output of the last command is complete
+		"""
+		self.writer.send_control(CTRL_PROMPT, encode_text(prompt_str, self.encoding))
+
+################################################################################
+class Frame_Reader:
+	"""
+	Reads frames from a socket
+	"""
+	############################################################################
+	def __init__(self, sock, recv_size=RECV_SIZE):
+		"""
+		PURPOSE: creates a new Frame_Reader
+		ARGS:
+			sock (socket): socket to read frames from
+			recv_size (int): max number of bytes taken from the socket at a
+				time, larger takes fewer calls for bulk data
+		RETURNS: new instance of a Frame_Reader
+		NOTES:
+		"""
+		#Save arguments
+		self.sock = sock
+
+		#Define properties
+		self.buffer = bytearray()
+		#Start of the unread data in buffer
+		self.pos = 0
+		self.recv_buffer = bytearray(recv_size)
+		self.recv_view = memoryview(self.recv_buffer)
+		self.decompressor = None
+
+	############################################################################
+	def start_decompression(self, codec):
+		"""
+		PURPOSE: decompresses everything received after the server's answer
+			to a hello
+		ARGS:
+			codec (str): codec from the server's answer, "" for none
+		RETURNS: none
+		NOTES: to be called right after reading the answer. Anything already
+			received past it is decompressed too. The server ends the
+			compressed stream before raw data, ex: a file transfer, and
+			answers again when it starts a new one
+		"""
+		if codec == CODEC_ZLIB and self.decompressor is None:
+			self.decompressor = zlib.decompressobj()
+			self.buffer = bytearray(self.decompressor.decompress(self.buffer[self.pos:]))
+			self.pos = 0
+			if self.decompressor.eof:
+				self.buffer += self.decompressor.unused_data
+				self.decompressor = None
+		elif codec:
+			raise ValueError("unknown codec '%s'" % codec)
+
+	############################################################################
+	def read_frame(self):
+		"""
+		PURPOSE: waits for the next frame
+		ARGS:
+		RETURNS: (tuple) channel and payload (bytes), None if the connection
+			was closed
+		NOTES: raises ValueError if the peer sends a frame that is too large.
+			Data is received into one reusable buffer and consumed frames
+			are only cut off the front of buffer once they make up half of
+			it, so a large payload is not moved for every frame read
+		"""
+		while True:
+			num_buffered = len(self.buffer) - self.pos
+			if num_buffered >= FRAME_HEADER.size:
+				channel, length = FRAME_HEADER.unpack_from(self.buffer, self.pos)
+				if length > MAX_FRAME_SIZE:
+					raise ValueError("frame of %d bytes is too large" % length)
+				if num_buffered >= FRAME_HEADER.size + length:
+					start = self.pos + FRAME_HEADER.size
+					with memoryview(self.buffer) as view:
+						payload = bytes(view[start:start + length])
+					self.pos = start + length
+					if self.pos == len(self.buffer):
+						self.buffer.clear()
+						self.pos = 0
+					elif self.pos * 2 >= len(self.buffer):
+						del self.buffer[:self.pos]
+						self.pos = 0
+					return channel, payload
+
+			num_received = self.sock.recv_into(self.recv_view)
+			if not num_received:
+				return None
+			data = self.recv_view[:num_received]
+			if self.decompressor is not None:
+				data = self.decompressor.decompress(data)
+				if self.decompressor.eof:
+					#Compressed stream ended, what follows is raw
+					data += self.decompressor.unused_data
+					self.decompressor = None
+			self.buffer += data
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
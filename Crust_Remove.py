@@ -0,0 +1,306 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import stat
+import queue
+import threading
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+DEFAULT_NUM_WORKERS = 16
+#How often progress is reported while a removal runs (seconds)
+DEFAULT_PROGRESS_INTERVAL = 1.0
+#Flags directories are opened with, never following a symlink out of the tree
+DIR_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_NOFOLLOW", 0) | getattr(os, "O_CLOEXEC", 0)
+#Removing relative to directory file descriptors needs all of these, otherwise
+#trees are removed one path at a time
+DIR_FD_SUPPORTED = (os.scandir in os.supports_fd and os.open in os.supports_dir_fd and os.unlink in os.supports_dir_fd and os.rmdir in os.supports_dir_fd)
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Dir_Node:
+	"""
+	Directory being removed, waiting on its own entries and its subdirectories
+	"""
+	__slots__ = ("name", "path", "parent", "fd", "pending", "failed")
+
+	############################################################################
+	def __init__(self, name, path, parent):
+		"""
+		PURPOSE: creates a new Dir_Node
+		ARGS:
+			name (str): name of the directory within its parent
+			path (str): full path of the directory, for reporting
+			parent (Dir_Node): directory this one is in, None for the top of
+				a tree
+		RETURNS: new instance of a Dir_Node
+		NOTES: pending starts at one for the scan of the directory itself
+		"""
+		self.name = name
+		self.path = path
+		self.parent = parent
+		self.fd = None
+		self.pending = 1
+		self.failed = False
+
+################################################################################
+class Remover:
+	"""
+	Removes files and directory trees, unlinking subtrees on worker threads
+	"""
+	############################################################################
+	def __init__(self, num_workers=DEFAULT_NUM_WORKERS, dry_run=False):
+		"""
+		PURPOSE: creates a new Remover
+		ARGS:
+			num_workers (int): number of directories emptied at the same time
+			dry_run (bool): true to only count what would be removed
+		RETURNS: new instance of a Remover
+		NOTES: errors do not stop the removal, they are collected in errors.
+			A directory that could not be emptied is left in place along
+			with every directory above it
+		"""
+		#Save arguments
+		self.num_workers = max(1, num_workers)
+		self.dry_run = dry_run
+
+		#Define properties
+		self.errors = []
+		self.num_files = 0
+		self.num_dirs = 0
+		self.lock = threading.Lock()
+		self.done_event = threading.Event()
+		self.num_trees = 0
+
+	############################################################################
+	def add_error(self, path, e):
+		"""
+		PURPOSE: records an error
+		ARGS:
+			path (str): path the error happened on
+			e (OSError): the error
+		RETURNS: none
+		NOTES: thread safe
+		"""
+		with self.lock:
+			self.errors.append((path, e))
+
+	############################################################################
+	def remove_file(self, path):
+		"""
+		PURPOSE: removes a single file or symlink
+		ARGS:
+			path (str): path to remove
+		RETURNS: none
+		NOTES: records any error
+		"""
+		try:
+			if not self.dry_run:
+				os.unlink(path)
+			elif not os.path.lexists(path):
+				raise FileNotFoundError(2, "No such file or directory", path)
+			with self.lock:
+				self.num_files += 1
+		except OSError as e:
+			self.add_error(path, e)
+
+	############################################################################
+	def scan_dir(self, node, dir_queue):
+		"""
+		PURPOSE: unlinks the files of a directory and queues its subdirectories
+		ARGS:
+			node (Dir_Node): directory to empty
+			dir_queue (queue.LifoQueue): where subdirectories are queued
+		RETURNS: none
+		NOTES: runs on a worker thread. Every operation is relative to the
+			directory's file descriptor so it cannot be redirected by a
+			symlink swapped in part way through
+		"""
+		try:
+			if node.parent is None:
+				node.fd = os.open(node.path, DIR_OPEN_FLAGS)
+			else:
+				node.fd = os.open(node.name, DIR_OPEN_FLAGS, dir_fd=node.parent.fd)
+			with os.scandir(node.fd) as it:
+				entries = list(it)
+		except OSError as e:
+			self.add_error(node.path, e)
+			node.failed = True
+			return
+
+		num_files = 0
+		for entry in entries:
+			entry_path = os.path.join(node.path, entry.name)
+			try:
+				is_dir = entry.is_dir(follow_symlinks=False)
+			except OSError:
+				is_dir = False
+			if is_dir:
+				with self.lock:
+					node.pending += 1
+				dir_queue.put(Dir_Node(entry.name, entry_path, node))
+				continue
+			try:
+				if not self.dry_run:
+					os.unlink(entry.name, dir_fd=node.fd)
+				num_files += 1
+			except OSError as e:
+				self.add_error(entry_path, e)
+				node.failed = True
+		with self.lock:
+			self.num_files += num_files
+
+	############################################################################
+	def finish_part(self, node):
+		"""
+		PURPOSE: marks one piece of a directory's work as done, removing the
+			directory once nothing is left in it
+		ARGS:
+			node (Dir_Node): directory whose scan or subdirectory finished
+		RETURNS: none
+		NOTES: finishing a directory may finish its parent, and so on up
+		"""
+		while node is not None:
+			with self.lock:
+				node.pending -= 1
+				if node.pending:
+					return
+			if node.fd is not None:
+				os.close(node.fd)
+				node.fd = None
+
+			parent = node.parent
+			if not node.failed:
+				try:
+					if self.dry_run:
+						pass
+					elif parent is None:
+						os.rmdir(node.path)
+					else:
+						os.rmdir(node.name, dir_fd=parent.fd)
+					with self.lock:
+						self.num_dirs += 1
+				except OSError as e:
+					self.add_error(node.path, e)
+					node.failed = True
+			if parent is None:
+				with self.lock:
+					self.num_trees -= 1
+					if self.num_trees == 0:
+						self.done_event.set()
+			elif node.failed:
+				#Parent cannot be removed with this directory still in it
+				parent.failed = True
+			node = parent
+
+	############################################################################
+	def worker(self, dir_queue):
+		"""
+		PURPOSE: empties directories until told to exit
+		ARGS:
+			dir_queue (queue.LifoQueue): directories to empty, None tells the
+				worker to exit
+		RETURNS: none
+		NOTES: to be run in a separate thread. The queue is last in first out
+			so trees are removed depth first and few directories are held
+			open at once
+		"""
+		while True:
+			node = dir_queue.get()
+			if node is None:
+				break
+			try:
+				self.scan_dir(node, dir_queue)
+			finally:
+				self.finish_part(node)
+
+	############################################################################
+	def remove_tree_by_path(self, path):
+		"""
+		PURPOSE: removes a directory tree without directory file descriptors
+		ARGS:
+			path (str): directory to remove
+		RETURNS: none
+		NOTES: single threaded fallback for platforms without dir_fd support
+		"""
+		failed_dirs = set()
+		for dir_path, dir_names, file_names in os.walk(path, topdown=False, onerror=lambda e: self.add_error(e.filename, e)):
+			failed = dir_path in failed_dirs
+			for name in file_names:
+				num_errors = len(self.errors)
+				self.remove_file(os.path.join(dir_path, name))
+				failed = failed or len(self.errors) != num_errors
+			for name in dir_names:
+				sub_path = os.path.join(dir_path, name)
+				if os.path.islink(sub_path):
+					self.remove_file(sub_path)
+			if failed:
+				failed_dirs.add(os.path.dirname(dir_path))
+				continue
+			try:
+				if not self.dry_run:
+					os.rmdir(dir_path)
+				self.num_dirs += 1
+			except OSError as e:
+				self.add_error(dir_path, e)
+				failed_dirs.add(os.path.dirname(dir_path))
+
+	############################################################################
+	def remove(self, paths, progress=None, progress_interval=DEFAULT_PROGRESS_INTERVAL):
+		"""
+		PURPOSE: removes files and directory trees
+		ARGS:
+			paths (list): paths to remove, directories are removed with
+				everything in them
+			progress (function): called with the number of files and
+				directories removed so far every progress_interval seconds
+				while trees are being removed, None for no progress
+			progress_interval (float): seconds between progress calls
+		RETURNS: none
+		NOTES: progress is called from the calling thread
+		"""
+		trees = []
+		for path in paths:
+			try:
+				is_dir = stat.S_ISDIR(os.lstat(path).st_mode)
+			except OSError as e:
+				self.add_error(path, e)
+				continue
+			if is_dir:
+				trees.append(path)
+			else:
+				self.remove_file(path)
+		if not trees:
+			return
+
+		if not DIR_FD_SUPPORTED:
+			for path in trees:
+				self.remove_tree_by_path(path)
+			return
+
+		dir_queue = queue.LifoQueue()
+		self.num_trees = len(trees)
+		self.done_event.clear()
+		threads = []
+		for ii in range(self.num_workers):
+			thread = threading.Thread(target=self.worker, args=(dir_queue,), daemon=True)
+			thread.start()
+			threads.append(thread)
+		try:
+			for path in trees:
+				dir_queue.put(Dir_Node(os.path.basename(path), path, None))
+			while not self.done_event.wait(progress_interval):
+				if progress is not None:
+					progress(self.num_files, self.num_dirs)
+		finally:
+			for thread in threads:
+				dir_queue.put(None)
+			for thread in threads:
+				thread.join()
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
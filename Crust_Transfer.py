@@ -0,0 +1,635 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import stat
+import time
+import hashlib
+import threading
+from Crust_Protocol import encode_control, encode_transfer, decode_transfer, FRAME_HEADER, FILE_FRAME_SIZE, CHANNEL_CONTROL, CHANNEL_FILE, CTRL_FILE_OFFER, CTRL_FILE_REQUEST, CTRL_FILE_START, CTRL_FILE_END, CTRL_FILE_DONE, TRANSFER_MESSAGES
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#Checksum of every file moved, over the whole file even when resumed
+HASH_NAME = "sha256"
+HASH_CHUNK_SIZE = 1024 * 1024
+#Bytes a client takes from its socket at a time, file data comes in frames
+#of FILE_FRAME_SIZE so small reads would mean many calls per frame
+RECV_BUFFER_SIZE = 1024 * 1024
+OPEN_FLAGS = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+################################################################################
+###                             Helper Functions                             ###
+################################################################################
+def hash_file(fd, size):
+	"""
+	PURPOSE: checksums the start of a file
+	ARGS:
+		fd (int): file descriptor to read, its position is not used
+		size (int): number of bytes from the start to checksum
+	RETURNS: (hashlib object) HASH_NAME of the bytes, more can be added
+	NOTES: raises EOFError if the file is shorter than size
+	"""
+	hasher = hashlib.new(HASH_NAME)
+	pos = 0
+	while pos < size:
+		data = os.pread(fd, min(HASH_CHUNK_SIZE, size - pos), pos)
+		if not data:
+			raise EOFError("file ended %d bytes early" % (size - pos))
+		hasher.update(data)
+		pos += len(data)
+	return hasher
+
+################################################################################
+def hash_in_background(fd, size):
+	"""
+	PURPOSE: checksums the start of a file on another thread
+	ARGS:
+		fd (int): file descriptor to read, must stay open until the result is
+			taken
+		size (int): number of bytes from the start to checksum
+	RETURNS: (function) waits for the checksum and returns it as hex, raises
+		whatever hash_file raised
+	NOTES: hashing and reading release the GIL so this overlaps with sending
+		the file instead of adding to it
+	"""
+	result = {}
+
+	def run():
+		try:
+			result["digest"] = hash_file(fd, size).hexdigest()
+		except (OSError, EOFError) as e:
+			result["error"] = e
+
+	thread = threading.Thread(target=run, daemon=True)
+	thread.start()
+
+	def wait():
+		thread.join()
+		if "error" in result:
+			raise result["error"]
+		return result["digest"]
+
+	return wait
+
+################################################################################
+def send_file_frames(sock, send_lock, fh, offset, count):
+	"""
+	PURPOSE: sends part of a file as file data frames on a blocking socket
+	ARGS:
+		sock (socket): socket to send on
+		send_lock (threading.Lock): held while each frame is sent
+		fh (file object): binary file to send from
+		offset (int): where in the file to start
+		count (int): number of bytes to send
+	RETURNS: none
+	NOTES: the data goes from the file to the socket with sendfile where the
+		platform has it. Raises EOFError if the file is shorter than
+		expected, after padding the frame so the connection stays usable
+	"""
+	while count > 0:
+		num_bytes = min(count, FILE_FRAME_SIZE)
+		with send_lock:
+			sock.sendall(FRAME_HEADER.pack(CHANNEL_FILE, num_bytes))
+			num_sent = sock.sendfile(fh, offset, num_bytes)
+			if num_sent != num_bytes:
+				sock.sendall(bytes(num_bytes - num_sent))
+				raise EOFError("file ended %d bytes early" % (count - num_sent))
+		offset += num_sent
+		count -= num_sent
+
+################################################################################
+def error_text(e):
+	"""
+	PURPOSE: describes an error for the other end of a transfer
+	ARGS:
+		e (Exception): the error
+	RETURNS: (str) the system's description for OSErrors that have one,
+		otherwise the error's message
+	NOTES:
+	"""
+	if isinstance(e, OSError) and e.strerror:
+		return e.strerror
+	return str(e)
+
+################################################################################
+def format_rate(num_bytes, seconds):
+	"""
+	PURPOSE: formats how much was moved and how fast
+	ARGS:
+		num_bytes (int): bytes moved
+		seconds (float): time it took
+	RETURNS: (str) ex: '64.0M in 85.1ms (752.0M/s)'
+	NOTES:
+	"""
+	from Crust import human_readable_size
+	from Crust_Metrics import format_seconds
+	rate = num_bytes / seconds if seconds > 0 else 0.0
+	return "%s in %s (%s/s)" % (human_readable_size(num_bytes), format_seconds(seconds), human_readable_size(rate))
+
+################################################################################
+def parse_transfer_args(crust, cmd_name, cmd_args):
+	"""
+	PURPOSE: reads the arguments of 'get' and 'put'
+	ARGS:
+		crust (Crust): shell running the command
+		cmd_name (str): name of the command, for errors
+		cmd_args (list): list of strings representing arguments
+	RETURNS: (tuple) true if '-c' was given, the source and the destination
+		(None if not given), or None after reporting a usage error
+	NOTES:
+	"""
+	resume = False
+	paths = []
+	for cur_arg in cmd_args:
+		if cur_arg in ("-c", "--continue"):
+			resume = True
+		elif cur_arg.startswith("-") and len(cur_arg) > 1:
+			crust.write_err_and_flush("%s: invalid option '%s'\n" % (cmd_name, cur_arg))
+			return None
+		else:
+			paths.append(cur_arg)
+	if len(paths) not in (1, 2):
+		crust.write_err_and_flush("%s: usage: %s [-c] SOURCE [DESTINATION]\n" % (cmd_name, cmd_name))
+		return None
+	return resume, paths[0], paths[1] if len(paths) > 1 else None
+
+################################################################################
+def read_reply(link, msg_type):
+	"""
+	PURPOSE: waits for a transfer message from the client
+	ARGS:
+		link (Async_Transfer_Link): connection of the session
+		msg_type (int): CTRL_FILE_ constant to wait for
+	RETURNS: (dict) fields of the message
+	NOTES: anything else, ex: data of an earlier transfer that failed, is
+		dropped. Raises ConnectionError if the client hangs up first
+	"""
+	while True:
+		frame = link.read_frame()
+		if frame is None:
+			raise ConnectionError("client hung up")
+		channel, payload = frame
+		if channel == CHANNEL_CONTROL and payload and payload[0] == msg_type:
+			return decode_transfer(payload[1:])
+
+################################################################################
+def cmd_get(crust, cmd_args):
+	"""
+	PURPOSE: executes 'get' command, sends a file to the client
+	ARGS:
+		crust (Crust): shell running the command
+		cmd_args (list): list of strings representing arguments
+	RETURNS: (int) exit status
+	NOTES: may write to fout and ferr. 'get [-c] REMOTE [LOCAL]' saves REMOTE
+		as LOCAL on the client, by default under its own name in the
+		client's directory. '-c' continues from the end of a partial LOCAL.
+		Only works in a remote session whose client handles transfers
+	"""
+	link = crust.transfer_link
+	if link is None:
+		crust.write_err_and_flush("get: only available in a remote session\n")
+		return 1
+	parsed = parse_transfer_args(crust, "get", cmd_args)
+	if parsed is None:
+		return 2
+	resume, remote, local = parsed
+
+	path = crust.abs_path(remote)
+	try:
+		fh = open(path, 'rb', buffering=0)
+	except OSError as e:
+		crust.write_err_and_flush("get: %s: %s\n" % (remote, e.strerror or e))
+		return 1
+	try:
+		with fh:
+			st = os.fstat(fh.fileno())
+			if not stat.S_ISREG(st.st_mode):
+				crust.write_err_and_flush("get: %s: Not a regular file\n" % remote)
+				return 1
+			size = st.st_size
+
+			crust.flush_output()
+			start = time.perf_counter()
+			link.send_message(CTRL_FILE_OFFER, {"name": local, "source": os.path.basename(path), "size": size, "resume": resume})
+			reply = read_reply(link, CTRL_FILE_START)
+			if "error" in reply:
+				crust.write_err_and_flush("get: %s: %s\n" % (local or remote, reply["error"]))
+				return 1
+			offset = reply.get("offset", 0)
+			if not isinstance(offset, int):
+				raise ValueError("client sent a bad offset")
+			if not 0 <= offset <= size:
+				offset = 0
+
+			#The checksum covers the whole file so it is read while the rest is
+			#being sent, the kernel sends it straight from the page cache
+			wait_hash = hash_in_background(fh.fileno(), size)
+			try:
+				try:
+					link.send_file(fh, offset, size - offset)
+				finally:
+					digest = wait_hash()
+				end = {"size": size, HASH_NAME: digest}
+			except EOFError as e:
+				end = {"error": "file changed while being sent (%s)" % e}
+			link.send_message(CTRL_FILE_END, end)
+			done = read_reply(link, CTRL_FILE_DONE)
+	except (ConnectionError, TimeoutError, ValueError) as e:
+		#Client went away or does not speak the protocol
+		crust.write_err_and_flush("get: %s: %s\n" % (remote, error_text(e)))
+		return 1
+
+	if "error" in end or "error" in done:
+		crust.write_err_and_flush("get: %s: %s\n" % (remote, end.get("error") or done["error"]))
+		return 1
+	crust.bytes_out += size - offset
+	msg = "get: %s: %s" % (remote, format_rate(size - offset, time.perf_counter() - start))
+	if offset:
+		msg += ", resumed at %d" % offset
+	crust.write_out_and_flush(msg + "\n")
+	return 0
+
+################################################################################
+def cmd_put(crust, cmd_args):
+	"""
+	PURPOSE: executes 'put' command, takes a file from the client
+	ARGS:
+		crust (Crust): shell running the command
+		cmd_args (list): list of strings representing arguments
+	RETURNS: (int) exit status
+	NOTES: may write to fout and ferr. 'put [-c] LOCAL [REMOTE]' saves the
+		client's LOCAL as REMOTE, by default under its own name in the
+		working directory. '-c' continues from the end of a partial
+		REMOTE. Only works in a remote session whose client handles
+		transfers
+	"""
+	link = crust.transfer_link
+	if link is None:
+		crust.write_err_and_flush("put: only available in a remote session\n")
+		return 1
+	parsed = parse_transfer_args(crust, "put", cmd_args)
+	if parsed is None:
+		return 2
+	resume, local, remote = parsed
+
+	path = crust.abs_path(remote if remote is not None else os.path.basename(local))
+	if os.path.isdir(path):
+		path = os.path.join(path, os.path.basename(local))
+	name = remote or os.path.basename(path)
+	#Opened before asking so a bad destination costs no data
+	try:
+		receiver = File_Receiver(path)
+	except OSError as e:
+		crust.write_err_and_flush("put: %s: %s\n" % (name, e.strerror or e))
+		return 1
+
+	error = None
+	finished = False
+	try:
+		crust.flush_output()
+		start = time.perf_counter()
+		link.send_message(CTRL_FILE_REQUEST, {"name": local, "offset": receiver.existing_size if resume else 0})
+		reply = read_reply(link, CTRL_FILE_START)
+		if "error" in reply:
+			crust.write_err_and_flush("put: %s: %s\n" % (local, reply["error"]))
+			return 1
+		size = reply.get("size")
+		offset = reply.get("offset", 0)
+		if not isinstance(size, int) or not isinstance(offset, int):
+			raise ValueError("client sent a bad file size or offset")
+		try:
+			receiver.start(size, offset)
+		except (OSError, EOFError) as e:
+			error = error_text(e)
+
+		#Data keeps coming whatever happens here, it is read to the end so
+		#the session stays in step with the client
+		while not finished:
+			frame = link.read_frame()
+			if frame is None:
+				raise ConnectionError("client hung up")
+			channel, payload = frame
+			if channel == CHANNEL_FILE:
+				if error is None:
+					try:
+						receiver.write(payload)
+					except (OSError, ValueError) as e:
+						error = error_text(e)
+			elif payload and payload[0] == CTRL_FILE_END:
+				if error is None:
+					error = receiver.finish(decode_transfer(payload[1:]))
+				finished = True
+	except (ConnectionError, TimeoutError, ValueError) as e:
+		#Client went away or does not speak the protocol
+		error = error_text(e)
+	finally:
+		receiver.close(discard=error is not None or not finished)
+
+	if error is not None:
+		crust.write_err_and_flush("put: %s: %s\n" % (name, error))
+		return 1
+	msg = "put: %s: %s" % (name, format_rate(size - offset, time.perf_counter() - start))
+	if offset:
+		msg += ", resumed at %d" % offset
+	crust.write_out_and_flush(msg + "\n")
+	return 0
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class File_Receiver:
+	"""
+	File being written from file data frames, checked against the sender's
+	checksum at the end
+	"""
+	############################################################################
+	def __init__(self, path):
+		"""
+		PURPOSE: creates a new File_Receiver, opening the file without
+			changing it
+		ARGS:
+			path (str): file to write, created if missing
+		RETURNS: new instance of a File_Receiver
+		NOTES: raises OSError if the file cannot be opened or is not a
+			regular file
+		"""
+		#Save arguments
+		self.path = path
+
+		#Define properties
+		self.created = not os.path.lexists(path)
+		self.fd = os.open(path, OPEN_FLAGS, 0o666)
+		st = os.fstat(self.fd)
+		if not stat.S_ISREG(st.st_mode):
+			os.close(self.fd)
+			self.fd = None
+			raise OSError("Not a regular file")
+		self.existing_size = st.st_size
+		self.hasher = None
+		self.size = 0
+		self.offset = 0
+		self.received = 0
+
+	############################################################################
+	def start(self, size, offset):
+		"""
+		PURPOSE: gets ready for the data
+		ARGS:
+			size (int): size of the whole file
+			offset (int): where the data starts, what is before it is kept
+		RETURNS: none
+		NOTES: the kept part is read for the checksum and anything past it
+			is cut off. Raises EOFError if offset is past the end of the file
+		"""
+		if offset > self.existing_size:
+			raise EOFError("cannot resume at %d, the file only has %d bytes" % (offset, self.existing_size))
+		self.hasher = hash_file(self.fd, offset)
+		os.ftruncate(self.fd, offset)
+		os.lseek(self.fd, offset, os.SEEK_SET)
+		self.size = size
+		self.offset = offset
+		self.received = 0
+
+	############################################################################
+	def write(self, data):
+		"""
+		PURPOSE: writes the next piece of the file
+		ARGS:
+			data (bytes): data of a file data frame
+		RETURNS: none
+		NOTES: raises ValueError if the sender goes past the size it gave
+		"""
+		if self.offset + self.received + len(data) > self.size:
+			raise ValueError("sender went past the %d bytes it offered" % self.size)
+		with memoryview(data) as view:
+			while view:
+				num_written = os.write(self.fd, view)
+				view = view[num_written:]
+		self.hasher.update(data)
+		self.received += len(data)
+
+	############################################################################
+	def finish(self, fields):
+		"""
+		PURPOSE: checks the file against the end of transfer message
+		ARGS:
+			fields (dict): fields of the sender's CTRL_FILE_END
+		RETURNS: (str) what is wrong with the file, None if it is good
+		NOTES:
+		"""
+		if "error" in fields:
+			return str(fields["error"])
+		if self.offset + self.received != self.size or fields.get("size") != self.size:
+			return "only got %d of %d bytes" % (self.offset + self.received, self.size)
+		if fields.get(HASH_NAME) != self.hasher.hexdigest():
+			return "%s checksum does not match, try again without -c" % HASH_NAME
+		return None
+
+	############################################################################
+	def close(self, discard=False):
+		"""
+		PURPOSE: closes the file
+		ARGS:
+			discard (bool): true if the transfer failed, a file this created
+				and received nothing into is removed
+		RETURNS: none
+		NOTES: data that was received is kept so the transfer can be resumed
+		"""
+		if self.fd is None:
+			return
+		os.close(self.fd)
+		self.fd = None
+		if discard and self.created and not self.received:
+			try:
+				os.unlink(self.path)
+			except OSError:
+				pass
+
+################################################################################
+class Transfer_Client:
+	"""
+	Client side of 'get' and 'put', answers the server's transfer messages
+	"""
+	############################################################################
+	def __init__(self, sock, send_lock, allowed=None):
+		"""
+		PURPOSE: creates a new Transfer_Client
+		ARGS:
+			sock (socket): blocking socket to the server
+			send_lock (threading.Lock): held by everything sending on sock so
+				frames do not interleave
+			allowed (function): called with CTRL_FILE_OFFER or
+				CTRL_FILE_REQUEST and the local file name the server asked
+				for (None for the default), returns true to go ahead. None
+				allows everything
+		RETURNS: new instance of a Transfer_Client
+		NOTES: meant to be fed every frame from the server by the thread
+			reading them, see handle_frame. Sending a file blocks that
+			thread until it is sent, the server sends nothing meanwhile
+		"""
+		#Save arguments
+		self.sock = sock
+		self.send_lock = send_lock
+		self.allowed = allowed
+
+		#Define properties
+		self.receiver = None
+		self.error = None
+
+	############################################################################
+	def send_message(self, msg_type, fields):
+		"""
+		PURPOSE: sends a transfer message to the server
+		ARGS:
+			msg_type (int): one of the CTRL_FILE_ constants
+			fields (dict): json serializable fields of the message
+		RETURNS: none
+		NOTES:
+		"""
+		with self.send_lock:
+			self.sock.sendall(encode_control(msg_type, encode_transfer(fields)))
+
+	############################################################################
+	def handle_frame(self, channel, payload):
+		"""
+		PURPOSE: handles a frame from the server if it is part of a transfer
+		ARGS:
+			channel (int): channel of the frame
+			payload (bytes): data of the frame
+		RETURNS: (bool) true if the frame was handled
+		NOTES:
+		"""
+		if channel == CHANNEL_FILE:
+			if self.receiver is not None and self.error is None:
+				try:
+					self.receiver.write(payload)
+				except (OSError, ValueError) as e:
+					self.error = error_text(e)
+			return True
+		if channel != CHANNEL_CONTROL or not payload or payload[0] not in TRANSFER_MESSAGES:
+			return False
+		try:
+			fields = decode_transfer(payload[1:])
+		except ValueError:
+			return True
+		if payload[0] == CTRL_FILE_OFFER:
+			self.start_receive(fields)
+		elif payload[0] == CTRL_FILE_END:
+			self.finish_receive(fields)
+		elif payload[0] == CTRL_FILE_REQUEST:
+			self.send_file(fields)
+		return True
+
+	############################################################################
+	def start_receive(self, fields):
+		"""
+		PURPOSE: accepts a file the server offers
+		ARGS:
+			fields (dict): fields of the CTRL_FILE_OFFER
+		RETURNS: none
+		NOTES: answers with where the server should start, or why not
+		"""
+		name = fields.get("name")
+		source = os.path.basename(str(fields.get("source", "")))
+		if self.allowed is not None and not self.allowed(CTRL_FILE_OFFER, name):
+			self.send_message(CTRL_FILE_START, {"error": "client did not ask for this file"})
+			return
+		path = name if name is not None else source
+		if not path or path in (os.curdir, os.pardir):
+			self.send_message(CTRL_FILE_START, {"error": "no file name to save as"})
+			return
+		if os.path.isdir(path):
+			path = os.path.join(path, source)
+
+		size = fields.get("size", 0)
+		if not isinstance(size, int) or size < 0:
+			self.send_message(CTRL_FILE_START, {"error": "server sent a bad file size"})
+			return
+		try:
+			receiver = File_Receiver(path)
+		except OSError as e:
+			self.send_message(CTRL_FILE_START, {"error": "%s: %s" % (path, error_text(e))})
+			return
+		offset = 0
+		if fields.get("resume") and receiver.existing_size <= size:
+			offset = receiver.existing_size
+		try:
+			receiver.start(size, offset)
+		except (OSError, EOFError) as e:
+			receiver.close(discard=True)
+			self.send_message(CTRL_FILE_START, {"error": "%s: %s" % (path, error_text(e))})
+			return
+		self.receiver = receiver
+		self.error = None
+		self.send_message(CTRL_FILE_START, {"offset": offset})
+
+	############################################################################
+	def finish_receive(self, fields):
+		"""
+		PURPOSE: checks a received file and tells the server how it went
+		ARGS:
+			fields (dict): fields of the CTRL_FILE_END
+		RETURNS: none
+		NOTES:
+		"""
+		receiver = self.receiver
+		if receiver is None:
+			return
+		self.receiver = None
+		error = self.error
+		if error is None:
+			error = receiver.finish(fields)
+		receiver.close(discard=error is not None)
+		if error is None:
+			self.send_message(CTRL_FILE_DONE, {})
+		else:
+			self.send_message(CTRL_FILE_DONE, {"error": error})
+
+	############################################################################
+	def send_file(self, fields):
+		"""
+		PURPOSE: sends a file the server asks for
+		ARGS:
+			fields (dict): fields of the CTRL_FILE_REQUEST
+		RETURNS: none
+		NOTES: the checksum is worked out while the data is sent
+		"""
+		name = fields.get("name")
+		if self.allowed is not None and not self.allowed(CTRL_FILE_REQUEST, name):
+			self.send_message(CTRL_FILE_START, {"error": "client did not offer this file"})
+			return
+		offset = fields.get("offset", 0)
+		if not isinstance(offset, int):
+			self.send_message(CTRL_FILE_START, {"error": "server sent a bad offset"})
+			return
+		try:
+			fh = open(str(name), 'rb', buffering=0)
+		except OSError as e:
+			self.send_message(CTRL_FILE_START, {"error": error_text(e)})
+			return
+		with fh:
+			st = os.fstat(fh.fileno())
+			if not stat.S_ISREG(st.st_mode):
+				self.send_message(CTRL_FILE_START, {"error": "Not a regular file"})
+				return
+			size = st.st_size
+			if not 0 <= offset <= size:
+				offset = 0
+			self.send_message(CTRL_FILE_START, {"size": size, "offset": offset})
+
+			wait_hash = hash_in_background(fh.fileno(), size)
+			try:
+				try:
+					send_file_frames(self.sock, self.send_lock, fh, offset, size - offset)
+				finally:
+					digest = wait_hash()
+				end = {"size": size, HASH_NAME: digest}
+			except EOFError as e:
+				end = {"error": "file changed while being sent (%s)" % e}
+			self.send_message(CTRL_FILE_END, end)
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
@@ -0,0 +1,214 @@
+################################################################################
+###                                 Imports                                  ###
+################################################################################
+import os
+import re
+import fnmatch
+import queue
+import threading
+import collections
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+DEFAULT_NUM_WORKERS = 16
+#Max number of scanned directories waiting to be consumed
+DEFAULT_MAX_QUEUED = 64
+#Max number of directories waiting to be scanned that any worker can take,
+#past this a worker keeps the subdirectories it finds for itself
+DEFAULT_MAX_PENDING_DIRS = 4096
+#How often blocked workers check if the walk has been stopped (seconds)
+STOP_POLL_INTERVAL = 0.1
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Walker:
+	"""
+	Parallel directory walker built on os.scandir
+	"""
+	############################################################################
+	def __init__(self, root, max_depth=None, excludes=(), num_workers=DEFAULT_NUM_WORKERS, max_queued=DEFAULT_MAX_QUEUED, onerror=None, max_pending_dirs=DEFAULT_MAX_PENDING_DIRS):
+		"""
+		PURPOSE: creates a new Walker
+		ARGS:
+			root (str): directory to start walking from
+			max_depth (int): how many levels below root to descend, None for
+				no limit
+			excludes (iterable): names or glob patterns of entries to skip.
+				Patterns containing a path separator are matched against
+				the full path instead of the name
+			num_workers (int): number of threads scanning directories
+			max_queued (int): max number of scanned directories that can be
+				waiting to be consumed before the workers block
+			onerror (function): called with the OSError when a directory
+				cannot be scanned, errors are ignored if None
+			max_pending_dirs (int): max number of directories queued for
+				any worker to scan
+		RETURNS: new instance of a Walker
+		NOTES: the walk is started by iterating over walk()
+		"""
+		#Save arguments
+		self.root = root
+		self.max_depth = max_depth
+		#Compile excludes into one regex each for names and full paths
+		name_excludes = []
+		path_excludes = []
+		for exclude in excludes:
+			if os.sep in exclude:
+				path_excludes.append(fnmatch.translate(os.path.normpath(exclude)))
+			else:
+				name_excludes.append(fnmatch.translate(exclude))
+		self.name_exclude_re = None
+		self.path_exclude_re = None
+		if name_excludes:
+			self.name_exclude_re = re.compile("|".join(name_excludes))
+		if path_excludes:
+			self.path_exclude_re = re.compile("|".join(path_excludes))
+		self.num_workers = max(1, num_workers)
+		self.max_queued = max(1, max_queued)
+		self.onerror = onerror
+		self.max_pending_dirs = max(1, max_pending_dirs)
+
+		#Define properties
+		self.stop_event = threading.Event()
+
+	############################################################################
+	def is_excluded(self, entry):
+		"""
+		PURPOSE: checks if a directory entry should be skipped
+		ARGS:
+			entry (os.DirEntry): entry to check
+		RETURNS: (bool) true if the entry matches one of the excludes
+		NOTES:
+		"""
+		if self.name_exclude_re is not None and self.name_exclude_re.match(entry.name):
+			return True
+		if self.path_exclude_re is not None and self.path_exclude_re.match(entry.path):
+			return True
+		return False
+
+	############################################################################
+	def stop(self):
+		"""
+		PURPOSE: stops the walk early
+		ARGS:
+		RETURNS: none
+		NOTES: safe to call from any thread
+		"""
+		self.stop_event.set()
+
+	############################################################################
+	def worker(self, dir_queue, result_queue):
+		"""
+		PURPOSE: scans directories until told to exit
+		ARGS:
+			dir_queue (queue.LifoQueue): (path, depth) of directories to scan,
+				None tells the worker to exit
+			result_queue (queue.Queue): where (path, entries, num subdirs
+				found, error) of each scanned directory is put
+		RETURNS: none
+		NOTES: to be run in a separate thread. Subdirectories go on
+			dir_queue while it holds fewer than max_pending_dirs, the rest
+			are kept and scanned by this worker, handed out again as
+			dir_queue drains
+		"""
+		while True:
+			item = dir_queue.get()
+			if item is None:
+				break
+			own_dirs = collections.deque([item])
+			while own_dirs:
+				#Share what this worker has kept whenever there is room
+				while len(own_dirs) > 1 and dir_queue.qsize() < self.max_pending_dirs:
+					dir_queue.put(own_dirs.popleft())
+				dir_path, depth = own_dirs.pop()
+
+				entries = []
+				subdirs = []
+				error = None
+				if not self.stop_event.is_set():
+					try:
+						with os.scandir(dir_path) as it:
+							if self.name_exclude_re is None and self.path_exclude_re is None:
+								entries = list(it)
+							else:
+								for entry in it:
+									if not self.is_excluded(entry):
+										entries.append(entry)
+					except OSError as e:
+						error = e
+
+					if self.max_depth is None or depth < self.max_depth:
+						for entry in entries:
+							try:
+								is_dir = entry.is_dir(follow_symlinks=False)
+							except OSError:
+								is_dir = False
+							if is_dir:
+								subdirs.append(entry.path)
+
+				#Hand back the result before queueing subdirectories so the
+				#consumer always sees a directory before any of its children
+				#and knows how much work is outstanding
+				result = (dir_path, entries, len(subdirs), error)
+				while True:
+					try:
+						result_queue.put(result, timeout=STOP_POLL_INTERVAL)
+						break
+					except queue.Full:
+						if self.stop_event.is_set():
+							break
+				room = self.max_pending_dirs - dir_queue.qsize()
+				for sub_path in subdirs:
+					if room > 0:
+						dir_queue.put((sub_path, depth + 1))
+						room -= 1
+					else:
+						own_dirs.append((sub_path, depth + 1))
+
+	############################################################################
+	def walk(self):
+		"""
+		PURPOSE: walks the tree
+		ARGS:
+		RETURNS: (generator) (path, entries) for each directory, where entries
+			is a list of os.DirEntry
+		NOTES: directories are yielded as soon as they are scanned, in no
+			particular order. Closing the generator stops the walk. Memory
+			is bounded by max_queued results, max_pending_dirs shared
+			directories to scan and the directories each worker keeps
+		"""
+		dir_queue = queue.LifoQueue()
+		result_queue = queue.Queue(self.max_queued)
+		threads = []
+		for ii in range(self.num_workers):
+			thread = threading.Thread(target=self.worker, args=(dir_queue, result_queue), daemon=True)
+			thread.start()
+			threads.append(thread)
+
+		try:
+			dir_queue.put((self.root, 0))
+			pending = 1
+			while pending and not self.stop_event.is_set():
+				dir_path, entries, num_queued, error = result_queue.get()
+				pending += num_queued - 1
+				if error is not None:
+					if self.onerror is not None:
+						self.onerror(error)
+					continue
+				yield dir_path, entries
+		finally:
+			self.stop_event.set()
+			#Unblock any worker waiting to put a result and tell them all to exit
+			while True:
+				try:
+					result_queue.get_nowait()
+				except queue.Empty:
+					break
+			for thread in threads:
+				dir_queue.put(None)
+
+################################################################################
+###                               End of File                                ###
+################################################################################
\ No newline at end of file
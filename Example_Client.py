@@ -3,51 +3,217 @@
 ################################################################################
 import socket
 import threading
+import queue
+import collections
 import sys
+import argparse
+from Crust_Protocol import Frame_Reader, encode_frame, encode_control, encode_hello, decode_completion, CHANNEL_STDIN, CHANNEL_STDOUT, CHANNEL_STDERR, CHANNEL_CONTROL, CTRL_PROMPT, CTRL_EXIT, CTRL_HELLO, CTRL_COMPLETE, CTRL_FILE_OFFER
+from Crust_Transfer import Transfer_Client, RECV_BUFFER_SIZE
+from Crust_Lexer import lex_line, Syntax_Error
+try:
+	import readline
+except ImportError:
+	#Not available on windows, input is sent without line editing
+	readline = None
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+#How long to wait for the server to answer a completion (seconds)
+COMPLETE_TIMEOUT = 2.0
+#Characters that end the word readline completes
+COMPLETER_DELIMS = " \t\n;|&>"
+#Lines sent that the server may still ask to move files for
+MAX_PENDING_LINES = 16
 
 ################################################################################
 ###                             Helper Functions                             ###
 ################################################################################
-def server_rx(conn):
+def server_rx(conn, completions, transfers):
 	"""
 	PURPOSE: handles receiving data from the server
 	ARGS:
 		conn (socket): socket to server
+		completions (queue.Queue): where answers to completion requests are
+			put
+		transfers (Transfer_Client): handles 'get' and 'put'
 	RETURNS: none
 	NOTES: to be run in a separate thread
 	"""
+	reader = Frame_Reader(conn, RECV_BUFFER_SIZE)
+	stdout = sys.stdout.buffer
+	stderr = sys.stderr.buffer
 	while True:
-		#wait for input from client
-		data = conn.recv(1024)
-		if data == b'':
+		#wait for output from server
+		frame = reader.read_frame()
+		if frame is None:
 			#Socket died
 			break
 
-		sys.stdout.write(data.decode("ascii"))
-		sys.stdout.flush()
+		#Output is passed on as bytes, the terminal does the decoding
+		channel, payload = frame
+		if transfers.handle_frame(channel, payload):
+			continue
+		if channel == CHANNEL_STDOUT:
+			stdout.write(payload)
+		elif channel == CHANNEL_STDERR:
+			stdout.flush()
+			stderr.write(payload)
+			stderr.flush()
+		elif channel == CHANNEL_CONTROL and payload:
+			msg_type = payload[0]
+			if msg_type == CTRL_PROMPT:
+				stdout.write(payload[1:])
+				stdout.flush()
+			elif msg_type == CTRL_EXIT:
+				break
+			elif msg_type == CTRL_HELLO:
+				#Server agreed on a codec, what follows is compressed
+				reader.start_decompression(payload[1:].decode("ascii", "replace"))
+			elif msg_type == CTRL_COMPLETE:
+				completions.put(decode_completion(payload[1:]))
+	stdout.flush()
+
+################################################################################
+def make_transfer_check(sent_lines):
+	"""
+	PURPOSE: creates the check of which files the server may move
+	ARGS:
+		sent_lines (collections.deque): lines sent to the server, newest
+			last
+	RETURNS: (function) allowed function for Transfer_Client
+	NOTES: a file is only written for a 'get', or read for a 'put', that was
+		typed, and only under the name typed or, for 'get', the server's
+		name for it in this directory. Each line allows one transfer
+	"""
+	def allowed(msg_type, name):
+		cmd_name = "get" if msg_type == CTRL_FILE_OFFER else "put"
+		for line in list(sent_lines):
+			try:
+				cmds = lex_line(line)
+			except Syntax_Error:
+				continue
+			for cmd in cmds:
+				if cmd_name in cmd and (name is None or name in cmd):
+					sent_lines.remove(line)
+					return True
+		return False
+
+	return allowed
+
+################################################################################
+def make_completer(send, completions):
+	"""
+	PURPOSE: creates a readline completer that asks the server
+	ARGS:
+		send (function): sends bytes to the server
+		completions (queue.Queue): where server_rx puts the answers
+	RETURNS: (function) completer for readline.set_completer
+	NOTES: the server completes command names and paths in the session's
+		working directory. Nothing is offered while a command is running
+	"""
+	matches = []
+
+	def completer(text, state):
+		if state == 0:
+			del matches[:]
+			line = readline.get_line_buffer()[:readline.get_endidx()]
+			begin = readline.get_begidx()
+			#Drop answers to requests that timed out
+			while not completions.empty():
+				completions.get_nowait()
+			try:
+				send(encode_control(CTRL_COMPLETE, line.encode("utf-8", "surrogateescape")))
+				word_len, candidates = completions.get(timeout=COMPLETE_TIMEOUT)
+			except (OSError, queue.Empty):
+				return None
+			#Server replaces its own idea of the word, readline replaces
+			#from begin so line the candidates up with that
+			word_start = len(line) - word_len
+			for candidate in candidates:
+				if begin <= word_start:
+					matches.append(line[begin:word_start] + candidate)
+				elif candidate.startswith(line[word_start:begin]):
+					matches.append(candidate[begin - word_start:])
+			#Python's readline never adds a space after a completion, add
+			#one unless it is a directory so the next name can be completed
+			if len(matches) == 1 and not matches[0].endswith(("/", "\\")):
+				matches[0] += " "
+		if state < len(matches):
+			return matches[state]
+		return None
+
+	return completer
 
 ################################################################################
 ###                                  Main                                    ###
 ################################################################################
+parser = argparse.ArgumentParser(description="Connect to a Crust server")
+parser.add_argument("--host", default="127.0.0.1", help="address of the server")
+parser.add_argument("--port", type=int, default=30000, help="port of the server")
+parser.add_argument("--no-compress", action="store_true", help="do not ask the server to compress output")
+args = parser.parse_args()
+
 #Create socket
 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 print("Connecting to server...")
-sock.connect(("127.0.0.1", 30000))
+sock.connect((args.host, args.port))
+#Lines, completions and transfer messages are small and each is waited on
+sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+if not args.no_compress:
+	sock.sendall(encode_hello())
 print("Connected to server")
 print("Kill with 'ctrl-c' or 'ctrl-break'")
 
-rx_thread = threading.Thread(target=server_rx, args=(sock,), daemon=True)
+#The receive thread sends too while moving files
+send_lock = threading.Lock()
+def send(data):
+	with send_lock:
+		sock.sendall(data)
+sent_lines = collections.deque(maxlen=MAX_PENDING_LINES)
+transfers = Transfer_Client(sock, send_lock, make_transfer_check(sent_lines))
+
+#The receive thread writes bytes under the text layer, empty it first
+sys.stdout.flush()
+completions = queue.Queue()
+rx_thread = threading.Thread(target=server_rx, args=(sock, completions, transfers), daemon=True)
 rx_thread.start()
 
+#Tab completion needs readline and a terminal
+interactive = readline is not None and sys.stdin.isatty()
+if interactive:
+	readline.set_completer_delims(COMPLETER_DELIMS)
+	readline.set_completer(make_completer(send, completions))
+	if "libedit" in (readline.__doc__ or ""):
+		#macOS ships libedit in place of GNU readline
+		readline.parse_and_bind("bind ^I rl_complete")
+	else:
+		readline.parse_and_bind("tab: complete")
+
+#Input is sent as typed, bytes and all, the shell decodes it
 while True:
 	#Get user input
-	user_input = input() + "\n"
+	if interactive:
+		try:
+			user_input = (input() + "\n").encode("utf-8", "surrogateescape")
+		except EOFError:
+			user_input = b""
+	else:
+		user_input = sys.stdin.buffer.readline()
+	if not user_input:
+		user_input = b"exit\n"
+	elif not user_input.endswith(b"\n"):
+		user_input += b"\n"
 
-	sock.sendall(user_input.encode("ascii"))
+	sent_lines.append(user_input.decode("utf-8", "surrogateescape"))
+	send(encode_frame(CHANNEL_STDIN, user_input))
 
-	if user_input == "exit\n":
+	if user_input.rstrip(b"\r\n") == b"exit":
 		break
 
+#Let the last of the output arrive
+rx_thread.join()
+
 ################################################################################
 ###                               End of File                                ###
 ################################################################################
\ No newline at end of file
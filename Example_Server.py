@@ -1,84 +1,835 @@
 ################################################################################
 ###                                 Imports                                  ###
 ################################################################################
-from Crust import Crust
-import socket
+from Crust import Crust, FLUSH_LINE
+from Crust_Protocol import Channel_File, choose_codec, encode_completion, CHANNEL_STDOUT, CHANNEL_STDERR, CTRL_EXIT, CTRL_HELLO, CTRL_COMPLETE, DEFAULT_COMPRESS_LEVEL
+from Crust_Async import Async_Frame_Reader, Async_Frame_Writer, Async_Stdin_Reader, Async_Transfer_Link
+from Crust_Metrics import Session_Metrics
 import threading
+import asyncio
+import socket
+import select
 import os
-import time
 import sys
+import time
+import json
+import signal
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+try:
+	import resource
+except ImportError:
+	#Not available on windows
+	resource = None
+
+################################################################################
+###                                Constants                                 ###
+################################################################################
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 30000
+#Idle sessions only cost a socket and a coroutine so many can be connected
+DEFAULT_MAX_SESSIONS = 4096
+#Threads running commands, shared by every session
+DEFAULT_NUM_WORKERS = 32
+#How often the metrics file is rewritten (seconds)
+DEFAULT_METRICS_INTERVAL = 10.0
+#How long sessions get to finish when the server is stopped (seconds)
+DEFAULT_DRAIN_TIMEOUT = 30.0
+#Idle shells kept ready for new clients, at least min and at most max
+DEFAULT_POOL_MIN = 16
+DEFAULT_POOL_MAX = 256
+
+#Pre-forked worker processes
+#How often workers tell the master they are alive, and how long the master
+#waits without hearing from one before killing it (seconds)
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 10.0
+#How often the master checks on its workers (seconds)
+HEALTH_CHECK_INTERVAL = 0.5
+#A worker that dies sooner than this after starting is restarted only after
+#RESTART_DELAY so a crashing worker cannot fork in a tight loop (seconds)
+MIN_WORKER_LIFETIME = 1.0
+RESTART_DELAY = 1.0
+#Extra time draining workers get before they are killed (seconds)
+DRAIN_GRACE = 5.0
+
+#Metrics of running sessions by client address, and of every ended session
+SESSION_METRICS = {}
+ENDED_METRICS = Session_Metrics()
+METRICS_LOCK = threading.Lock()
+#Warm shells of this process, set while serving
+SESSION_POOL = None
 
 ################################################################################
 ###                             Helper Functions                             ###
 ################################################################################
-def client_rx(conn, fin):
+def raise_fd_limit():
+	"""
+	PURPOSE: raises the open file limit as far as allowed
+	ARGS:
+	RETURNS: (int) new soft limit, None if it cannot be changed
+	NOTES: every session holds a socket open
+	"""
+	if resource is None:
+		return None
+	try:
+		soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+		if hard != resource.RLIM_INFINITY and soft < hard:
+			resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+			soft = hard
+		return soft
+	except (OSError, ValueError):
+		return None
+
+################################################################################
+def dump_metrics():
+	"""
+	PURPOSE: gathers the metrics of every session
+	ARGS:
+	RETURNS: (dict) json serializable metrics of each running session and the
+		totals of all sessions since the server started
+	NOTES:
+	"""
+	with METRICS_LOCK:
+		running = list(SESSION_METRICS.items())
+		totals = Session_Metrics()
+		totals.merge(ENDED_METRICS)
+	sessions = {}
+	for addr, metrics in running:
+		sessions["%s:%d" % addr] = metrics.to_dict()
+		totals.merge(metrics)
+	dump = {
+		"time": time.time(),
+		"num_sessions": len(running),
+		"sessions": sessions,
+		"totals": totals.to_dict(),
+	}
+	if SESSION_POOL is not None:
+		dump["pool"] = SESSION_POOL.to_dict()
+	return dump
+
+################################################################################
+def write_metrics(metrics_file):
 	"""
-	PURPOSE: handles receiving data from a client
+	PURPOSE: writes the metrics of every session to a file as json
 	ARGS:
-		conn (socket): socket to client
-		fin (file-like object): file like object to write to
+		metrics_file (str): path to write to
 	RETURNS: none
-	NOTES: to be run in a separate thread
+	NOTES: written to a temporary file and swapped in so readers never see a
+		partial dump
+	"""
+	tmp_path = metrics_file + ".tmp"
+	with open(tmp_path, 'w') as fh:
+		json.dump(dump_metrics(), fh, indent=1, sort_keys=True)
+	os.replace(tmp_path, metrics_file)
+
+################################################################################
+def metrics_writer(metrics_file, interval, wake_event, stop_event):
+	"""
+	PURPOSE: rewrites the metrics file periodically
+	ARGS:
+		metrics_file (str): path to write to
+		interval (float): seconds between writes
+		wake_event (threading.Event): set to write right away
+		stop_event (threading.Event): set along with wake_event to stop
+			writing
+	RETURNS: none
+	NOTES: to be run in a separate thread. Writes one last time when stopped
 	"""
 	while True:
-		#wait for input from client
-		data = conn.recv(1024)
-		if data == b'':
-			#Socket died
+		wake_event.wait(interval)
+		wake_event.clear()
+		stopped = stop_event.is_set()
+		try:
+			write_metrics(metrics_file)
+		except OSError as e:
+			print("Could not write metrics to '%s': %s" % (metrics_file, e))
+		if stopped:
 			break
 
-		fin.write(data.decode("ascii"))
-		fin.flush()
+################################################################################
+def answer_completion(crust, writer, body):
+	"""
+	PURPOSE: answers a client's completion request
+	ARGS:
+		crust (Crust): shell of the session
+		writer (Frame_Writer): where the answer is sent
+		body (bytes): line up to the cursor
+	RETURNS: none
+	NOTES: lists directories so it is run on the executor, not the loop.
+		Nothing waits on its future, so a completion that fails is answered
+		with no candidates rather than leaving the client waiting
+	"""
+	try:
+		word_len, candidates = crust.complete(body.decode("utf-8", "surrogateescape"))
+	except Exception as e:
+		print("Completion failed: %s" % e)
+		word_len, candidates = 0, []
+	try:
+		writer.send_control(CTRL_COMPLETE, encode_completion(word_len, candidates))
+	except OSError:
+		#Client is gone
+		pass
 
 ################################################################################
-def client_tx(conn, fout):
+async def run_session(stream_reader, stream_writer, executor, pool, compress_level):
 	"""
-	PURPOSE: handles transmitting data to client
+	PURPOSE: runs one shell for a connected client
 	ARGS:
-		conn (socket): socket to client
-		fout (file-like object): file like object to read from
+		stream_reader (asyncio.StreamReader): stream from the client
+		stream_writer (asyncio.StreamWriter): stream to the client
+		executor (concurrent.futures.Executor): where commands are run
+		pool (Session_Pool): where the session's shell comes from and goes
+			back to
+		compress_level (int): zlib level for clients that ask for
+			compression, 0 to never compress
 	RETURNS: none
-	NOTES: to be run in a separate thread
+	NOTES: every session has its own Crust and therefore its own working
+		directory. While waiting for input a session holds no thread, only
+		its commands and completions run on the executor. Completion
+		requests are read while the shell waits for input. 'get' and 'put'
+		move files over the connection
+	"""
+	addr = stream_writer.get_extra_info("peername")[:2]
+	print("Running shell for %s:%d..." % addr)
+	loop = asyncio.get_running_loop()
+	writer = Async_Frame_Writer(stream_writer, loop)
+
+	def on_control(payload):
+		if payload[0] == CTRL_HELLO:
+			writer.answer_hello(choose_codec(payload[1:], compress_level), compress_level)
+		elif payload[0] == CTRL_COMPLETE:
+			loop.run_in_executor(executor, answer_completion, crust, writer, payload[1:])
+
+	shell_fin = Async_Stdin_Reader(Async_Frame_Reader(stream_reader), on_control)
+	shell_fout = Channel_File(writer, CHANNEL_STDOUT)
+	shell_ferr = Channel_File(writer, CHANNEL_STDERR)
+	crust = pool.acquire(shell_fout, shell_ferr)
+	crust.transfer_link = Async_Transfer_Link(writer, shell_fin, stream_writer, loop)
+	with METRICS_LOCK:
+		SESSION_METRICS[addr] = crust.metrics
+	#run shell
+	reusable = False
+	try:
+		await crust.run_async(shell_fin, executor)
+		writer.send_control(CTRL_EXIT)
+		reusable = True
+	except (OSError, ValueError):
+		#Client went away mid command or sent garbage, a command may still
+		#be running in the shell so it is not reused
+		pass
+	finally:
+		with METRICS_LOCK:
+			SESSION_METRICS.pop(addr, None)
+			ENDED_METRICS.merge(crust.metrics)
+		if reusable:
+			pool.release(crust)
+		try:
+			writer.close()
+		except OSError:
+			pass
+		stream_writer.close()
+		try:
+			await stream_writer.wait_closed()
+		except OSError:
+			pass
+	print("Client %s:%d disconnected" % addr)
+
+################################################################################
+def make_listen_socket(host, port, reuse_port=False):
+	"""
+	PURPOSE: creates a listening socket
+	ARGS:
+		host (str): address to listen on
+		port (int): port to listen on
+		reuse_port (bool): true to set SO_REUSEPORT so several processes can
+			listen on the port and have the kernel spread connections
+			between them
+	RETURNS: (socket) non blocking listening socket
+	NOTES:
+	"""
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	try:
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if reuse_port:
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		sock.bind((host, port))
+		sock.listen(1024)
+		sock.setblocking(False)
+	except OSError:
+		sock.close()
+		raise
+	return sock
+
+################################################################################
+async def send_heartbeats(heartbeat_fd, stop_event):
+	"""
+	PURPOSE: tells the master process this worker's event loop is alive
+	ARGS:
+		heartbeat_fd (int): non blocking pipe to the master
+		stop_event (asyncio.Event): set to drain the worker if the master
+			goes away
+	RETURNS: none
+	NOTES: a loop that is stuck stops sending and gets restarted
 	"""
 	while True:
-		c = fout.read(1)
-		conn.send(c.encode("ascii"))
+		try:
+			os.write(heartbeat_fd, b'.')
+		except BlockingIOError:
+			#Master is behind on reading, it has heard from us recently
+			pass
+		except OSError:
+			#Master is gone, nothing will restart us so wind down
+			stop_event.set()
+			return
+		await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+################################################################################
+async def serve_async(host=DEFAULT_HOST, port=DEFAULT_PORT, max_sessions=DEFAULT_MAX_SESSIONS, metrics_file=None, metrics_interval=DEFAULT_METRICS_INTERVAL, num_workers=DEFAULT_NUM_WORKERS, drain_timeout=DEFAULT_DRAIN_TIMEOUT, pool_min=DEFAULT_POOL_MIN, pool_max=DEFAULT_POOL_MAX, compress_level=DEFAULT_COMPRESS_LEVEL, sock=None, heartbeat_fd=None):
+	"""
+	PURPOSE: accepts clients and runs a shell for each of them at the same time
+	ARGS:
+		see serve()
+		sock (socket): listening socket to use instead of host and port
+		heartbeat_fd (int): pipe to send heartbeats to the master process
+			on, None when not a worker process
+	RETURNS: none
+	NOTES: runs until cancelled, or until SIGTERM after draining. Draining
+		stops accepting clients and waits up to drain_timeout for the
+		connected sessions to end before hanging up on them
+	"""
+	global SESSION_POOL
+	loop = asyncio.get_running_loop()
+	executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="crust-cmd")
+	pool = Session_Pool(pool_min, pool_max)
+	pool.fill()
+	SESSION_POOL = pool
+	session_slots = asyncio.Semaphore(max_sessions)
+	sessions = set()
+	stop_event = asyncio.Event()
+
+	async def handle_client(stream_reader, stream_writer):
+		task = asyncio.current_task()
+		sessions.add(task)
+		try:
+			async with session_slots:
+				await run_session(stream_reader, stream_writer, executor, pool, compress_level)
+		finally:
+			sessions.discard(task)
+
+	if sock is None:
+		server = await asyncio.start_server(handle_client, host, port, reuse_address=True, backlog=1024)
+	else:
+		server = await asyncio.start_server(handle_client, sock=sock)
+	print("Starting server on %s:%d (pid %d)..." % (host, port, os.getpid()))
+	if heartbeat_fd is None:
+		print("Kill with 'ctrl-c' or 'ctrl-break', drain with SIGTERM")
+
+	#Dump metrics periodically and on request
+	metrics_thread = None
+	metrics_wake = threading.Event()
+	metrics_stop = threading.Event()
+	if metrics_file:
+		metrics_thread = threading.Thread(target=metrics_writer, args=(metrics_file, metrics_interval, metrics_wake, metrics_stop), daemon=True)
+		metrics_thread.start()
+		if hasattr(signal, "SIGUSR1"):
+			loop.add_signal_handler(signal.SIGUSR1, metrics_wake.set)
+	if hasattr(signal, "SIGTERM"):
+		try:
+			loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+		except NotImplementedError:
+			#Not supported by the windows event loop
+			pass
+	heartbeat_task = None
+	if heartbeat_fd is not None:
+		heartbeat_task = asyncio.ensure_future(send_heartbeats(heartbeat_fd, stop_event))
+
+	try:
+		await stop_event.wait()
+		#Drain, stop taking clients and give the sessions time to finish
+		server.close()
+		if sessions:
+			print("Draining %d sessions (pid %d)..." % (len(sessions), os.getpid()))
+			await asyncio.wait(list(sessions), timeout=drain_timeout)
+	finally:
+		#Sessions still connected are cancelled, which hangs up on their
+		#clients. Commands still running stop the next time they write
+		server.close()
+		if heartbeat_task is not None:
+			heartbeat_task.cancel()
+		for task in list(sessions):
+			task.cancel()
+		if sessions:
+			await asyncio.wait(list(sessions), timeout=DRAIN_GRACE)
+		executor.shutdown(wait=False, cancel_futures=True)
+		if metrics_thread is not None:
+			metrics_stop.set()
+			metrics_wake.set()
+			metrics_thread.join()
+
+################################################################################
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_sessions=DEFAULT_MAX_SESSIONS, metrics_file=None, metrics_interval=DEFAULT_METRICS_INTERVAL, num_workers=DEFAULT_NUM_WORKERS, drain_timeout=DEFAULT_DRAIN_TIMEOUT, num_processes=1, pool_min=DEFAULT_POOL_MIN, pool_max=DEFAULT_POOL_MAX, compress_level=DEFAULT_COMPRESS_LEVEL):
+	"""
+	PURPOSE: accepts clients and runs a shell for each of them at the same time
+	ARGS:
+		host (str): address to listen on
+		port (int): port to listen on
+		max_sessions (int): max number of connected shells per process,
+			clients past this wait until a session ends
+		metrics_file (str): path to dump the metrics of every session to as
+			json, None to not dump them. Worker processes each dump to the
+			path with '.N' added, N being the worker's number
+		metrics_interval (float): seconds between metrics dumps
+		num_workers (int): max number of commands running at once across
+			every session of a process
+		drain_timeout (float): seconds sessions get to finish when the
+			server is stopped with SIGTERM
+		num_processes (int): number of worker processes to pre-fork, 1 to
+			serve from this process
+		pool_min (int): warm shells each process keeps ready for new
+			clients
+		pool_max (int): max shells each process keeps for reuse after their
+			clients disconnect
+		compress_level (int): zlib level (1-9) used for clients that offer
+			compression when they connect, 0 to never compress
+	RETURNS: none
+	NOTES: runs until interrupted. SIGUSR1 dumps the metrics right away
+	"""
+	raise_fd_limit()
+	kwargs = {
+		"host": host,
+		"port": port,
+		"max_sessions": max_sessions,
+		"metrics_file": metrics_file,
+		"metrics_interval": metrics_interval,
+		"num_workers": num_workers,
+		"drain_timeout": drain_timeout,
+		"pool_min": pool_min,
+		"pool_max": pool_max,
+		"compress_level": compress_level,
+	}
+	if num_processes > 1:
+		Prefork_Master(num_processes, kwargs).run()
+	else:
+		asyncio.run(serve_async(**kwargs))
+
+################################################################################
+###                                Class Def                                 ###
+################################################################################
+class Session_Pool:
+	"""
+	Shells made ahead of time and reused so a client gets its prompt without
+	waiting for a new one to be built
+	"""
+	############################################################################
+	def __init__(self, min_size=DEFAULT_POOL_MIN, max_size=DEFAULT_POOL_MAX):
+		"""
+		PURPOSE: creates a new Session_Pool
+		ARGS:
+			min_size (int): idle shells to keep ready, topped back up after
+				clients take them
+			max_size (int): max idle shells kept, shells given back past this
+				are dropped
+		RETURNS: new instance of a Session_Pool
+		NOTES: only used from the event loop's thread. The pool starts empty,
+			call fill() to warm it
+		"""
+		#Save arguments
+		self.min_size = max(0, min_size)
+		self.max_size = max(self.min_size, max_size)
+
+		#Define properties
+		self.idle = []
+		self.fill_pending = False
+		self.hits = 0
+		self.misses = 0
+		self.recycled = 0
+		self.dropped = 0
+
+	############################################################################
+	def new_shell(self):
+		"""
+		PURPOSE: builds a shell that is not connected to anything yet
+		ARGS:
+		RETURNS: (Crust) the shell
+		NOTES: channel files coalesce frames themselves so the shell's buffer
+			only flushes on newlines, which keeps output like 'locate'
+			streaming
+		"""
+		return Crust(None, None, None, flush_policy=FLUSH_LINE)
+
+	############################################################################
+	def fill(self):
+		"""
+		PURPOSE: tops the pool back up to min_size idle shells
+		ARGS:
+		RETURNS: none
+		NOTES:
+		"""
+		self.fill_pending = False
+		while len(self.idle) < self.min_size:
+			self.idle.append(self.new_shell())
+
+	############################################################################
+	def acquire(self, fout, ferr):
+		"""
+		PURPOSE: gets a shell for a new client
+		ARGS:
+			fout (file-like object): where the shell's output goes
+			ferr (file-like object): where the shell's error output goes
+		RETURNS: (Crust) shell in the state of a new one
+		NOTES: a new shell is built if none are idle. Refilling is left until
+			the loop is done with the connection
+		"""
+		if self.idle:
+			self.hits += 1
+			crust = self.idle.pop()
+		else:
+			self.misses += 1
+			crust = self.new_shell()
+		crust.reset(None, fout, ferr)
+		if len(self.idle) < self.min_size and not self.fill_pending:
+			self.fill_pending = True
+			asyncio.get_running_loop().call_soon(self.fill)
+		return crust
+
+	############################################################################
+	def release(self, crust):
+		"""
+		PURPOSE: takes back the shell of a client that disconnected
+		ARGS:
+			crust (Crust): shell to reuse, must not be running a command
+		RETURNS: none
+		NOTES: the shell is reset right away so it lets go of the client's
+			connection and kills any jobs it left behind
+		"""
+		crust.reset(None, None, None)
+		if len(self.idle) < self.max_size:
+			self.recycled += 1
+			self.idle.append(crust)
+		else:
+			self.dropped += 1
+
+	############################################################################
+	def to_dict(self):
+		"""
+		PURPOSE: converts the pool's counters to plain data
+		ARGS:
+		RETURNS: (dict) json serializable counters
+		NOTES: a hit is a client given an idle shell, a miss one that had to
+			wait for a new shell to be built
+		"""
+		return {
+			"idle": len(self.idle),
+			"min_size": self.min_size,
+			"max_size": self.max_size,
+			"hits": self.hits,
+			"misses": self.misses,
+			"recycled": self.recycled,
+			"dropped": self.dropped,
+		}
+
+################################################################################
+class Worker_Process:
+	"""
+	Bookkeeping for one pre-forked worker process
+	"""
+	############################################################################
+	def __init__(self, index, pid, heartbeat_fd):
+		"""
+		PURPOSE: creates a new Worker_Process
+		ARGS:
+			index (int): number of the worker, kept across restarts
+			pid (int): process id
+			heartbeat_fd (int): read end of the worker's heartbeat pipe
+		RETURNS: new instance of a Worker_Process
+		NOTES:
+		"""
+		#Save arguments
+		self.index = index
+		self.pid = pid
+		self.heartbeat_fd = heartbeat_fd
+
+		#Define properties
+		self.started = time.monotonic()
+		self.last_beat = self.started
+		#Set once the worker has been told to drain, it is not restarted
+		self.drain_deadline = None
+
+################################################################################
+class Prefork_Master:
+	"""
+	Forks worker processes that each run the server, and keeps them running
+	"""
+	############################################################################
+	def __init__(self, num_processes, serve_kwargs):
+		"""
+		PURPOSE: creates a new Prefork_Master
+		ARGS:
+			num_processes (int): number of worker processes to keep running
+			serve_kwargs (dict): arguments for serve_async in each worker
+		RETURNS: new instance of a Prefork_Master
+		NOTES: every worker runs its own event loop and command threads so
+			sessions spread over every core instead of sharing one GIL.
+			With SO_REUSEPORT each worker listens on its own socket and the
+			kernel balances connections, otherwise they share one socket
+			made before forking
+		"""
+		#Save arguments
+		self.num_processes = max(1, num_processes)
+		self.serve_kwargs = serve_kwargs
+
+		#Define properties
+		self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+		self.shared_sock = None
+		self.workers = {}
+		self.pending_restarts = []
+		self.stopping = False
+		self.reloading = False
+		self.forward_usr1 = False
+
+	############################################################################
+	def spawn(self, index):
+		"""
+		PURPOSE: forks a worker process
+		ARGS:
+			index (int): number of the worker
+		RETURNS: none
+		NOTES: the child never returns from this
+		"""
+		heartbeat_r, heartbeat_w = os.pipe()
+		#Anything still buffered would be written by both processes
+		sys.stdout.flush()
+		sys.stderr.flush()
+		pid = os.fork()
+		if pid == 0:
+			#Child, the master's signal handlers and pipes are not its business
+			os.close(heartbeat_r)
+			for worker in self.workers.values():
+				os.close(worker.heartbeat_fd)
+			signal.signal(signal.SIGINT, signal.SIG_IGN)
+			signal.signal(signal.SIGHUP, signal.SIG_IGN)
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+			os.set_blocking(heartbeat_w, False)
+			status = 0
+			try:
+				kwargs = dict(self.serve_kwargs)
+				if kwargs["metrics_file"]:
+					kwargs["metrics_file"] = "%s.%d" % (kwargs["metrics_file"], index)
+				if self.reuse_port:
+					kwargs["sock"] = make_listen_socket(kwargs["host"], kwargs["port"], reuse_port=True)
+				else:
+					kwargs["sock"] = self.shared_sock
+				asyncio.run(serve_async(heartbeat_fd=heartbeat_w, **kwargs))
+			except BaseException as e:
+				print("Worker %d (pid %d) failed: %s" % (index, os.getpid(), e))
+				status = 1
+			finally:
+				sys.stdout.flush()
+				sys.stderr.flush()
+				os._exit(status)
+
+		os.close(heartbeat_w)
+		os.set_blocking(heartbeat_r, False)
+		self.workers[pid] = Worker_Process(index, pid, heartbeat_r)
+		print("Started worker %d (pid %d)" % (index, pid))
+
+	############################################################################
+	def drain(self, worker):
+		"""
+		PURPOSE: asks a worker to finish its sessions and exit
+		ARGS:
+			worker (Worker_Process): worker to drain
+		RETURNS: none
+		NOTES: it is killed if it takes longer than its drain timeout
+		"""
+		if worker.drain_deadline is not None:
+			return
+		worker.drain_deadline = time.monotonic() + self.serve_kwargs["drain_timeout"] + DRAIN_GRACE
+		try:
+			os.kill(worker.pid, signal.SIGTERM)
+		except OSError:
+			pass
+
+	############################################################################
+	def read_heartbeats(self, timeout):
+		"""
+		PURPOSE: waits for heartbeats from the workers
+		ARGS:
+			timeout (float): max seconds to wait
+		RETURNS: none
+		NOTES:
+		"""
+		fds = dict((worker.heartbeat_fd, worker) for worker in self.workers.values())
+		if not fds:
+			time.sleep(timeout)
+			return
+		try:
+			ready, _, _ = select.select(list(fds), [], [], timeout)
+		except InterruptedError:
+			return
+		now = time.monotonic()
+		for fd in ready:
+			try:
+				if os.read(fd, 4096):
+					fds[fd].last_beat = now
+			except BlockingIOError:
+				pass
+			except OSError:
+				pass
+
+	############################################################################
+	def reap(self):
+		"""
+		PURPOSE: notices workers that exited and arranges restarts
+		ARGS:
+		RETURNS: none
+		NOTES: a worker that was not asked to drain is restarted
+		"""
+		while self.workers:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				return
+			if pid == 0:
+				return
+			worker = self.workers.pop(pid, None)
+			if worker is None:
+				continue
+			os.close(worker.heartbeat_fd)
+			if worker.drain_deadline is not None or self.stopping:
+				print("Worker %d (pid %d) exited" % (worker.index, pid))
+				continue
+			print("Worker %d (pid %d) died with status %d, restarting" % (worker.index, pid, os.waitstatus_to_exitcode(status)))
+			restart_at = time.monotonic()
+			if restart_at - worker.started < MIN_WORKER_LIFETIME:
+				restart_at += RESTART_DELAY
+			self.pending_restarts.append((restart_at, worker.index))
+
+	############################################################################
+	def check_health(self):
+		"""
+		PURPOSE: kills workers that stopped sending heartbeats or took too
+			long to drain
+		ARGS:
+		RETURNS: none
+		NOTES: killed workers are restarted by reap() unless draining
+		"""
+		now = time.monotonic()
+		for worker in list(self.workers.values()):
+			if worker.drain_deadline is not None:
+				overdue = now > worker.drain_deadline
+			else:
+				overdue = now - worker.last_beat > HEARTBEAT_TIMEOUT
+				if overdue:
+					print("Worker %d (pid %d) stopped responding, killing it" % (worker.index, worker.pid))
+			if overdue:
+				try:
+					os.kill(worker.pid, signal.SIGKILL)
+				except OSError:
+					pass
+
+	############################################################################
+	def run(self):
+		"""
+		PURPOSE: starts the workers and looks after them until stopped
+		ARGS:
+		RETURNS: none
+		NOTES: SIGINT or SIGTERM drains every worker and exits once they are
+			gone. SIGHUP replaces every worker with a new one, draining the
+			old ones, for picking up new code without dropping sessions.
+			SIGUSR1 is passed on to every worker
+		"""
+		host = self.serve_kwargs["host"]
+		port = self.serve_kwargs["port"]
+		#With SO_REUSEPORT this only reserves the port and fails early if it
+		#is taken, it never listens so it is never given a connection
+		if self.reuse_port:
+			self.shared_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self.shared_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			self.shared_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+			self.shared_sock.bind((host, port))
+		else:
+			self.shared_sock = make_listen_socket(host, port)
+		print("Starting %d workers on %s:%d..." % (self.num_processes, host, port))
+		print("Kill with 'ctrl-c' or SIGTERM, replace workers with SIGHUP")
+
+		def on_stop(signum, frame):
+			self.stopping = True
+		def on_reload(signum, frame):
+			self.reloading = True
+		def on_usr1(signum, frame):
+			self.forward_usr1 = True
+		signal.signal(signal.SIGINT, on_stop)
+		signal.signal(signal.SIGTERM, on_stop)
+		signal.signal(signal.SIGHUP, on_reload)
+		signal.signal(signal.SIGUSR1, on_usr1)
+
+		for index in range(self.num_processes):
+			self.spawn(index)
+
+		stop_sent = False
+		while self.workers or (self.pending_restarts and not self.stopping):
+			if self.stopping and not stop_sent:
+				print("Draining workers...")
+				for worker in list(self.workers.values()):
+					self.drain(worker)
+				stop_sent = True
+			if self.reloading and not self.stopping:
+				self.reloading = False
+				print("Replacing workers...")
+				for worker in list(self.workers.values()):
+					if worker.drain_deadline is None:
+						self.spawn(worker.index)
+						self.drain(worker)
+			if self.forward_usr1:
+				self.forward_usr1 = False
+				for worker in self.workers.values():
+					try:
+						os.kill(worker.pid, signal.SIGUSR1)
+					except OSError:
+						pass
+
+			self.read_heartbeats(HEALTH_CHECK_INTERVAL)
+			self.reap()
+			self.check_health()
+
+			now = time.monotonic()
+			if not self.stopping:
+				for restart in [r for r in self.pending_restarts if r[0] <= now]:
+					self.pending_restarts.remove(restart)
+					self.spawn(restart[1])
+		self.shared_sock.close()
 
 ################################################################################
 ###                                  Main                                    ###
 ################################################################################
-#Create socket
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.bind(("127.0.0.1", 30000))
-sock.listen(5)
-print("Starting server...")
-print("Kill with 'ctrl-c' or 'ctrl-break'")
-
-#Listen for connections
-my_threads = []
-while True:
-	#Wait for connection
-	print("Waiting for client...")
-	clientsock, addr = sock.accept()
-
-	#Create a new shell
-	r, w = os.pipe()
-	shell_fin_r = os.fdopen(r, 'r')
-	shell_fin_w = os.fdopen(w, 'w')
-	r, w = os.pipe()
-	shell_fout_r = os.fdopen(r, 'r')
-	shell_fout_w = os.fdopen(w, 'w')
-	#write fout and ferr to the same place for now
-	crust = Crust(shell_fin_r, shell_fout_w, shell_fout_w)
-	#start thread to handle transmitting output to client
-	tx_thread = threading.Thread(target=client_tx, args=(clientsock, shell_fout_r), daemon=True)
-	tx_thread.start()
-	#start thread to handle receiving input from client and passing to the shell
-	rx_thread = threading.Thread(target=client_rx, args=(clientsock, shell_fin_w), daemon=True)
-	rx_thread.start()
-	#run shell
-	print("Running shell...")
-	crust.run()
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serve Crust shells over TCP")
+	parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on")
+	parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+	parser.add_argument("--max-sessions", type=int, default=DEFAULT_MAX_SESSIONS, help="max number of connected shells")
+	parser.add_argument("--workers", type=int, default=DEFAULT_NUM_WORKERS, help="max number of commands running at once")
+	parser.add_argument("--metrics-file", help="file to dump the metrics of every session to as json")
+	parser.add_argument("--metrics-interval", type=float, default=DEFAULT_METRICS_INTERVAL, help="seconds between metrics dumps")
+	parser.add_argument("--processes", type=int, default=1, help="worker processes to pre-fork, 0 for one per core")
+	parser.add_argument("--drain-timeout", type=float, default=DEFAULT_DRAIN_TIMEOUT, help="seconds sessions get to finish when stopping")
+	parser.add_argument("--pool-min", type=int, default=DEFAULT_POOL_MIN, help="warm shells kept ready for new clients")
+	parser.add_argument("--pool-max", type=int, default=DEFAULT_POOL_MAX, help="max shells kept for reuse after clients disconnect")
+	parser.add_argument("--compress-level", type=int, default=DEFAULT_COMPRESS_LEVEL, choices=range(10), metavar="{0-9}", help="zlib level for clients that ask for compression, 0 to never compress")
+	args = parser.parse_args()
+	if args.pool_min < 0 or args.pool_max < args.pool_min:
+		parser.error("--pool-max must be at least --pool-min, which must not be negative")
+	num_processes = args.processes
+	if num_processes <= 0:
+		num_processes = os.cpu_count() or 1
+	if num_processes > 1 and not hasattr(os, "fork"):
+		parser.error("--processes needs os.fork, which is not available here")
+	try:
+		serve(args.host, args.port, args.max_sessions, args.metrics_file, args.metrics_interval, args.workers, args.drain_timeout, num_processes, args.pool_min, args.pool_max, args.compress_level)
+	except KeyboardInterrupt:
+		pass
 
 ################################################################################
 ###                               End of File                                ###